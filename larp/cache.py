@@ -0,0 +1,152 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from os import PathLike
+from typing import List, Optional, Union
+import numpy as np
+from larp.field import PotentialField
+from larp.quad import QuadTree
+from larp.network import RoutingNetwork
+import larp.io as lpio
+
+"""
+Author: Josue N Rivera
+Content-addressed cache of built quadtrees and routing networks
+"""
+
+CACHE_VERSION = 1 # bump when the bundle format or the build output changes
+
+def __to_json__(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+class BuildCache():
+    """
+    Keeps built trees (and networks) in a local directory, one bundle per key. A key is the sha256 of the
+    field's RGeoJSON, center and size, and the build parameters, so any change to them builds anew
+    """
+
+    def __init__(self, directory:Union[str, PathLike]) -> None:
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, field:PotentialField,
+            minimum_length_limit:float = 5.0,
+            maximum_length_limit:float = np.inf,
+            edge_bounds:Union[np.ndarray, List[float]] = np.arange(0.2, 0.8, 0.2),
+            size:Optional[float] = None,
+            conservative:bool = False) -> str:
+        
+        content = {
+            'version': CACHE_VERSION,
+            'field': field.toRGeoJSON(),
+            'center_point': field.center_point,
+            'field_size': field.size,
+            'minimum_length_limit': float(minimum_length_limit),
+            'maximum_length_limit': float(maximum_length_limit),
+            'edge_bounds': np.sort(np.array(edge_bounds, dtype=float))[::-1],
+            'size': None if size is None else float(size),
+            'conservative': bool(conservative)
+        }
+
+        text = json.dumps(content, sort_keys=True, default=__to_json__)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def path(self, key:str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key:str) -> bool:
+        return os.path.exists(os.path.join(self.path(key), "meta.json"))
+
+    def __store__(self, key:str, tree:QuadTree, network:Optional[RoutingNetwork] = None) -> None:
+        """
+        Writes the bundle next to its final place and moves it there at once, so readers never see it partially written
+        """
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        try:
+            lpio.saveQuadTreeBundle(tree, staging)
+            if network is not None:
+                lpio.saveRoutingNetwork(network, staging)
+
+            if os.path.exists(self.path(key)):
+                shutil.rmtree(self.path(key)) # stale entry missing the network
+            os.replace(staging, self.path(key))
+        except OSError as error:
+            # another process stored the same key meanwhile
+            if error.errno not in (errno.ENOTEMPTY, errno.EEXIST) or key not in self:
+                raise
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def quadtree(self, field:PotentialField,
+                 minimum_length_limit:float = 5.0,
+                 maximum_length_limit:float = np.inf,
+                 edge_bounds:Union[np.ndarray, List[float]] = np.arange(0.2, 0.8, 0.2),
+                 size:Optional[float] = None,
+                 conservative:bool = False) -> QuadTree:
+        """
+        Built quadtree of the field, loaded from the cache on a hit and built then stored on a miss
+        """
+        key = self.key(field, minimum_length_limit, maximum_length_limit, edge_bounds, size, conservative)
+
+        if key in self:
+            return lpio.loadQuadTreeBundle(self.path(key), field=field)
+
+        tree = QuadTree(field,
+                        minimum_length_limit=minimum_length_limit,
+                        maximum_length_limit=maximum_length_limit,
+                        edge_bounds=edge_bounds,
+                        size=size,
+                        conservative=conservative,
+                        build_tree=True)
+        self.__store__(key, tree)
+
+        return tree
+
+    def network(self, field:PotentialField,
+                minimum_length_limit:float = 5.0,
+                maximum_length_limit:float = np.inf,
+                edge_bounds:Union[np.ndarray, List[float]] = np.arange(0.2, 0.8, 0.2),
+                size:Optional[float] = None,
+                conservative:bool = False) -> RoutingNetwork:
+        """
+        Built routing network (and quadtree, as network.quadtree) of the field, from the cache on a hit
+        """
+        key = self.key(field, minimum_length_limit, maximum_length_limit, edge_bounds, size, conservative)
+
+        if os.path.exists(os.path.join(self.path(key), "network.json")):
+            tree = lpio.loadQuadTreeBundle(self.path(key), field=field)
+            return lpio.loadRoutingNetwork(self.path(key), quadtree=tree)
+
+        if key in self:
+            tree = lpio.loadQuadTreeBundle(self.path(key), field=field)
+        else:
+            tree = QuadTree(field,
+                            minimum_length_limit=minimum_length_limit,
+                            maximum_length_limit=maximum_length_limit,
+                            edge_bounds=edge_bounds,
+                            size=size,
+                            conservative=conservative,
+                            build_tree=True)
+        network = RoutingNetwork(tree, build_network=True)
+        self.__store__(key, tree, network)
+
+        return network
+
+    def clear(self) -> None:
+        """
+        Removes every cached bundle, with any stray file or leftover staging directory
+        """
+        for entry in os.listdir(self.directory):
+            path = os.path.join(self.directory, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
@@ -1,8 +1,10 @@
-from typing import List, Optional, Tuple, Union
+from __future__ import annotations
+from typing import Dict, List, Optional, Tuple, Union
 import warnings
 
 import numpy as np
 import larp.fn as lpf
+from larp.index import BBoxIndex, PointTreeIndex
 from larp.types import FieldScaleTransform, RGJDict, FieldSize, Point, RGeoJSONCollection, RGeoJSONObject, RepulsionVectorsAndRef
 
 """
@@ -11,31 +13,76 @@ Author: Josue N Rivera
 x are assumed to be a list of point coordinates in euclidean space
 """
 
+def __batch_slices__(n:int, elements:int, max_bytes:int, dim:int = 2, itemsize:int = 8):
+    """
+    Yields slices over n points so that a (points x elements x dim) buffer stays under max_bytes
+    """
+    step = max(1, int(max_bytes) // max(1, elements*dim*itemsize))
+    for start in range(0, n, step):
+        yield slice(start, min(start + step, n))
+
+def __segment_meets_ellipses__(a:np.ndarray, b:np.ndarray, centers:np.ndarray, inv_shapes:np.ndarray) -> np.ndarray:
+    """
+    Whether each segment a -> b (n x 2) touches each ellipse (m), as n x m
+    """
+    y0 = np.einsum('mij,nmj->nmi', inv_shapes, a[:, None] - centers)
+    dy = np.einsum('mij,nj->nmi', inv_shapes, b - a)
+
+    # closest point to the origin of y0 + t*dy for t in [0, 1]
+    den = (dy*dy).sum(-1)
+    t = np.clip(np.divide(-(y0*dy).sum(-1), den, out=np.zeros_like(den), where=den > 0.0), 0.0, 1.0)
+    y = y0 + t[..., None]*dy
+
+    return (y*y).sum(-1) <= 1.0
+
+REPULSION_CACHE_SIZE = 4096 # distinct repulsion matrices whose derived matrices are kept for sharing
+__REPULSION_PROFILES__:Dict[Tuple[str, Tuple[int, ...], bytes], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = {}
+
+def __repulsion_profile__(repulsion:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns read-only (repulsion, inverse repulsion, identity, gradient matrix), shared by every RGJ with an equal repulsion
+    """
+    repulsion = np.array(repulsion)
+    key = (repulsion.dtype.str, repulsion.shape, repulsion.tobytes())
+
+    profile = __REPULSION_PROFILES__.get(key)
+    if profile is None:
+        inv_repulsion = np.linalg.inv(repulsion)
+        profile = (repulsion, inv_repulsion, np.eye(len(repulsion)), inv_repulsion + inv_repulsion.T)
+        for matrix in profile:
+            matrix.setflags(write=False)
+
+        if len(__REPULSION_PROFILES__) < REPULSION_CACHE_SIZE:
+            __REPULSION_PROFILES__[key] = profile
+
+    return profile
+
+def __points_bbox__(points:np.ndarray) -> np.ndarray:
+    points = points.reshape(-1, 2)
+    if len(points) == 1:
+        return np.repeat(points, 2, axis=0)
+    
+    return np.array([points.min(0), points.max(0)])
+
 class RGJGeometry():
+    __slots__ = ('coordinates', 'repulsion', 'inv_repulsion', 'eye_repulsion', 'grad_matrix', 'properties', 'bbox')
 
     RGJType = None
+    MAX_BATCH_BYTES = 2**26 # memory cap for (points x elements x 2) intermediates of batched kernels
 
     def __init__(self, coordinates:Union[np.ndarray, List[Point], List[List[Point]], Point], repulsion:Optional[np.ndarray] = None, properties:Optional[dict] = None, optional_dim = 2, **kwargs) -> None:
         self.coordinates = np.array(coordinates)
-        self.repulsion = np.eye(optional_dim) if repulsion is None else np.array(repulsion)
-        self.inv_repulsion = np.linalg.inv(self.repulsion)
-        self.eye_repulsion = np.eye(len(self.repulsion))
+        self.repulsion, self.inv_repulsion, self.eye_repulsion, self.grad_matrix = __repulsion_profile__(np.eye(optional_dim) if repulsion is None else repulsion)
         self.properties = {} if properties is None else properties
-        self.grad_matrix = self.inv_repulsion + self.inv_repulsion.T
         
-        bbox = self.coordinates.reshape(-1, 2)
-        self.bbox = np.array([bbox.min(0), bbox.max(0)])
+        self.bbox = __points_bbox__(self.coordinates)
 
     def set_coordinates(self, new_coords):
         self.coordinates = np.array(new_coords)
-        bbox = self.coordinates.reshape(-1, 2)
-        self.bbox = np.array([bbox.min(0), bbox.max(0)])
+        self.bbox = __points_bbox__(self.coordinates)
 
     def set_repulsion(self, new_repulsion):
-        self.repulsion = np.array(new_repulsion)
-        self.inv_repulsion = np.linalg.inv(self.repulsion)
-        self.eye_repulsion = np.eye(len(self.repulsion))
-        self.grad_matrix = self.inv_repulsion + self.inv_repulsion.T
+        self.repulsion, self.inv_repulsion, self.eye_repulsion, self.grad_matrix = __repulsion_profile__(new_repulsion)
 
     def get_dist_matrix(self, scaled=True, inverted=True):
 
@@ -63,6 +110,98 @@ class RGJGeometry():
 
         return False
 
+    def support_bbox(self) -> np.ndarray:
+        """
+        Box containing every location where the repulsion vector is zero
+        """
+        bbox = np.reshape(self.bbox, (-1, 2))
+        return np.array([bbox.min(0), bbox.max(0)])
+
+    def influence_radius(self, tolerance:float) -> np.ndarray:
+        """
+        Per-axis offset from the geometry beyond which the potential is below tolerance
+        """
+        sqr_radius = max(-np.log(tolerance), 0.0)
+        matrix = self.get_dist_matrix(scaled=True, inverted=True)
+
+        return np.sqrt(sqr_radius*np.diag(np.linalg.inv((matrix + matrix.T)/2.0)))
+
+    def influence_bbox(self, tolerance:float) -> np.ndarray:
+        """
+        Box outside of which the potential is below tolerance
+        """
+        bbox = self.support_bbox()
+        radius = self.influence_radius(tolerance)
+
+        return np.array([bbox[0] - radius, bbox[1] + radius])
+
+    def length_scale(self) -> float:
+        """
+        Shortest distance, over all directions, across which the squared distance grows by one
+        """
+        matrix = self.get_dist_matrix(scaled=True, inverted=True)
+        return 1.0/np.sqrt(np.linalg.eigvalsh((matrix + matrix.T)/2.0).max())
+
+    def __affine_min_squared_dist__(self, v0:np.ndarray, v1:np.ndarray) -> np.ndarray:
+        """
+        Minimum squared distance of repulsion vectors moving affinely from v0 to v1 (..., 2)
+        """
+        matrix = self.get_dist_matrix(scaled=True, inverted=True)
+        matrix = (matrix + matrix.T)/2.0
+        dv = v1 - v0
+
+        num = -((v0@matrix)*dv).sum(-1)
+        den = ((dv@matrix)*dv).sum(-1)
+        s = np.clip(np.divide(num, den, out=np.zeros_like(num), where=den > 0.0), 0.0, 1.0)[..., None]
+
+        v = v0 + s*dv
+        return ((v@matrix)*v).sum(-1)
+
+    def __piecewise_min_squared_dist__(self, vectors:np.ndarray) -> np.ndarray:
+        """
+        Minimum squared distance over the affine pieces between repulsion vectors (..., k, 2) taken at sorted breakpoints
+        """
+        return self.__affine_min_squared_dist__(vectors[..., :-1, :], vectors[..., 1:, :]).min(-1)
+
+    @staticmethod
+    def __breakpoints__(a:np.ndarray, u:np.ndarray, values:np.ndarray) -> np.ndarray:
+        """
+        Sorted segment parameters 0, 1 and every t in [0, 1] where a + t*u reaches values (..., k, 2) along an axis
+        """
+        den = u[..., None, :]
+        ts = np.divide(values - a[..., None, :], den, out=np.zeros(np.broadcast_shapes(values.shape, den.shape)), where=den != 0.0)
+        ts = np.clip(ts.reshape(*ts.shape[:-2], -1), 0.0, 1.0)
+        bounds = np.broadcast_to(np.array([0.0, 1.0]), (*ts.shape[:-1], 2))
+
+        return np.sort(np.concatenate([bounds, ts], axis=-1), axis=-1)
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, samples=33, iterations=40) -> np.ndarray:
+        """
+        Minimum squared distance along each segment a -> b (n x 2)
+
+        Generic bounded search: the best of evenly spaced samples is refined by golden section within its neighbouring samples.
+        The result is an attained value, so never below the true minimum, and exact when the distance is unimodal there
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        u = b - a
+
+        ts = np.linspace(0.0, 1.0, samples)
+        dists = self.squared_dist((a[:, None] + ts[:, None]*u[:, None]).reshape(-1, 2)).reshape(len(a), samples)
+        best = dists.argmin(1)
+        best_dists = dists[np.arange(len(a)), best]
+
+        low, high = ts[np.maximum(best - 1, 0)], ts[np.minimum(best + 1, samples - 1)]
+        ratio = (np.sqrt(5.0) - 1.0)/2.0
+        for _ in range(iterations):
+            t1, t2 = high - ratio*(high - low), low + ratio*(high - low)
+            d = self.squared_dist(np.concatenate([a + t1[:, None]*u, a + t2[:, None]*u], axis=0))
+            d1, d2 = d[:len(a)], d[len(a):]
+            best_dists = np.minimum(best_dists, np.minimum(d1, d2))
+            left = d1 < d2
+            high, low = np.where(left, t2, high), np.where(left, low, t1)
+
+        return best_dists
+
     def squared_dist(self, x: np.ndarray, scaled=True, inverted=True, **kwargs) -> np.ndarray:
         nvector = self.repulsion_vector(x, min_dist_select = True)
         matrix = self.get_dist_matrix(scaled=scaled, inverted=inverted)
@@ -71,10 +210,61 @@ class RGJGeometry():
     
     def repulsion_vector(self, x:np.ndarray, **kwargs) -> np.ndarray:
         raise NotImplementedError
+
+    def __select_min_dist__(self, vectors:np.ndarray) -> np.ndarray:
+        """
+        Selects per point (axis 0) the vector (axis 1) with the smallest scaled distance
+        """
+        matrix = self.get_dist_matrix(scaled=True, inverted=True)
+        nvectors = np.matmul(vectors, matrix)
+        dist = (vectors*nvectors).sum(-1)
+        select = dist.argmin(1)
+        return vectors[np.arange(len(select)), select]
+
+    def __batched_repulsion_vector__(self, x:np.ndarray, elements_n:int, min_dist_select:bool = True, max_batch_bytes:Optional[int] = None) -> np.ndarray:
+        """
+        Evaluates all sub-elements at once through `__repulsion_vector_batch__` (points x elements x 2),
+        tiling the points so the intermediate stays below `max_batch_bytes`
+        """
+        x = np.asarray(x).reshape(-1, 2)
+
+        if not min_dist_select:
+            return self.__repulsion_vector_batch__(x).swapaxes(0, 1)
+        
+        max_batch_bytes = self.MAX_BATCH_BYTES if max_batch_bytes is None else max_batch_bytes
+        vectors = [self.__select_min_dist__(self.__repulsion_vector_batch__(x[select]))
+                   for select in __batch_slices__(len(x), elements_n, max_batch_bytes)]
+
+        return np.concatenate(vectors, axis=0) if len(vectors) else np.zeros((0, 2))
+
+    def __repulsion_vector_batch__(self, x:np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+    
+    def __fused__(self, x:np.ndarray, **kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Squared distance, potential and gradient from a single repulsion vector evaluation of the nearest element
+        """
+        if not kwargs.pop("min_dist_select", True):
+            raise ValueError("Fused evaluation needs min_dist_select, use gradient for per-element gradients")
+        repulsion_vector = self.repulsion_vector(x, **kwargs).reshape(-1, 2)
+        dists = ((repulsion_vector@self.inv_repulsion)*repulsion_vector).sum(axis=1)
+        evals = np.exp(-dists)
+
+        return dists, evals, - evals.reshape(-1, 1) * (repulsion_vector@self.grad_matrix.T)
+
+    def eval_gradient(self, x:np.ndarray, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns potential and gradient together
+        """
+        _, evals, grads = self.__fused__(x, **kwargs)
+        return evals, grads
     
     def gradient(self, x:np.ndarray, **kwargs):
-        repulsion_vector = self.repulsion_vector(x, **kwargs)
-        return - self.eval(x=x).reshape(-1, 1) * (repulsion_vector@self.grad_matrix.T)
+        if not kwargs.get("min_dist_select", True):
+            # one gradient per element, scaled by the potential of the nearest one
+            repulsion_vector = self.repulsion_vector(x, **kwargs)
+            return - self.eval(x=x).reshape(-1, 1) * (repulsion_vector@self.grad_matrix.T)
+        return self.__fused__(x, **kwargs)[2]
 
     def eval(self, x:np.ndarray):
         return np.exp(-self.squared_dist(x))
@@ -95,6 +285,7 @@ class RGJGeometry():
 
 
 class PointRGJ(RGJGeometry):
+    __slots__ = ()
     RGJType = "Point"
 
     def __init__(self, coordinates: Union[np.ndarray, Point], repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
@@ -103,7 +294,12 @@ class PointRGJ(RGJGeometry):
     def repulsion_vector(self, x: np.ndarray, **kwargs) -> np.ndarray:
         return x - self.coordinates
 
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, **kwargs) -> np.ndarray:
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        return self.__affine_min_squared_dist__(a - self.coordinates, b - self.coordinates)
+
 class LineStringRGJ(RGJGeometry):
+    __slots__ = ('lines_n', 'points_in_line_pair')
     RGJType = "LineString"
 
     def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
@@ -127,7 +323,21 @@ class LineStringRGJ(RGJGeometry):
         g = line[0] + np.clip(x12dotxx1/x12dotx12, 0.0, 1.0)*(x2_d_x1)
         return x - g
     
-    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, **kwargs) -> np.ndarray:
+    def __repulsion_vector_batch__(self, x: np.ndarray) -> np.ndarray:
+        x1 = self.points_in_line_pair[:, 0]
+        x2_d_x1 = self.points_in_line_pair[:, 1] - x1
+        x_d_x1 = x[:, None] - x1
+
+        x12dotxx1 = (x2_d_x1*x_d_x1).sum(-1, keepdims=True)
+        x12dotx12 = (x2_d_x1*x2_d_x1).sum(-1, keepdims=True)
+
+        g = x1 + np.clip(x12dotxx1/x12dotx12, 0.0, 1.0)*(x2_d_x1)
+        return x[:, None] - g
+    
+    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, batched:bool = True, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        if batched:
+            return self.__batched_repulsion_vector__(x, self.lines_n, min_dist_select=min_dist_select, max_batch_bytes=max_batch_bytes)
+        
         vectors:np.ndarray = [self.__repulsion_vector_one_line__((x, line)) for line in self.points_in_line_pair]
 
         vectors = np.stack(vectors, axis=0)
@@ -140,8 +350,36 @@ class LineStringRGJ(RGJGeometry):
             vectors = vectors[np.arange(len(select)), select]
         
         return vectors
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        """
+        Exact minimum squared distance along each segment a -> b (n x 2). The projection onto each line
+        is affine between the parameters where it reaches a line end, so the distance is piecewise quadratic
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        x1 = self.points_in_line_pair[:, 0]
+        x2_d_x1 = self.points_in_line_pair[:, 1] - x1
+        x12dotx12 = (x2_d_x1*x2_d_x1).sum(-1)
+
+        max_batch_bytes = self.MAX_BATCH_BYTES if max_batch_bytes is None else max_batch_bytes
+        dists = np.zeros(len(a))
+        for select in __batch_slices__(len(a), 4*self.lines_n, max_batch_bytes):
+            sa, su = a[select, None], (b - a)[select, None]
+
+            # projection parameter onto each line as s0 + t*ds, the distance bends where it crosses 0 and 1
+            s0 = ((sa - x1)*x2_d_x1).sum(-1)/x12dotx12
+            ds = (su*x2_d_x1).sum(-1)/x12dotx12
+            ts = np.divide(np.stack([-s0, 1.0 - s0], axis=-1), ds[..., None], out=np.zeros((*s0.shape, 2)), where=ds[..., None] != 0.0)
+            ts = np.sort(np.concatenate([np.zeros((*s0.shape, 1)), np.clip(ts, 0.0, 1.0), np.ones((*s0.shape, 1))], axis=-1), axis=-1)
+
+            x = sa[..., None, :] + ts[..., None]*su[..., None, :]
+            g = x1[:, None] + np.clip(s0[..., None] + ts*ds[..., None], 0.0, 1.0)[..., None]*x2_d_x1[:, None]
+            dists[select] = self.__piecewise_min_squared_dist__(x - g).min(-1)
+
+        return dists
     
 class RectangleRGJ(RGJGeometry):
+    __slots__ = ('x1_abs_x2',)
     RGJType = "Rectangle"
 
     def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
@@ -155,15 +393,30 @@ class RectangleRGJ(RGJGeometry):
     def repulsion_vector(self, x: np.ndarray, **kwargs) -> np.ndarray:
         
         return 0.5*np.sign(x-self.coordinates[0])*(np.abs(x-self.coordinates[0]) + np.abs(x-self.coordinates[1]) - self.x1_abs_x2)
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Exact minimum squared distance along each segment a -> b (n x 2). The repulsion vector
+        is affine between the parameters where the segment crosses a side line
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        u = b - a
+
+        ts = self.__breakpoints__(a, u, np.broadcast_to(self.coordinates, (len(a), 2, 2)))
+        x = a[:, None] + ts[..., None]*u[:, None]
+        vectors = self.repulsion_vector(x.reshape(-1, 2)).reshape(x.shape)
+
+        return self.__piecewise_min_squared_dist__(vectors)
     
 class EllipseRGJ(RGJGeometry):
+    __slots__ = ('shape', 'inv_shape')
     RGJType = "Ellipse"
     DEN_ERROR_BUFFER = 1e-6
 
     def __init__(self, coordinates: np.ndarray, shape: np.ndarray, repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
 
         super().__init__(coordinates=coordinates, repulsion=repulsion, **kwargs)
-        self.shape = shape
+        self.shape = np.array(shape)
         self.inv_shape = np.linalg.inv(self.shape)
 
         eval, evec  = np.linalg.eig(self.shape)
@@ -180,9 +433,15 @@ class EllipseRGJ(RGJGeometry):
         self.bbox = np.array([bounds.min(0), bounds.max(0)])
 
     def set_shape(self, new_shape):
-        self.shape = new_shape
+        self.shape = np.array(new_shape)
         self.inv_shape = np.linalg.inv(self.shape)
 
+    def support_bbox(self) -> np.ndarray:
+        extent = np.linalg.norm(np.asarray(self.shape, dtype=float), axis=-1)
+        bbox = np.concatenate([self.bbox, [self.coordinates - extent, self.coordinates + extent]])
+
+        return np.array([bbox.min(0), bbox.max(0)])
+
     def repulsion_vector(self, x: np.ndarray, **kwargs) -> np.ndarray:
 
         x_d_xh = x - self.coordinates
@@ -192,6 +451,19 @@ class EllipseRGJ(RGJGeometry):
         den = np.maximum(den, self.DEN_ERROR_BUFFER)
 
         return np.maximum(1 - 1/den, 0)*x_d_xh
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Zero for segments crossing the ellipse, bounded search (see `RGJGeometry.segment_squared_dist`) otherwise
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        dists = np.zeros(len(a))
+
+        outside = ~__segment_meets_ellipses__(a, b, self.coordinates.reshape(1, 2), self.inv_shape.reshape(1, 2, 2))[:, 0]
+        if outside.any():
+            dists[outside] = super().segment_squared_dist(a[outside], b[outside], **kwargs)
+
+        return dists
     
     def toRGeoJSON(self) -> RGeoJSONObject:
         out = super().toRGeoJSON()
@@ -199,47 +471,77 @@ class EllipseRGJ(RGJGeometry):
         return out
 
 class MultiPointRGJ(RGJGeometry):
+    __slots__ = ('indexed', '__index')
     RGJType = "MultiPoint"
+    INDEX_MIN_POINTS = 512 # number of points from which nearest point queries use a KD-tree by default
 
-    def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
+    def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, indexed:Optional[bool] = None, **kwargs) -> None:
         super().__init__(coordinates=coordinates, repulsion=repulsion)
         self.bbox = self.coordinates.copy()
+        self.indexed = indexed
+        self.__index = None
+
+    def set_coordinates(self, new_coords):
+        super().set_coordinates(new_coords)
+        self.bbox = self.coordinates.copy()
+        self.__index = None
+
+    def set_repulsion(self, new_repulsion):
+        super().set_repulsion(new_repulsion)
+        self.__index = None
 
     def in_bbox(self, x:Point) -> bool:
         return any(self.bbox == x)
 
-    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, **kwargs) -> np.ndarray:
-        x = np.array(x)
+    def __whitened_index__(self) -> Tuple[np.ndarray, PointTreeIndex]:
+        """
+        KD-tree over coordinates whitened by the inverse repulsion, so that euclidean
+        nearest neighbours in the whitened space are the nearest points under the repulsion metric
+        """
+        if self.__index is None:
+            matrix = self.get_dist_matrix(scaled=True, inverted=True)
+            whitening = np.linalg.cholesky((matrix + matrix.T)/2.0)
+            self.__index = (whitening, PointTreeIndex(self.coordinates.reshape(-1, 2) @ whitening))
 
-        n = x.shape[0]
-        m = self.coordinates.shape[0]
+        return self.__index
 
-        x = np.tile(x, (m, 1, 1)).transpose(1, 0, 2)
-        y = np.tile(self.coordinates, (n, 1, 1))
-        diff = y - x
+    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, indexed:Optional[bool] = None, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        x = np.array(x).reshape(-1, 2)
 
-        if min_dist_select:
-            matrix = self.get_dist_matrix(scaled=True, inverted=True)
-            Adiff = np.matmul(diff, matrix)
-            dist = (Adiff*diff).sum(-1)
-            select = dist.argmin(1)
-            diff = diff[np.arange(len(select)), select]
-        else:
-            diff = diff.swapaxes(0, 1)
+        if not min_dist_select:
+            return self.coordinates[:, None] - x
+        
+        indexed = self.indexed if indexed is None else indexed
+        if indexed or (indexed is None and len(self.coordinates) >= self.INDEX_MIN_POINTS):
+            whitening, index = self.__whitened_index__()
+            _, select = index.query(x @ whitening)
+            return self.coordinates[select] - x
+
+        max_batch_bytes = self.MAX_BATCH_BYTES if max_batch_bytes is None else max_batch_bytes
+        diff = [self.__select_min_dist__(self.coordinates - x[select, None])
+                for select in __batch_slices__(len(x), len(self.coordinates), max_batch_bytes)]
+
+        return np.concatenate(diff, axis=0) if len(diff) else np.zeros((0, 2))
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        coords = self.coordinates.reshape(-1, 2)
 
-        return diff
+        max_batch_bytes = self.MAX_BATCH_BYTES if max_batch_bytes is None else max_batch_bytes
+        dists = [self.__affine_min_squared_dist__(a[select, None] - coords, b[select, None] - coords).min(1)
+                 for select in __batch_slices__(len(a), 2*len(coords), max_batch_bytes)]
+
+        return np.concatenate(dists) if len(dists) else np.zeros(0)
     
 class MultiLineStringRGJ(LineStringRGJ):
+    __slots__ = ()
     RGJType = "MultiLineString"
 
     def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, properties:Optional[dict] = None, optional_dim = 2, **kwargs) -> None:
 
         self.coordinates = [np.array(coords) for coords in coordinates]
-        self.repulsion = np.eye(optional_dim) if repulsion is None else np.array(repulsion)
-        self.inv_repulsion = np.linalg.inv(self.repulsion)
-        self.eye_repulsion = np.eye(len(self.repulsion))
+        self.repulsion, self.inv_repulsion, self.eye_repulsion, self.grad_matrix = __repulsion_profile__(np.eye(optional_dim) if repulsion is None else repulsion)
         self.properties = {} if properties is None else properties
-        self.grad_matrix = self.inv_repulsion + self.inv_repulsion.T
         
         self.lines_n = sum([len(coords)-1 for coords in self.coordinates])
         self.points_in_line_pair = np.concatenate([[coords[:-1], coords[1:]] for coords in self.coordinates], axis=1).swapaxes(0, 1)
@@ -259,6 +561,7 @@ class MultiLineStringRGJ(LineStringRGJ):
 
 class MultiRectangleRGJ(RGJGeometry):
 
+    __slots__ = ('rect_n',)
     RGJType = "MultiRectangle"
 
     def __init__(self, coordinates: np.ndarray, repulsion:Optional[np.ndarray] = None, **kwargs) -> None:
@@ -274,7 +577,39 @@ class MultiRectangleRGJ(RGJGeometry):
         x, rect = args
         return 0.5*np.sign(x-rect[0])*(np.abs(x-rect[0]) + np.abs(x-rect[1]) - np.abs(rect[0] - rect[1]))
     
-    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, **kwargs) -> np.ndarray:
+    def __repulsion_vector_batch__(self, x: np.ndarray) -> np.ndarray:
+        rects = self.coordinates
+        x_d_r0 = x[:, None] - rects[:, 0]
+        x_d_r1 = x[:, None] - rects[:, 1]
+
+        return 0.5*np.sign(x_d_r0)*(np.abs(x_d_r0) + np.abs(x_d_r1) - np.abs(rects[:, 0] - rects[:, 1]))
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        """
+        Exact minimum squared distance along each segment a -> b (n x 2), see `RectangleRGJ.segment_squared_dist`
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        rects = self.coordinates
+
+        max_batch_bytes = self.MAX_BATCH_BYTES if max_batch_bytes is None else max_batch_bytes
+        dists = np.zeros(len(a))
+        for select in __batch_slices__(len(a), 6*self.rect_n, max_batch_bytes):
+            sa, su = np.repeat(a[select, None], self.rect_n, 1), np.repeat((b - a)[select, None], self.rect_n, 1)
+
+            ts = self.__breakpoints__(sa, su, np.broadcast_to(rects, (len(sa), *rects.shape)))
+            x = sa[..., None, :] + ts[..., None]*su[..., None, :]
+            x_d_r0 = x - rects[:, None, 0]
+            x_d_r1 = x - rects[:, None, 1]
+            vectors = 0.5*np.sign(x_d_r0)*(np.abs(x_d_r0) + np.abs(x_d_r1) - np.abs(rects[:, None, 0] - rects[:, None, 1]))
+
+            dists[select] = self.__piecewise_min_squared_dist__(vectors).min(-1)
+
+        return dists
+    
+    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, batched:bool = True, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        if batched:
+            return self.__batched_repulsion_vector__(x, self.rect_n, min_dist_select=min_dist_select, max_batch_bytes=max_batch_bytes)
+        
         vectors:np.ndarray = [self.__repulsion_vector_one_rect__((x, rect)) for rect in self.coordinates]
 
         vectors = np.stack(vectors, axis=0)
@@ -289,6 +624,7 @@ class MultiRectangleRGJ(RGJGeometry):
         return vectors
 
 class MultiEllipseRGJ(RGJGeometry):
+    __slots__ = ('shape', 'inv_shape', 'parameters', 'ellipse_n')
     RGJType = "MultiEllipse"
     DEN_ERROR_BUFFER = 1e-6
 
@@ -301,10 +637,10 @@ class MultiEllipseRGJ(RGJGeometry):
 
         self.bbox = []
 
-        for sp in self.shape:
+        for coordinate, sp in zip(self.coordinates, self.shape):
             eval, evec  = np.linalg.eig(sp)
             vectors = evec * np.sqrt(eval) @ np.linalg.inv(evec)
-            bounds = np.concatenate([self.coordinates + vectors, self.coordinates - vectors])
+            bounds = np.concatenate([coordinate + vectors, coordinate - vectors])
             self.bbox.append(np.array([bounds.min(0), bounds.max(0)]))
 
         self.bbox = np.array(self.bbox)
@@ -315,10 +651,10 @@ class MultiEllipseRGJ(RGJGeometry):
         self.ellipse_n = len(self.coordinates)
 
         self.bbox = []
-        for sp in self.shape:
+        for coordinate, sp in zip(self.coordinates, self.shape):
             eval, evec  = np.linalg.eig(sp)
             vectors = evec * np.sqrt(eval) @ np.linalg.inv(evec)
-            bounds = np.concatenate([self.coordinates + vectors, self.coordinates - vectors])
+            bounds = np.concatenate([coordinate + vectors, coordinate - vectors])
             self.bbox.append(np.array([bounds.min(0), bounds.max(0)]))
 
         self.bbox = np.array(self.bbox)
@@ -327,6 +663,12 @@ class MultiEllipseRGJ(RGJGeometry):
         self.shape = new_shape
         self.inv_shape = np.linalg.inv(self.shape)
         self.parameters = list(zip(self.coordinates, self.inv_shape))
+
+    def support_bbox(self) -> np.ndarray:
+        extent = np.linalg.norm(np.asarray(self.shape, dtype=float), axis=-1)
+        bbox = np.concatenate([self.bbox.reshape(-1, 2), self.coordinates - extent, self.coordinates + extent])
+
+        return np.array([bbox.min(0), bbox.max(0)])
     
     def __repulsion_vector_one_ellipse__(self, args) -> np.ndarray:
         x, coordinate, inv_shape = args
@@ -337,7 +679,18 @@ class MultiEllipseRGJ(RGJGeometry):
         den = np.maximum(den, self.DEN_ERROR_BUFFER)
         return np.maximum(1 - 1/den, 0)*x_d_xh
     
-    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, **kwargs) -> np.ndarray:
+    def __repulsion_vector_batch__(self, x: np.ndarray) -> np.ndarray:
+        x_d_xh = x[:, None] - self.coordinates
+        Binvx = np.matmul(x_d_xh[..., None, :], self.inv_shape.swapaxes(-1, -2))[..., 0, :]
+
+        den = np.sqrt((Binvx*Binvx).sum(-1, keepdims=True))
+        den = np.maximum(den, self.DEN_ERROR_BUFFER)
+        return np.maximum(1 - 1/den, 0)*x_d_xh
+    
+    def repulsion_vector(self, x: np.ndarray, min_dist_select:bool = True, batched:bool = True, max_batch_bytes:Optional[int] = None, **kwargs) -> np.ndarray:
+        if batched:
+            return self.__batched_repulsion_vector__(x, self.ellipse_n, min_dist_select=min_dist_select, max_batch_bytes=max_batch_bytes)
+        
         vectors:np.ndarray = [self.__repulsion_vector_one_ellipse__((x, parameters[0], parameters[1])) for parameters in self.parameters]
 
         vectors = np.stack(vectors, axis=0)
@@ -350,8 +703,22 @@ class MultiEllipseRGJ(RGJGeometry):
             vectors = vectors[np.arange(len(select)), select]
         
         return vectors
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, **kwargs) -> np.ndarray:
+        """
+        Zero for segments crossing an ellipse, bounded search (see `RGJGeometry.segment_squared_dist`) otherwise
+        """
+        a, b = np.asarray(a, dtype=float).reshape(-1, 2), np.asarray(b, dtype=float).reshape(-1, 2)
+        dists = np.zeros(len(a))
+
+        outside = ~__segment_meets_ellipses__(a, b, self.coordinates, self.inv_shape).any(1)
+        if outside.any():
+            dists[outside] = super().segment_squared_dist(a[outside], b[outside], **kwargs)
+
+        return dists
     
 class GeometryCollectionRGJ(RGJGeometry):
+    __slots__ = ('rgjs', 'rgjs_n', 'inv_repulsions', 'grad_matrixes')
     RGJType = "GeometryCollection"
 
     def __init__(self, geometries: List[RGJDict], properties:Optional[dict] = None, **kwargs) -> None:
@@ -376,6 +743,17 @@ class GeometryCollectionRGJ(RGJGeometry):
     def in_bbox(self, x:Point) -> bool:
         return any([rgj.in_bbox(x) for rgj in self.rgjs])
 
+    def support_bbox(self) -> np.ndarray:
+        bbox = np.concatenate([rgj.support_bbox() for rgj in self.rgjs], 0)
+        return np.array([bbox.min(0), bbox.max(0)])
+
+    def influence_bbox(self, tolerance:float) -> np.ndarray:
+        bbox = np.concatenate([rgj.influence_bbox(tolerance) for rgj in self.rgjs], 0)
+        return np.array([bbox.min(0), bbox.max(0)])
+
+    def length_scale(self) -> float:
+        return min(rgj.length_scale() for rgj in self.rgjs)
+
     def get_dist_matrix(self, scaled=True, inverted=True) -> List[np.ndarray]:
 
         """
@@ -397,6 +775,9 @@ class GeometryCollectionRGJ(RGJGeometry):
             return dists[np.arange(len(dists)), min_idxs], min_idxs
 
         return np.min(dists, axis=1)
+
+    def segment_squared_dist(self, a:np.ndarray, b:np.ndarray, **kwargs) -> np.ndarray:
+        return np.min(np.stack([rgj.segment_squared_dist(a, b, **kwargs) for rgj in self.rgjs], axis=1), axis=1)
     
     def repulsion_vector(self, x:np.ndarray, min_dist_select:bool = True, **kwargs) -> np.ndarray:
 
@@ -413,12 +794,31 @@ class GeometryCollectionRGJ(RGJGeometry):
 
         return vectors
     
-    def gradient(self, x: np.ndarray, **kwargs):
+    def __fused__(self, x: np.ndarray, reference_idx = False, **kwargs) -> Union[Tuple[np.ndarray, np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        results = [rgj.__fused__(x, **kwargs) for rgj in self.rgjs]
+
+        dists = np.stack([result[0] for result in results], axis=1)
+        min_idxs = np.argmin(dists, axis=1)
+        rows = np.arange(len(dists))
+
+        dists = dists[rows, min_idxs]
+        evals = np.stack([result[1] for result in results], axis=1)[rows, min_idxs]
+        grads = np.stack([result[2] for result in results], axis=1)[rows, min_idxs]
 
-        _, dist_idxs = self.squared_dist(x, reference_idx=True, **kwargs)
+        if reference_idx:
+            return dists, evals, grads, min_idxs
+        return dists, evals, grads
 
-        repulsion_vector = self.repulsion_vector(x, min_dist_select = True, **kwargs)
-        return - self.eval(x=x).reshape(-1, 1) * (np.einsum('ijk,ik->ij', self.grad_matrixes[dist_idxs], repulsion_vector))
+    def eval_gradient(self, x: np.ndarray, reference_idx = False, **kwargs) -> Union[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Returns potential, gradient and (if reference_idx) the index of the sub geometry owning each point
+        """
+        _, evals, grads, min_idxs = self.__fused__(x, reference_idx=True, **kwargs)
+
+        return (evals, grads, min_idxs) if reference_idx else (evals, grads)
+    
+    def gradient(self, x: np.ndarray, **kwargs):
+        return self.__fused__(x, **kwargs)[2]
     
     def toRGeoJSON(self) -> RGeoJSONObject:
         if self.RGJType is None: 
@@ -438,11 +838,18 @@ class PotentialField():
     Potential field given a subset of RGJs
     """
 
-    def __init__(self, rgjs:Optional[Union[List[RGJDict], RGJGeometry]] = None, center_point: Optional[Point] = None, size:Optional[Union[FieldSize, float]] = None, properties:Optional[List[dict]] = None, extra_info={}):
+    def __init__(self, rgjs:Optional[Union[List[RGJDict], RGJGeometry]] = None, center_point: Optional[Point] = None, size:Optional[Union[FieldSize, float]] = None, properties:Optional[List[dict]] = None, extra_info={}, tolerance:Optional[float] = None):
         self.rgjs:List[RGJGeometry] = []
         self.__reload_center = None
         self.center_point = center_point
         self.extra_info = extra_info
+        self.index:Optional[BBoxIndex] = None
+        self.index_tolerance:Optional[float] = None
+        self.__index_cell_size = None
+        self.version = 0 # incremented whenever the RGJs change
+        self.__compiled:Optional[CompiledField] = None
+        self.__bboxes = np.zeros((0, 2, 2)) # per-RGJ bounding boxes, with spare capacity for appends
+        self.bbox:Optional[np.ndarray] = None
 
         if size is None:
             self.size = size
@@ -452,11 +859,9 @@ class PotentialField():
             self.size = np.array(size)
 
         if properties is None or isinstance(rgjs[0], RGJGeometry):
-            for rgj in rgjs:
-                self.addRGJ(rgj=rgj)
+            self.addRGJs(rgjs)
         else:
-            for rgj, proper in zip(rgjs, properties):
-                self.addRGJ(rgj=rgj, properties=proper)
+            self.addRGJs(rgjs, properties=properties)
 
         if self.center_point is None:
             self.__reload_center = True # whether to recalculate center point if new RGJ are added
@@ -466,11 +871,13 @@ class PotentialField():
         else:
             self.__reload_center = False
             if len(rgjs) > 0:
-                self.reload_bbox()
                 suggest_size = np.array([max(np.abs(self.bbox - self.center_point).reshape(-1))*2]*2)
 
                 self.size = suggest_size if self.size is None else self.size
 
+        if tolerance is not None:
+            self.tolerance = tolerance
+
     def __iter__(self):
         self.rgj_idx = 0
         return self
@@ -486,7 +893,6 @@ class PotentialField():
         return len(self.rgjs)
 
     def __calculate_center_point__(self, suggest_size = False) -> Union[Point, Tuple[Point, float]]:
-        self.reload_bbox()
         center = np.sum(self.bbox, 0)/2.0
 
         if suggest_size:
@@ -500,9 +906,130 @@ class PotentialField():
         for rgj in self.rgjs:
             rgj.set_repulsion(new_repulsion)
 
+        self.reload_rgjs()
+
+    def reload_rgjs(self) -> None:
+        """
+        Refreshes structures derived from the RGJs (bounding boxes, index and compiled form) after they are modified in place
+        """
+        self.reload_bbox()
+        self.reload_index()
+        self.__changed__()
+
+    def __changed__(self) -> None:
+        self.version += 1
+        self.__compiled = None
+
+    def compile(self) -> CompiledField:
+        """
+        Returns the compiled (read-only, struct-of-arrays) form of the field. It is rebuilt if the field changes
+        """
+        if self.__compiled is None:
+            self.__compiled = CompiledField(self)
+
+        return self.__compiled
+
+    def enable_index(self, tolerance:float = 1e-12, cell_size:Optional[float] = None) -> BBoxIndex:
+        """
+        Indexes the influence box of every RGJ so that eval, squared_dist_list and repulsion_vectors
+        skip point-RGJ pairs whose potential is below tolerance
+        """
+        if not 0.0 < tolerance < 1.0:
+            raise ValueError("Index tolerance must be between 0 and 1 (exclusive)")
+
+        self.index_tolerance = tolerance
+        self.__index_cell_size = cell_size
+        self.index = BBoxIndex(self.__influence_bboxes__(self.rgjs), cell_size=cell_size)
+
+        return self.index
+
+    @property
+    def tolerance(self) -> Optional[float]:
+        """
+        Truncation tolerance. When set, point-RGJ pairs outside the RGJ's influence box (where its potential
+        is below tolerance) are skipped and contribute an exact 0, so eval, eval_per and to_image are off by
+        at most tolerance. The gradient also scales with the distance to the RGJ: for tolerance below exp(-1/2),
+        it is off by at most 4*tolerance*sqrt(-log(tolerance))/length_scale, with the shortest RGJ length_scale
+        """
+        return self.index_tolerance
+
+    @tolerance.setter
+    def tolerance(self, tolerance:Optional[float]) -> None:
+        if tolerance is None:
+            self.disable_index()
+        elif tolerance != self.index_tolerance:
+            self.enable_index(tolerance)
+
+    def disable_index(self) -> None:
+        self.index = None
+        self.index_tolerance = None
+
+    def reload_index(self) -> None:
+        """
+        Recomputes the influence boxes (e.g., after RGJs are modified in place)
+        """
+        if self.index is not None:
+            self.enable_index(self.index_tolerance, cell_size=self.__index_cell_size)
+
+    def __influence_bboxes__(self, rgjs:List[RGJGeometry], tolerance:Optional[float] = None) -> np.ndarray:
+        tolerance = self.index_tolerance if tolerance is None else tolerance
+        return np.array([rgj.influence_bbox(tolerance) for rgj in rgjs]).reshape(-1, 2, 2)
+
+    def __candidate_groups__(self, points:np.ndarray, filted_idx:Optional[List[int]] = None) -> List[Tuple[int, np.ndarray]]:
+        """
+        Groups, per RGJ, the indexes of the points inside its influence box
+        """
+        point_idxs, rgj_idxs = self.index.query_points(points)
+
+        if filted_idx is not None:
+            allowed = np.zeros(len(self), dtype=bool)
+            allowed[np.asarray(filted_idx, dtype=int)] = True
+            select = allowed[rgj_idxs]
+            point_idxs, rgj_idxs = point_idxs[select], rgj_idxs[select]
+
+        order = np.argsort(rgj_idxs, kind='stable')
+        point_idxs, rgj_idxs = point_idxs[order], rgj_idxs[order]
+        groups, starts = np.unique(rgj_idxs, return_index=True)
+
+        return list(zip(groups, np.split(point_idxs, starts[1:])))
+
+    @staticmethod
+    def __rgj_bbox__(rgj:RGJGeometry) -> np.ndarray:
+        if np.shape(rgj.bbox) == (2, 2):
+            return rgj.bbox
+        
+        bbox = np.reshape(rgj.bbox, (-1, 2))
+        return np.array([bbox.min(0), bbox.max(0)])
+
+    @property
+    def rgj_bboxes(self) -> np.ndarray:
+        """
+        Bounding box of each RGJ (n x 2 x 2)
+        """
+        return self.__bboxes[:len(self.rgjs)]
+
+    def __append_bboxes__(self, bboxes:np.ndarray) -> None:
+        """
+        Stores the boxes of the RGJs just appended and grows the field box, doubling capacity as needed
+        """
+        n, start = len(self.rgjs), len(self.rgjs) - len(bboxes)
+        if n > len(self.__bboxes):
+            buffer = np.zeros((max(2*len(self.__bboxes), n), 2, 2))
+            buffer[:start] = self.__bboxes[:start]
+            self.__bboxes = buffer
+        self.__bboxes[start:n] = bboxes
+
+        if len(bboxes):
+            bboxes = bboxes if self.bbox is None else np.concatenate([self.bbox[None], bboxes])
+            self.bbox = np.array([bboxes[:, 0].min(0), bboxes[:, 1].max(0)])
+
     def reload_bbox(self):
-        bbox = np.concatenate([rgj.bbox for rgj in self.rgjs], 0).reshape(-1, 2)
-        self.bbox = np.array([bbox.min(0), bbox.max(0)])
+        """
+        Recomputes every RGJ box (e.g., after RGJs are modified in place)
+        """
+        self.__bboxes = np.zeros((0, 2, 2))
+        self.bbox = None
+        self.__append_bboxes__(np.array([self.__rgj_bbox__(rgj) for rgj in self.rgjs]).reshape(-1, 2, 2))
     
     def reload_center_point(self, toggle=True, recal_size=False) -> Point:
         self.__reload_center = toggle
@@ -523,24 +1050,65 @@ class PotentialField():
                 ] for ax in range(len(self.center_point))], -1).tolist()
 
     def addRGJ(self, rgj:Union[RGJDict, RGJGeometry], properties:Optional[dict] = None, **kward) -> None:
+        self.addRGJs([rgj], properties=[properties], **kward)
 
-        if not isinstance(rgj, RGJGeometry):
-            rgj:RGJGeometry = globals()[rgj["type"]+"RGJ"](properties=properties, **rgj, **kward)
+    def addRGJs(self, rgjs:List[Union[RGJDict, RGJGeometry]], properties:Optional[List[dict]] = None, **kward) -> np.ndarray:
+        """
+        Validates and constructs every RGJ before appending them all at once. Returns the indexes of the added RGJs
+        """
+        properties = [None]*len(rgjs) if properties is None else properties
+        if len(properties) != len(rgjs):
+            raise ValueError("The number of properties doesn't match the number of RGJs")
         
-        self.rgjs.append(rgj)
+        for rgj in rgjs:
+            if isinstance(rgj, RGJGeometry):
+                continue
+            rgj_class = globals().get(str(rgj.get("type")) + "RGJ")
+            if not (isinstance(rgj_class, type) and issubclass(rgj_class, RGJGeometry)):
+                raise ValueError(f"Unknown RGJ type: {rgj.get('type')}")
+
+        new_rgjs:List[RGJGeometry] = [rgj if isinstance(rgj, RGJGeometry) else globals()[rgj["type"]+"RGJ"](properties=proper, **rgj, **kward)
+                                      for rgj, proper in zip(rgjs, properties)]
+        start = len(self.rgjs)
+        if not new_rgjs:
+            return np.arange(start, start)
+
+        self.rgjs.extend(new_rgjs)
+        self.__append_bboxes__(np.array([self.__rgj_bbox__(rgj) for rgj in new_rgjs]))
+        if self.index is not None:
+            self.index.add(self.__influence_bboxes__(new_rgjs))
+        self.__changed__()
 
         if self.__reload_center:
             self.center_point = self.__calculate_center_point__()
 
+        return np.arange(start, len(self.rgjs))
+
     def delRGJ(self, idx:Union[int, List[int]]) -> None:
+        self.delRGJs(idx)
 
-        idx = np.unique([idx] if idx is int else idx)
-        idx.sort()
+    def delRGJs(self, idxs:Union[int, List[int], np.ndarray]) -> None:
+        """
+        Removes many RGJs at once
+        """
+        idxs = np.unique(np.asarray(idxs, dtype=int).reshape(-1))
+        if not len(idxs):
+            return
         
-        for i in range(len(idx)):
-            del self.rgjs[idx[i]-i]
+        keep = np.ones(len(self.rgjs), dtype=bool)
+        keep[idxs] = False
+        self.rgjs[:] = [rgj for rgj, kept in zip(self.rgjs, keep) if kept]
 
-        if self.__reload_center:
+        bboxes = self.__bboxes[:len(keep)][keep]
+        self.__bboxes = np.zeros((0, 2, 2))
+        self.bbox = None
+        self.__append_bboxes__(bboxes)
+
+        if self.index is not None:
+            self.index.remove(idxs)
+        self.__changed__()
+
+        if self.__reload_center and len(self.rgjs):
             self.center_point = self.__calculate_center_point__()
 
     def toRGeoJSON(self, return_bbox=False) -> RGeoJSONCollection:\
@@ -565,12 +1133,31 @@ class PotentialField():
         point = np.array(point)
         return np.nonzero([rgj.in_bbox(point) for rgj in self.rgjs])[0]
     
-    def repulsion_vectors(self, points: Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None, min_dist_select:bool = True, reference_idx = False) -> Union[np.ndarray, RepulsionVectorsAndRef]:
+    def repulsion_vectors(self, points: Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None, min_dist_select:bool = True, reference_idx = False, cull = True) -> Union[np.ndarray, RepulsionVectorsAndRef]:
+        """
+        If the index is enabled (and cull), vectors of RGJs whose influence box does not contain the point are np.inf
+        """
         points = np.array(points)
         if not len(self):
             return points*np.inf
         filted_idx = filted_idx if not filted_idx is None else list(range(len(self)))
 
+        if self.index is not None and cull and min_dist_select:
+            positions:Dict[int, List[int]] = {} # rows of every id, repeated ids included
+            for position, idx in enumerate(filted_idx):
+                positions.setdefault(int(idx), []).append(position)
+            repulsion_vectors = np.full((len(filted_idx), len(points), 2), np.inf)
+
+            for idx, select in self.__candidate_groups__(points, filted_idx):
+                vectors = self.rgjs[idx].repulsion_vector(points[select], min_dist_select=True).reshape(-1, 2)
+                for position in positions[int(idx)]:
+                    repulsion_vectors[position, select] = vectors
+
+            repulsion_vectors = repulsion_vectors.reshape(-1, 2)
+            if reference_idx:
+                return repulsion_vectors, np.repeat(np.asarray(filted_idx, dtype=int), len(points))
+            return repulsion_vectors
+
         if reference_idx:
             idxs = []
             repulsion_vectors = []
@@ -588,18 +1175,52 @@ class PotentialField():
             rgjs = [self.rgjs[idx] for idx in filted_idx]
             return np.concatenate([rgj.repulsion_vector(points, min_dist_select=min_dist_select).reshape(-1, 2) for rgj in rgjs], axis=0)
         
+    def eval_gradient(self, points: Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None, reference_idx = False) -> Union[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Returns potential, gradient and (if reference_idx) the index of the RGJ owning each point
+        from one repulsion vector evaluation per RGJ. Points without an owner get index -1
+        """
+        points = np.array(points)
+        n = len(points)
+
+        dists = np.full(n, np.inf)
+        evals = np.zeros(n, dtype=float)
+        grads = np.zeros((n, 2), dtype=float)
+        owners = -np.ones(n, dtype=int)
+
+        if self.index is not None:
+            groups = self.__candidate_groups__(points, filted_idx)
+        else:
+            everything = np.arange(n)
+            groups = [(idx, everything) for idx in (range(len(self)) if filted_idx is None else filted_idx)]
+
+        for idx, select in groups:
+            rgj_dists, rgj_evals, rgj_grads = self.rgjs[idx].__fused__(points[select])
+
+            better = rgj_dists < dists[select]
+            select = select[better]
+            dists[select], evals[select], grads[select], owners[select] = rgj_dists[better], rgj_evals[better], rgj_grads[better], idx
+
+        return (evals, grads, owners) if reference_idx else (evals, grads)
+
     def gradient(self, points: Union[np.ndarray, List[Point]], min_dist_select=True) -> np.ndarray:
         points = np.array(points)
         if not len(self):
             return points*0.0
-        _, grad_idxs = self.squared_dist(points=points, reference_idx=True)
+        
+        if not min_dist_select:
+            # per-element gradients of the nearest RGJ
+            dists, grad_idxs = self.squared_dist(points=points, reference_idx=True)
+
+            grad = np.zeros((len(points), 2), dtype=float)
+            active = np.isfinite(dists) # points outside every influence box keep a zero gradient
+            for idx in set(grad_idxs[active]):
+                select = (idx == grad_idxs) & active
+                grad[select] = self.rgjs[idx].gradient(points[select], min_dist_select=False)
 
-        grad = np.ones((len(points), 2), dtype=float)
-        for idx in set(grad_idxs):
-            select = idx == grad_idxs
-            grad[select] = self.rgjs[idx].gradient(points[select], min_dist_select=min_dist_select)
+            return grad
 
-        return grad
+        return self.eval_gradient(points)[1]
 
     def eval(self, points: Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None) -> np.ndarray:
         points = np.array(points)
@@ -608,6 +1229,12 @@ class PotentialField():
         if not len(rgjs):
             return points.sum(1)*0.0
         
+        if self.index is not None:
+            evals = np.zeros(len(points), dtype=float)
+            for idx, select in self.__candidate_groups__(points, filted_idx):
+                evals[select] = np.maximum(evals[select], self.rgjs[idx].eval(points[select]))
+            return evals
+        
         return np.max(np.stack([rgj.eval(points) for rgj in rgjs], axis=1), axis=1)
     
     def eval_per(self, points: Union[np.ndarray, List[Point]], idxs:Optional[List[int]] = None) -> np.ndarray:
@@ -618,6 +1245,16 @@ class PotentialField():
         n = len(points)
         idxs = np.array(idxs, dtype=int)
         
+        if self.index is not None:
+            boxes = self.index.boxes[idxs]
+            inside = ((points >= boxes[:, 0]) & (points <= boxes[:, 1])).all(1)
+
+            evals = np.zeros(n, dtype=float)
+            for idx in set(idxs[inside]):
+                select = (idx == idxs) & inside
+                evals[select] = self.rgjs[idx].eval(points[select])
+            return evals
+        
         evals = np.ones(n, dtype=points[0].dtype)
         for idx in set(idxs):
             select = idx == idxs
@@ -625,7 +1262,10 @@ class PotentialField():
 
         return evals
     
-    def estimate_route_area(self, route:Union[List[Point], np.ndarray], step=1e-3, n=0, scale_transform:FieldScaleTransform = lambda x: x) -> float:
+    def estimate_route_area(self, route:Union[List[Point], np.ndarray], step=1e-3, n=0, scale_transform:FieldScaleTransform = lambda x: x, adaptive=False, rtol=0.0, atol=1e-6) -> float:
+        if adaptive:
+            return self.integrate_route_area(route, rtol=rtol, atol=atol, scale_transform=scale_transform)
+        
         route = np.array(route)
 
         points, step, _ = lpf.interpolate_along_route(route=route, step=step, n=n, return_step_n=True)
@@ -635,7 +1275,81 @@ class PotentialField():
 
         return f_eval.sum()*step
     
-    def estimate_route_highest_potential(self, route:Union[List[Point], np.ndarray], step=1e-2, n=0, scale_transform:FieldScaleTransform = lambda x: x) -> float:
+    def integrate_route_area(self, route:Union[List[Point], np.ndarray], rtol=0.0, atol=1e-6, max_step:Optional[float] = None, scale_transform:FieldScaleTransform = lambda x: x, return_error=False, max_depth=30) -> Union[float, Tuple[float, float]]:
+        """
+        Adaptive Simpson estimate of the potential integral along a route
+
+        Segments start as panels no longer than max_step (if not given, the shortest length scale of the RGJs
+        reaching the segment) and panels are bisected until their error estimate fits their share, by length,
+        of atol + rtol*|area|. Panels still above it at max_depth are accepted with a warning
+        """
+        route = np.array(route, dtype=float).reshape(-1, 2)
+        lengths = np.linalg.norm(np.diff(route, axis=0), axis=1)
+        total = lengths.sum()
+
+        if total <= 0.0 or not len(self):
+            return (0.0, 0.0) if return_error else 0.0
+
+        if max_step is None:
+            index = self.index if self.index is not None else BBoxIndex(self.__influence_bboxes__(self.rgjs, 1e-12))
+            segments = np.stack([np.minimum(route[:-1], route[1:]), np.maximum(route[:-1], route[1:])], axis=1)
+            seg_idxs, rgj_idxs = index.query_boxes(segments)
+
+            scales = np.array([rgj.length_scale() for rgj in self.rgjs], dtype=float)
+            max_step = np.full(len(lengths), np.inf) # segments far from every RGJ start as one panel
+            np.minimum.at(max_step, seg_idxs, scales[rgj_idxs])
+
+        panels_n = np.maximum(np.ceil(lengths/max_step), 1).astype(int)
+        segs = np.repeat(np.arange(len(lengths)), panels_n)
+        local = np.arange(panels_n.sum()) - np.repeat(np.cumsum(panels_n) - panels_n, panels_n)
+        diffs = route[segs + 1] - route[segs]
+
+        a = route[segs] + diffs*(local/panels_n[segs]).reshape(-1, 1)
+        b = route[segs] + diffs*((local + 1)/panels_n[segs]).reshape(-1, 1)
+        m = (a + b)/2.0
+        h = (lengths/panels_n)[segs]
+
+        # panel ends are the next panel starts, only the route end is new
+        f_eval = scale_transform(self.eval(np.concatenate([a, m, route[-1:]], axis=0)))
+        fa, fm = f_eval[:len(a)], f_eval[len(a):-1]
+        fb = np.append(fa[1:], f_eval[-1])
+
+        coarse = np.abs((h/6.0*(fa + 4.0*fm + fb)).sum())
+        tol = (atol + rtol*coarse)*h/total
+        unconverged = 0
+
+        area = error = 0.0
+        depth = 0
+        while len(h):
+            lq, rq = (a + m)/2.0, (m + b)/2.0
+            f_eval = scale_transform(self.eval(np.concatenate([lq, rq], axis=0)))
+            flq, frq = f_eval[:len(lq)], f_eval[len(lq):]
+
+            whole = h/6.0*(fa + 4.0*fm + fb)
+            halves = h/12.0*(fa + 4.0*flq + 2.0*fm + 4.0*frq + fb)
+            diff = halves - whole
+
+            converged = np.abs(diff) <= 15.0*tol
+            done = converged | (depth >= max_depth)
+            unconverged += int((done & ~converged).sum())
+            area += (halves[done] + diff[done]/15.0).sum()
+            error += np.abs(diff[done]).sum()/15.0
+
+            keep = ~done
+            a, m, b = np.concatenate([a[keep], m[keep]]), np.concatenate([lq[keep], rq[keep]]), np.concatenate([m[keep], b[keep]])
+            fa, fm, fb = np.concatenate([fa[keep], fm[keep]]), np.concatenate([flq[keep], frq[keep]]), np.concatenate([fm[keep], fb[keep]])
+            h, tol = np.tile(h[keep]/2.0, 2), np.tile(tol[keep]/2.0, 2)
+            depth += 1
+
+        if unconverged:
+            warnings.warn(f"Route integration reached max_depth on {unconverged} panels without converging (error estimate {error:.3g})")
+
+        return (float(area), float(error)) if return_error else float(area)
+    
+    def estimate_route_highest_potential(self, route:Union[List[Point], np.ndarray], step=1e-2, n=0, scale_transform:FieldScaleTransform = lambda x: x, exact=False) -> float:
+        if exact:
+            return self.route_highest_potential(route, scale_transform=scale_transform)
+        
         route = np.array(route)
 
         points, step, _ = lpf.interpolate_along_route(route=route, step=step, n=n, return_step_n=True)
@@ -645,6 +1359,98 @@ class PotentialField():
 
         return f_eval.max()
     
+    def segment_squared_dist(self, starts:Union[np.ndarray, List[Point]], ends:Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None) -> np.ndarray:
+        """
+        Minimum squared distance to the closest RGJ along each segment start -> end.
+        With the index enabled, only RGJs whose influence box meets a segment's box are considered (inf when none do)
+        """
+        starts, ends = np.array(starts, dtype=float).reshape(-1, 2), np.array(ends, dtype=float).reshape(-1, 2)
+        dists = np.full(len(starts), np.inf)
+
+        if self.index is not None:
+            segment_boxes = np.stack([np.minimum(starts, ends), np.maximum(starts, ends)], axis=1)
+            segment_idxs, rgj_idxs = self.index.query_boxes(segment_boxes)
+
+            if filted_idx is not None:
+                keep = np.isin(rgj_idxs, filted_idx)
+                segment_idxs, rgj_idxs = segment_idxs[keep], rgj_idxs[keep]
+
+            order = np.argsort(rgj_idxs, kind='stable')
+            groups, first = np.unique(rgj_idxs[order], return_index=True)
+            for idx, select in zip(groups, np.split(segment_idxs[order], first[1:])):
+                dists[select] = np.minimum(dists[select], self.rgjs[idx].segment_squared_dist(starts[select], ends[select]))
+
+            return dists
+
+        for idx in (range(len(self.rgjs)) if filted_idx is None else filted_idx):
+            dists = np.minimum(dists, self.rgjs[idx].segment_squared_dist(starts, ends))
+
+        return dists
+
+    def route_highest_potential(self, route:Union[List[Point], np.ndarray], scale_transform:FieldScaleTransform = lambda x: x) -> float:
+        """
+        Highest potential along a route from the minimum squared distance along each of its segments.
+        Exact for point, line and rectangle RGJs, a bounded search for ellipses. The scale transform must be non-decreasing
+        """
+        route = np.array(route, dtype=float).reshape(-1, 2)
+        if not len(route):
+            raise ValueError("Route needs at least one point")
+        starts, ends = (route[:-1], route[1:]) if len(route) > 1 else (route, route)
+
+        if not len(self):
+            return float(scale_transform(np.zeros(1))[0])
+
+        dists = self.segment_squared_dist(starts, ends)
+        return float(scale_transform(np.exp(-dists.min(keepdims=True)))[0])
+    
+    def score_routes(self, routes:Union[List[List[Point]], np.ndarray], offsets:Optional[Union[List[int], np.ndarray]] = None, step=1e-3, scale_transform:FieldScaleTransform = lambda x: x, tolerance:Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Scores many routes in one pass. Returns per-route area (as `estimate_route_area`) and
+        highest potential (as `estimate_route_highest_potential`) for the given step
+
+        Routes are a list of routes or a flat point array with offsets. With a tolerance (the field's, if not given),
+        only RGJs whose influence box meets the bounding box of a route are evaluated along it.
+        Routes without samples get an area of 0 and a highest potential of nan
+        """
+        points, offsets = lpf.ragged_routes(routes, offsets)
+        samples, sample_offsets = lpf.interpolate_along_routes(points, offsets, step=step)
+        n_routes = len(offsets) - 1
+        samples_n = np.diff(sample_offsets)
+
+        tolerance = self.tolerance if tolerance is None else tolerance
+        if tolerance is None or not len(self):
+            evals = self.eval(samples) if len(samples) else np.zeros(0)
+        else:
+            index = self.index if tolerance == self.tolerance else BBoxIndex(self.__influence_bboxes__(self.rgjs, tolerance))
+
+            nonempty = np.diff(offsets) > 0
+            corridors = np.zeros((n_routes, 2, 2))
+            if nonempty.any():
+                corridors[nonempty, 0] = np.minimum.reduceat(points, offsets[:-1][nonempty], axis=0)
+                corridors[nonempty, 1] = np.maximum.reduceat(points, offsets[:-1][nonempty], axis=0)
+
+            scored = np.nonzero(samples_n > 0)[0]
+            route_idxs, rgj_idxs = index.query_boxes(corridors[scored])
+            route_idxs = scored[route_idxs]
+
+            order = np.argsort(rgj_idxs, kind='stable')
+            route_idxs, rgj_idxs = route_idxs[order], rgj_idxs[order]
+            groups, starts = np.unique(rgj_idxs, return_index=True)
+
+            evals = np.zeros(len(samples), dtype=float)
+            for idx, routes_select in zip(groups, np.split(route_idxs, starts[1:])):
+                select = lpf.__expand_ranges__(sample_offsets[:-1][routes_select], samples_n[routes_select])
+                evals[select] = np.maximum(evals[select], self.rgjs[idx].eval(samples[select]))
+
+        f_eval = scale_transform(evals)
+        sample_route = np.repeat(np.arange(n_routes), samples_n)
+
+        areas = np.bincount(sample_route, weights=f_eval, minlength=n_routes)*step
+        peaks = np.full(n_routes, np.nan)
+        np.fmax.at(peaks, sample_route, f_eval)
+
+        return areas, peaks
+    
     def squared_dist(self, points:Union[np.ndarray, List[Point]], filted_idx:Optional[List[int]] = None, scaled=True, inverted=True, reference_idx = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
         points = np.array(points)
         if not len(self):
@@ -689,6 +1495,17 @@ class PotentialField():
         if not len(self):
             warnings.warn("There are not any RGJs elements in the field")
             return np.ones((len(points), len(rgjs)))*np.inf
+        
+        if self.index is not None and scaled and inverted:
+            # pairs outside the influence boxes are reported as np.inf
+            columns:Dict[int, List[int]] = {} # columns of every id, repeated ids included
+            for column, idx in enumerate(range(len(self)) if filted_idx is None else filted_idx):
+                columns.setdefault(int(idx), []).append(column)
+
+            dists = np.full((len(points), len(rgjs)), np.inf)
+            for idx, select in self.__candidate_groups__(points, filted_idx):
+                dists[select[:, None], columns[int(idx)]] = self.rgjs[idx].squared_dist(points[select], scaled=scaled, inverted=inverted)[:, None]
+            return dists
 
         return np.stack([rgj.squared_dist(points, scaled=scaled, inverted=inverted) for rgj in rgjs], axis=1)
     
@@ -721,4 +1538,192 @@ class PotentialField():
         points = np.vstack([xgrid.ravel(), ygrid.ravel()]).T
 
         return self.eval(points, filted_idx=filted_idx).reshape((y_resolution, resolution))
-        
\ No newline at end of file
+        
+
+class CompiledField():
+    """
+    Compiled (read-only) form of a potential field
+
+    Points, rectangles and ellipses are packed per type into contiguous arrays and evaluated with one
+    broadcast kernel per type. Any other RGJ is evaluated through its own object.
+    The arrays are rebuilt whenever the version of the field changes.
+    """
+
+    def __init__(self, field:PotentialField) -> None:
+        self.field = field
+        self.build()
+
+    def __len__(self) -> int:
+        return len(self.field)
+
+    @staticmethod
+    def __quadratic_form__(matrices:np.ndarray) -> Tuple[np.ndarray, str]:
+        """
+        Returns coefficients (a, b, c) of a*vx^2 + b*vx*vy + c*vy^2 and the cheapest kernel that evaluates them
+        """
+        coefs = np.stack([matrices[:, 0, 0], matrices[:, 0, 1] + matrices[:, 1, 0], matrices[:, 1, 1]], axis=1)
+
+        if not (coefs[:, 1] == 0.0).all():
+            return coefs, "general"
+        if (coefs[:, 0] == coefs[:, 2]).all():
+            return coefs, "isotropic"
+        return coefs, "diagonal"
+
+    def build(self) -> None:
+        self.version = self.field.version
+        rgjs = self.field.rgjs
+
+        types = {"Point": [], "Rectangle": [], "Ellipse": []}
+        self.others = []
+        for idx, rgj in enumerate(rgjs):
+            if type(rgj).__name__ == rgj.RGJType + "RGJ" and rgj.RGJType in types:
+                types[rgj.RGJType].append(idx)
+            else:
+                self.others.append(idx)
+
+        self.groups = {}
+        for rgj_type, ids in types.items():
+            if not len(ids):
+                continue
+
+            inv_repulsions = np.array([rgjs[idx].inv_repulsion for idx in ids], dtype=float).reshape(-1, 2, 2)
+            coefs, kernel = self.__quadratic_form__(inv_repulsions)
+            group = {
+                'ids': np.array(ids, dtype=int),
+                'coefs': coefs,
+                'kernel': kernel,
+                'grad_matrixes': np.array([rgjs[idx].grad_matrix for idx in ids], dtype=float).reshape(-1, 2, 2),
+                'coordinates': np.array([rgjs[idx].coordinates for idx in ids], dtype=float)
+            }
+
+            if rgj_type == "Rectangle":
+                group['x1_abs_x2'] = np.abs(group['coordinates'][:, 0] - group['coordinates'][:, 1])
+            elif rgj_type == "Ellipse":
+                group['inv_shapes'] = np.array([rgjs[idx].inv_shape for idx in ids], dtype=float).reshape(-1, 2, 2)
+                group['den_buffer'] = rgjs[ids[0]].DEN_ERROR_BUFFER
+
+            self.groups[rgj_type] = group
+
+    def __check__(self) -> None:
+        if self.version != self.field.version:
+            self.build()
+
+    @staticmethod
+    def __vectors__(rgj_type:str, group:dict, x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Components (points x elements) of the repulsion vectors for all elements of a type
+        """
+        coordinates = group['coordinates']
+
+        if rgj_type == "Point":
+            return x[:, 0:1] - coordinates[:, 0], x[:, 1:2] - coordinates[:, 1]
+        if rgj_type == "Rectangle":
+            components = []
+            for ax in range(2):
+                x_d_x1 = x[:, ax:ax+1] - coordinates[:, 0, ax]
+                x_d_x2 = x[:, ax:ax+1] - coordinates[:, 1, ax]
+                components.append(0.5*np.sign(x_d_x1)*(np.abs(x_d_x1) + np.abs(x_d_x2) - group['x1_abs_x2'][:, ax]))
+            return tuple(components)
+
+        inv_shapes = group['inv_shapes']
+        dx, dy = x[:, 0:1] - coordinates[:, 0], x[:, 1:2] - coordinates[:, 1]
+        Binvx0 = dx*inv_shapes[:, 0, 0] + dy*inv_shapes[:, 0, 1]
+        Binvx1 = dx*inv_shapes[:, 1, 0] + dy*inv_shapes[:, 1, 1]
+        den = np.maximum(np.sqrt(Binvx0*Binvx0 + Binvx1*Binvx1), group['den_buffer'])
+        scale = np.maximum(1 - 1/den, 0)
+        return scale*dx, scale*dy
+
+    @staticmethod
+    def __squared_dist__(group:dict, vx:np.ndarray, vy:np.ndarray) -> np.ndarray:
+        coefs = group['coefs']
+
+        if group['kernel'] == "isotropic":
+            return coefs[:, 0]*(vx*vx + vy*vy)
+        if group['kernel'] == "diagonal":
+            return coefs[:, 0]*(vx*vx) + coefs[:, 2]*(vy*vy)
+        return coefs[:, 0]*(vx*vx) + coefs[:, 1]*(vx*vy) + coefs[:, 2]*(vy*vy)
+
+    def __nearest__(self, points:np.ndarray, return_vectors = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns, per point, the smallest squared distance, the index of the RGJ attaining it
+        and (if requested) its repulsion vector. Ties go to the lowest RGJ index
+        """
+        self.__check__()
+        n = len(points)
+        dists = np.full(n, np.inf)
+        owners = np.full(n, len(self.field), dtype=int)
+        vectors = np.zeros((n, 2)) if return_vectors else None
+
+        def merge(select:np.ndarray, new_dists:np.ndarray, new_owners:np.ndarray, new_vectors:Optional[np.ndarray]):
+            better = (new_dists < dists[select]) | ((new_dists == dists[select]) & (new_owners < owners[select]))
+            idxs = np.arange(n)[select][better]
+            dists[idxs], owners[idxs] = new_dists[better], new_owners[better]
+            if new_vectors is not None:
+                vectors[idxs] = new_vectors[better]
+
+        for rgj_type, group in self.groups.items():
+            for select in __batch_slices__(n, len(group['ids']), RGJGeometry.MAX_BATCH_BYTES):
+                vx, vy = self.__vectors__(rgj_type, group, points[select])
+                type_dists = self.__squared_dist__(group, vx, vy)
+
+                local = type_dists.argmin(1)
+                rows = np.arange(len(local))
+                type_vectors = np.stack([vx[rows, local], vy[rows, local]], axis=1) if return_vectors else None
+                merge(select, type_dists[rows, local], group['ids'][local], type_vectors)
+
+        everything = slice(0, n)
+        for idx in self.others:
+            merge(everything, self.field.rgjs[idx].squared_dist(points), np.full(n, idx), None)
+
+        return dists, owners, vectors
+
+    def squared_dist(self, points:Union[np.ndarray, List[Point]], reference_idx = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        if not len(self):
+            warnings.warn("There are not any RGJs elements in the field")
+            if reference_idx:
+                return points.sum(1)*np.inf, -np.ones_like(points.sum(1))
+            return points.sum(1)*np.inf
+
+        dists, owners, _ = self.__nearest__(points)
+
+        return (dists, owners) if reference_idx else dists
+
+    def eval(self, points:Union[np.ndarray, List[Point]]) -> np.ndarray:
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        if not len(self):
+            return points.sum(1)*0.0
+
+        return np.exp(-self.__nearest__(points)[0])
+
+    def gradient(self, points:Union[np.ndarray, List[Point]]) -> np.ndarray:
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        if not len(self):
+            return points*0.0
+
+        return self.eval_gradient(points)[1]
+
+    def eval_gradient(self, points:Union[np.ndarray, List[Point]], reference_idx = False) -> Union[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Returns potential, gradient and (if reference_idx) the index of the RGJ owning each point
+        """
+        points = np.array(points, dtype=float).reshape(-1, 2)
+        if not len(self):
+            evals, grads, owners = points.sum(1)*0.0, points*0.0, -np.ones(len(points), dtype=int)
+            return (evals, grads, owners) if reference_idx else (evals, grads)
+
+        dists, owners, vectors = self.__nearest__(points, return_vectors=True)
+        evals = np.exp(-dists)
+
+        grad = np.zeros((len(points), 2), dtype=float)
+        for group in self.groups.values():
+            local = np.searchsorted(group['ids'], owners)
+            select = group['ids'][np.minimum(local, len(group['ids']) - 1)] == owners
+            grad_matrixes = group['grad_matrixes'][local[select]]
+            grad[select] = - evals[select].reshape(-1, 1) * np.einsum('ijk,ik->ij', grad_matrixes, vectors[select])
+
+        for idx in set(owners.tolist()) & set(self.others):
+            select = owners == idx
+            grad[select] = self.field.rgjs[idx].gradient(points[select])
+
+        return (evals, grad, owners) if reference_idx else (evals, grad)
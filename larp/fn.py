@@ -1,5 +1,5 @@
 
-from typing import List, Tuple, Union
+from typing import List, Optional, Tuple, Union
 import numpy as np
 from larp.types import Point
 from pyproj import CRS, Transformer
@@ -61,4 +61,64 @@ def interpolate_along_route(route:Union[List[Point], np.ndarray], step=1e-3, n=0
 
     points = line_starts[lines_idx] + uni_vectors[lines_idx]*relative_offset.reshape(-1, 1)
 
-    return points if not return_step_n else (points, step, n)
\ No newline at end of file
+    return points if not return_step_n else (points, step, n)
+
+def __expand_ranges__(starts:np.ndarray, counts:np.ndarray) -> np.ndarray:
+    """
+    Concatenates [start, start + count) ranges into one flat index array
+    """
+    counts = np.asarray(counts, dtype=int)
+    if not counts.sum():
+        return np.zeros(0, dtype=int)
+
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(np.asarray(starts, dtype=int), counts) + np.arange(counts.sum()) - offsets
+
+def ragged_routes(routes:Union[List[List[Point]], np.ndarray], offsets:Optional[Union[List[int], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns routes as a flat point array and offsets, where route i is points[offsets[i]:offsets[i+1]]
+    """
+    if offsets is not None:
+        return np.asarray(routes, dtype=float).reshape(-1, 2), np.asarray(offsets, dtype=int)
+
+    routes = [np.asarray(route, dtype=float).reshape(-1, 2) for route in routes]
+    offsets = np.concatenate([[0], np.cumsum([len(route) for route in routes])]).astype(int)
+    points = np.concatenate(routes, axis=0) if len(routes) else np.zeros((0, 2))
+
+    return points, offsets
+
+def interpolate_along_routes(routes:Union[List[List[Point]], np.ndarray], offsets:Optional[Union[List[int], np.ndarray]] = None, step=1e-3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return equally spaced points along many routes in one pass
+
+    Routes are either a list of routes or a flat point array with offsets (see `ragged_routes`).
+    Samples of route i are points[sample_offsets[i]:sample_offsets[i+1]], matching `interpolate_along_route(route, step)`
+    """
+    points, offsets = ragged_routes(routes, offsets)
+    n_routes = len(offsets) - 1
+
+    # segments joining consecutive points of the same route
+    seg_route = np.repeat(np.arange(n_routes), np.maximum(np.diff(offsets) - 1, 0))
+    seg_starts = __expand_ranges__(offsets[:-1], np.maximum(np.diff(offsets) - 1, 0))
+    line_starts, line_ends = points[seg_starts], points[seg_starts + 1]
+    lines_diff = line_ends - line_starts
+    lines_dist = np.linalg.norm(lines_diff, axis=1)
+
+    first_seg = np.concatenate([[0], np.cumsum(np.maximum(np.diff(offsets) - 1, 0))]).astype(int)
+    joints_dist = np.cumsum(lines_dist)
+    route_base = np.concatenate([[0.0], joints_dist])[first_seg[:-1]]
+    total_dist = np.concatenate([[0.0], joints_dist])[first_seg[1:]] - route_base
+
+    samples_n = np.ceil(total_dist/step).astype(int)
+    sample_offsets = np.concatenate([[0], np.cumsum(samples_n)]).astype(int)
+    sample_route = np.repeat(np.arange(n_routes), samples_n)
+    offset = (np.arange(sample_offsets[-1]) - sample_offsets[:-1][sample_route])*step
+
+    lines_idx = np.searchsorted(joints_dist, route_base[sample_route] + offset, side='left')
+    lines_idx = np.clip(lines_idx, first_seg[:-1][sample_route], first_seg[1:][sample_route] - 1)
+    relative_offset = route_base[sample_route] + offset - np.concatenate([[0.0], joints_dist])[lines_idx]
+
+    uni_vectors = lines_diff/lines_dist.reshape(-1, 1)
+    samples = line_starts[lines_idx] + uni_vectors[lines_idx]*relative_offset.reshape(-1, 1)
+
+    return samples, sample_offsets
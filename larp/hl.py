@@ -1,10 +1,13 @@
 
+import threading
+import time
 from typing import List, Optional, Tuple, Union
 import warnings
 import numpy as np
 from larp.field import PotentialField, RGJGeometry
-from larp.quad import QuadTree, QuadNode
-from larp.network import RoutingNetwork
+from larp.quad import QuadTree, QuadNode, __flatten_quads__, __unflatten_quads__
+from larp.network import RoutingNetwork, default_scale_transform
+from larp.types import FieldScaleTransform, Point, RoutingAlgorithmStr
 
 """
 Author: Josue N Rivera
@@ -36,8 +39,7 @@ class HotLoader(object):
         n_original = len(self.field)
         
         # Add rgj to field
-        for rgj in new_field:
-            self.field.addRGJ(rgj=rgj)
+        self.field.addRGJs(new_field.rgjs)
         
         # Update field idx in new quadtree
         def update_idx(quad:QuadNode):
@@ -53,6 +55,7 @@ class HotLoader(object):
         # Update quadtree
         graph_active_quad_new = set()
         graph_active_quad_old = set()
+        graph_active_quad_touched = set() # leaves kept whose zones changed
 
         def replace_branch(rootquad, newquad, child):
             rootquad[child] = newquad[child]
@@ -77,6 +80,8 @@ class HotLoader(object):
                 rootquad.boundary_zone = newquad.boundary_zone
             rootquad.rgj_idx = np.append(rootquad.rgj_idx, newquad.rgj_idx)
             rootquad.rgj_zones = np.append(rootquad.rgj_zones, newquad.rgj_zones)
+            if rootquad.leaf:
+                graph_active_quad_touched.add(rootquad)
 
             if rootquad.leaf and not newquad.leaf:
                 return True
@@ -110,6 +115,8 @@ class HotLoader(object):
             del node
 
         # add new references
+        self.quadtree.reset_locator()
+        self.network.invalidate(graph_active_quad_touched)
         self.network.__fill_shallow_neighs__()
         self.network.__build_graph__(graph_active_quad_new, overwrite_directed=False)
 
@@ -150,6 +157,7 @@ class HotLoader(object):
         # update quadtree
         graph_active_quad_new = set()
         graph_active_quad_old = set()
+        graph_active_quad_touched = set() # leaves kept whose zones changed
 
         def update_rgj_index(quad:QuadNode):
             original_idx = quad.rgj_idx.copy()
@@ -164,6 +172,8 @@ class HotLoader(object):
                     quad.rgj_idx = quad.rgj_idx[inv_mask] 
                     quad.rgj_zones = quad.rgj_zones[inv_mask]
                     quad.boundary_zone = min(quad.rgj_zones) if len(quad.rgj_idx) > 0 else self.quadtree.n_zones
+                    if quad.leaf:
+                        graph_active_quad_touched.add(quad)
 
         def recursive_update_rgj_index(quad:QuadNode):
             if quad is None or not len(quad.rgj_idx) or all(quad.rgj_idx < min_idx): return
@@ -191,6 +201,8 @@ class HotLoader(object):
                 rootquad.boundary_zone = min(rootquad.rgj_zones) if len(rootquad.rgj_idx) > 0 else self.quadtree.n_zones
             elif not len(rootquad.rgj_idx):
                 rootquad.boundary_zone = self.quadtree.n_zones
+            if rootquad.leaf:
+                graph_active_quad_touched.add(rootquad)
 
             # Update indexes in quad
             update_rgj_index(rootquad)
@@ -219,6 +231,8 @@ class HotLoader(object):
             return False
 
         update_quad(self.quadtree.root, search_qtree.root)
+        # a quad merged and then swallowed by the merge of an ancestor is in both sets, and must not be linked back in
+        graph_active_quad_new -= graph_active_quad_old
 
         # delete old reference
         for node in graph_active_quad_old:
@@ -226,6 +240,8 @@ class HotLoader(object):
            del node
 
         # add new references
+        self.quadtree.reset_locator()
+        self.network.invalidate(graph_active_quad_touched)
         self.network.__fill_shallow_neighs__()
         self.network.__build_graph__(graph_active_quad_new, overwrite_directed=False)
 
@@ -236,4 +252,133 @@ class HotLoader(object):
                 return search_qtree
             return search_field, search_qtree
         else:
-            del pop_field, pop_tree
\ No newline at end of file
+            del pop_field, pop_tree
+
+
+class ProgressiveLoader(object):
+    """
+    Builds the quadtree and routing network progressively. A coarse tree is built within the startup
+    budget (initial_depth levels and/or time_budget seconds) and is then refined one level at a time in a
+    background thread. Each finished level is published as a new (quadtree, network) snapshot, which is
+    never modified afterwards, so routes are always found on a consistent tree
+    """
+
+    def __init__(self, field:PotentialField,
+                 minimum_length_limit:float = 5.0,
+                 maximum_length_limit:float = np.inf,
+                 edge_bounds:Union[np.ndarray, List[float]] = np.arange(0.2, 0.8, 0.2),
+                 conservative:bool = False,
+                 initial_depth:Optional[int] = 4,
+                 time_budget:Optional[float] = None,
+                 background:bool = True) -> None:
+        
+        self.field = field
+        self.version = 0
+        self.__snapshot:Optional[Tuple[QuadTree, RoutingNetwork]] = None
+        self.__stop = threading.Event()
+        self.__done = threading.Event()
+        self.__thread:Optional[threading.Thread] = None
+
+        start = time.perf_counter()
+
+        # working tree, only touched by the building thread
+        self.__tree = QuadTree(field,
+                               minimum_length_limit=minimum_length_limit,
+                               maximum_length_limit=maximum_length_limit,
+                               edge_bounds=edge_bounds,
+                               conservative=conservative)
+        self.__tree.build(lazy_depth=0)
+        self.__unrefined = [quad for quad in self.__tree.leaves if quad.unrefined]
+        self.depth = 0
+
+        quad_time:Optional[float] = None # seconds per refined quad, measured on the first level
+        while self.__unrefined and (initial_depth is None or self.depth < initial_depth):
+            if time_budget is not None:
+                # levels grow with the quads left to refine, so skip one predicted to overrun the budget
+                elapsed = time.perf_counter() - start
+                predicted = 0.0 if quad_time is None else 2.0*quad_time*len(self.__unrefined)
+                if elapsed + predicted > time_budget:
+                    break
+
+            refined = len(self.__unrefined)
+            level_start = time.perf_counter()
+            self.refine_level()
+            quad_time = (time.perf_counter() - level_start)/refined
+
+        self.__publish__()
+
+        if not self.__unrefined:
+            self.__done.set()
+        elif background:
+            self.__thread = threading.Thread(target=self.__run__, daemon=True)
+            self.__thread.start()
+
+    @property
+    def snapshot(self) -> Tuple[QuadTree, RoutingNetwork]:
+        """
+        Latest published (quadtree, network) pair
+        """
+        return self.__snapshot
+    
+    @property
+    def quadtree(self) -> QuadTree:
+        return self.__snapshot[0]
+    
+    @property
+    def network(self) -> RoutingNetwork:
+        return self.__snapshot[1]
+
+    @property
+    def complete(self) -> bool:
+        return self.__done.is_set()
+
+    def refine_level(self) -> None:
+        """
+        Refines the working tree one level, without publishing it
+        """
+        children = self.__tree.refine_leaves(self.__unrefined)
+        self.__unrefined = [quad for quad in children if quad.unrefined]
+        self.depth += 1
+
+    def __publish__(self) -> None:
+        tree = QuadTree(self.field,
+                        minimum_length_limit=self.__tree.min_sector_size,
+                        maximum_length_limit=self.__tree.max_sector_size,
+                        edge_bounds=self.__tree.edge_bounds,
+                        size=self.__tree.size,
+                        conservative=self.__tree.conservative)
+        
+        # copies drop the unrefined marks, so coarse quads route as plain leaves
+        tree.root, tree.leaves = __unflatten_quads__(__flatten_quads__(self.__tree.root))
+        network = RoutingNetwork(tree, build_network=True)
+
+        self.__snapshot = (tree, network) # a single assignment, so readers see either snapshot whole
+        self.version += 1
+
+    def __run__(self) -> None:
+        while self.__unrefined and not self.__stop.is_set():
+            self.refine_level()
+            self.__publish__()
+
+        if not self.__unrefined:
+            self.__done.set()
+
+    def wait(self, timeout:Optional[float] = None) -> bool:
+        """
+        Waits for the fully refined snapshot. Returns whether it was published
+        """
+        return self.__done.wait(timeout)
+
+    def stop(self) -> None:
+        """
+        Stops the background refinement after the level in progress
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def find_route(self, pointA:Point, pointB:Point, scale_tranform:FieldScaleTransform=default_scale_transform, alg:RoutingAlgorithmStr='A*', penalty:float=10.0) -> Optional[List[QuadNode]]:
+        return self.network.find_route(pointA, pointB, scale_tranform=scale_tranform, alg=alg, penalty=penalty)
+
+    def find_many_routes(self, pointsA:Point, pointsB:Point, scale_tranform:FieldScaleTransform=default_scale_transform, alg:RoutingAlgorithmStr='A*') -> List[Optional[List[QuadNode]]]:
+        return self.network.find_many_routes(pointsA, pointsB, scale_tranform=scale_tranform, alg=alg)
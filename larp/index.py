@@ -0,0 +1,264 @@
+from typing import Optional, Tuple, Union
+import numpy as np
+from larp.fn import __expand_ranges__
+
+"""
+Author: Josue N Rivera
+
+Spatial indexes used to cull geometry-point pairs
+"""
+
+class BBoxIndex():
+    """
+    Uniform grid over axis-aligned boxes (n x 2 x 2 as [[min_x, min_y], [max_x, max_y]])
+
+    The grid is rebuilt lazily after boxes are added or removed
+    """
+
+    MAX_CELLS_PER_AXIS = 1024
+
+    def __init__(self, boxes:Optional[np.ndarray] = None, cell_size:Optional[float] = None) -> None:
+        self.__buffer = np.zeros((0, 2, 2), dtype=float) # boxes with spare capacity for appends
+        self.__n = 0
+        self.cell_size = cell_size
+        self.__fixed_cell_size = cell_size is not None
+        self.__dirty = True
+
+        if boxes is not None:
+            self.add(boxes)
+
+    def __len__(self) -> int:
+        return self.__n
+
+    @property
+    def boxes(self) -> np.ndarray:
+        return self.__buffer[:self.__n]
+
+    def add(self, boxes:np.ndarray) -> None:
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 2, 2)
+        n = self.__n + len(boxes)
+
+        if n > len(self.__buffer):
+            buffer = np.zeros((max(2*len(self.__buffer), n), 2, 2), dtype=float)
+            buffer[:self.__n] = self.boxes
+            self.__buffer = buffer
+
+        self.__buffer[self.__n:n] = boxes
+        self.__n = n
+        self.__dirty = True
+
+    def remove(self, idxs:Union[int, np.ndarray]) -> None:
+        self.__buffer = np.delete(self.boxes, idxs, axis=0)
+        self.__n = len(self.__buffer)
+        self.__dirty = True
+
+    def update(self, idxs:Union[int, np.ndarray], boxes:np.ndarray) -> None:
+        self.boxes[idxs] = np.asarray(boxes, dtype=float).reshape(-1, 2, 2)
+        self.__dirty = True
+
+    def __cell_ranges__(self, boxes:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        low = np.floor((boxes[:, 0] - self.origin)/self.cell_size).astype(int)
+        high = np.floor((boxes[:, 1] - self.origin)/self.cell_size).astype(int)
+
+        return np.clip(low, 0, self.shape - 1), np.clip(high, 0, self.shape - 1)
+
+    def __box_cells__(self, boxes:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (box index, cell key) pairs for every cell overlapped by each box
+        """
+        low, high = self.__cell_ranges__(boxes)
+        spans = high - low + 1
+        counts = spans.prod(1)
+
+        box_idxs = np.repeat(np.arange(len(boxes)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        span_y = spans[box_idxs, 1]
+        cx = low[box_idxs, 0] + local//span_y
+        cy = low[box_idxs, 1] + local%span_y
+
+        return box_idxs, cx*self.shape[1] + cy
+
+    def __build__(self) -> None:
+        self.__dirty = False
+        if not len(self.boxes):
+            self.origin, self.shape = np.zeros(2), np.ones(2, dtype=int)
+            self.cell_size = 1.0 if self.cell_size is None else self.cell_size
+            self.cell_keys = self.cell_starts = self.cell_ends = self.entries = np.zeros(0, dtype=int)
+            return
+
+        self.origin = self.boxes[:, 0].min(0)
+        span = np.maximum(self.boxes[:, 1].max(0) - self.origin, 1e-12)
+
+        if not self.__fixed_cell_size:
+            extents = (self.boxes[:, 1] - self.boxes[:, 0]).max(1)
+            self.cell_size = max(float(np.median(extents)), float(span.max())/self.MAX_CELLS_PER_AXIS, 1e-12)
+
+        self.shape = np.floor(span/self.cell_size).astype(int) + 1
+
+        box_idxs, keys = self.__box_cells__(self.boxes)
+        order = np.argsort(keys, kind='stable')
+        keys, self.entries = keys[order], box_idxs[order]
+
+        self.cell_keys, self.cell_starts = np.unique(keys, return_index=True)
+        self.cell_ends = np.append(self.cell_starts[1:], len(keys))
+
+    def __lookup__(self, keys:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns start and count of the entries stored in each cell key
+        """
+        if not len(self.cell_keys):
+            return np.zeros(len(keys), dtype=int), np.zeros(len(keys), dtype=int)
+
+        loc = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+        found = self.cell_keys[loc] == keys
+
+        return self.cell_starts[loc], np.where(found, self.cell_ends[loc] - self.cell_starts[loc], 0)
+
+    def query_points(self, points:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns (point index, box index) pairs for every box containing a point
+        """
+        if self.__dirty: self.__build__()
+
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        cells = np.floor((points - self.origin)/self.cell_size).astype(int)
+        inside = ((cells >= 0) & (cells < self.shape)).all(1)
+
+        point_idxs = np.nonzero(inside)[0]
+        starts, counts = self.__lookup__(cells[inside, 0]*self.shape[1] + cells[inside, 1])
+
+        point_idxs = np.repeat(point_idxs, counts)
+        box_idxs = self.entries[__expand_ranges__(starts, counts)]
+
+        boxes = self.boxes[box_idxs]
+        select = ((points[point_idxs] >= boxes[:, 0]) & (points[point_idxs] <= boxes[:, 1])).all(1)
+
+        return point_idxs[select], box_idxs[select]
+
+    def query_boxes(self, boxes:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns unique (query index, box index) pairs for every indexed box overlapping a query box
+        """
+        if self.__dirty: self.__build__()
+
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 2, 2)
+        if not len(self.boxes) or not len(boxes):
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        grid_max = self.origin + self.shape*self.cell_size
+        overlap = ((boxes[:, 1] >= self.origin) & (boxes[:, 0] <= grid_max)).all(1)
+
+        # query boxes spanning more cells than there are boxes are compared against every box
+        low, high = self.__cell_ranges__(boxes)
+        wide = overlap & ((high - low + 1).prod(1) > len(self.boxes))
+        query_idxs = np.nonzero(overlap & ~wide)[0]
+        wide_idxs = np.nonzero(wide)[0]
+
+        pair_query, keys = self.__box_cells__(boxes[query_idxs])
+        starts, counts = self.__lookup__(keys)
+
+        pair_query = np.concatenate([query_idxs[np.repeat(pair_query, counts)], np.repeat(wide_idxs, len(self.boxes))])
+        box_idxs = np.concatenate([self.entries[__expand_ranges__(starts, counts)], np.tile(np.arange(len(self.boxes)), len(wide_idxs))])
+
+        pairs = np.unique(pair_query*len(self.boxes) + box_idxs)
+        pair_query, box_idxs = pairs//len(self.boxes), pairs%len(self.boxes)
+
+        query, found = boxes[pair_query], self.boxes[box_idxs]
+        select = ((query[:, 1] >= found[:, 0]) & (query[:, 0] <= found[:, 1])).all(1)
+
+        return pair_query[select], box_idxs[select]
+
+class PointTreeIndex():
+    """
+    Balanced KD-tree over points answering exact euclidean nearest-neighbour queries
+
+    Points are split at the median of the widest axis down to buckets of at most BUCKET_SIZE points, so clustered
+    points get as many buckets as spread ones. Queries descend the tree level by level, pruning the nodes whose box
+    is farther than the farthest corner of the closest box, and run in chunks of QUERY_CHUNK to bound memory
+    """
+
+    BUCKET_SIZE = 16
+    QUERY_CHUNK = 4096
+
+    def __init__(self, points:np.ndarray) -> None:
+        self.points = np.asarray(points, dtype=float).reshape(-1, 2)
+        n = len(self.points)
+        if not n:
+            raise ValueError("Point index requires at least one point")
+
+        self.depth = max(int(np.ceil(np.log2(n/self.BUCKET_SIZE))), 0)
+
+        # node i of a level with 2**level nodes holds entries [i*n//2**level, (i + 1)*n//2**level), so children split their parent
+        entries = np.arange(n)
+        for level in range(self.depth):
+            bounds = self.__bounds__(level)
+            node = np.repeat(np.arange(len(bounds) - 1), np.diff(bounds))
+            points = self.points[entries]
+            axis = (np.maximum.reduceat(points, bounds[:-1]) - np.minimum.reduceat(points, bounds[:-1])).argmax(1)
+            entries = entries[np.lexsort((points[np.arange(n), axis[node]], node))]
+        self.entries = entries
+
+        # boxes of every node in heap order (children of k are 2k + 1 and 2k + 2), leaves first and merged upwards
+        self.low, self.high = np.zeros((2**(self.depth + 1) - 1, 2)), np.zeros((2**(self.depth + 1) - 1, 2))
+        bounds, points = self.__bounds__(self.depth), self.points[entries]
+        leaves = slice(2**self.depth - 1, 2**(self.depth + 1) - 1)
+        self.low[leaves], self.high[leaves] = np.minimum.reduceat(points, bounds[:-1]), np.maximum.reduceat(points, bounds[:-1])
+        for level in range(self.depth - 1, -1, -1):
+            nodes = np.arange(2**level - 1, 2**(level + 1) - 1)
+            self.low[nodes] = np.minimum(self.low[2*nodes + 1], self.low[2*nodes + 2])
+            self.high[nodes] = np.maximum(self.high[2*nodes + 1], self.high[2*nodes + 2])
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def __bounds__(self, level:int) -> np.ndarray:
+        return (np.arange(2**level + 1)*len(self.points))//2**level
+
+    def __prune__(self, x:np.ndarray, query:np.ndarray, nodes:np.ndarray, best:np.ndarray) -> np.ndarray:
+        """
+        Keeps the (query, node) pairs whose box may hold a point closer than the closest box's farthest corner
+        """
+        low, high, px = self.low[nodes], self.high[nodes], x[query]
+        near = (np.maximum(np.maximum(low - px, px - high), 0.0)**2).sum(1)
+        far = (np.maximum(np.abs(px - low), np.abs(px - high))**2).sum(1)
+
+        bound = best.copy()
+        np.minimum.at(bound, query, far)
+        return near <= bound[query]
+
+    def __query_chunk__(self, x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        n = len(x)
+        query, nodes = np.arange(n), np.zeros(n, dtype=int)
+        best = np.full(n, np.inf)
+
+        for _ in range(self.depth):
+            keep = self.__prune__(x, query, nodes, best)
+            query, nodes = np.repeat(query[keep], 2), (2*nodes[keep, None] + np.array([1, 2])).ravel()
+
+        keep = self.__prune__(x, query, nodes, best)
+        query, leaves = query[keep], nodes[keep] - (2**self.depth - 1)
+
+        bounds = self.__bounds__(self.depth)
+        counts = bounds[leaves + 1] - bounds[leaves]
+        query, candidates = np.repeat(query, counts), self.entries[__expand_ranges__(bounds[leaves], counts)]
+        dists = ((x[query] - self.points[candidates])**2).sum(1)
+
+        # closest point per query, the lowest index on ties as in brute force
+        order = np.lexsort((candidates, dists, query))
+        query, dists, candidates = query[order], dists[order], candidates[order]
+        first = np.ones(len(query), dtype=bool)
+        first[1:] = query[1:] != query[:-1]
+        return dists[first], candidates[first]
+
+    def query(self, x:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns squared distance and index of the nearest point for each query
+        """
+        x = np.asarray(x, dtype=float).reshape(-1, 2)
+        best, best_idx = np.zeros(len(x)), np.zeros(len(x), dtype=int)
+
+        for start in range(0, len(x), self.QUERY_CHUNK):
+            select = slice(start, start + self.QUERY_CHUNK)
+            best[select], best_idx[select] = self.__query_chunk__(x[select])
+
+        return best, best_idx
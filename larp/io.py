@@ -1,9 +1,14 @@
+import os
 from os import PathLike
-from typing import Union
+from typing import Optional, Union
 import numpy as np
-from larp.field import PotentialField, RGJGeometry
-from larp.quad import QuadTree
+from larp.field import EllipseRGJ, LineStringRGJ, MultiEllipseRGJ, MultiLineStringRGJ, MultiPointRGJ, MultiRectangleRGJ, PointRGJ, PotentialField, RectangleRGJ, RGJGeometry
+from larp.fn import __expand_ranges__
+from larp.quad import LinearQuadTree, QuadTree
+from larp.network import Landmarks, RoutingNetwork, default_scale_transform
+from larp.types import FieldScaleTransform
 from pyproj import CRS, Transformer
+import hashlib
 import json
 import pickle
 
@@ -23,6 +28,279 @@ def saveQuadTree(tree:QuadTree, file:str):
     with open(file, "wb") as outfile:
         pickle.dump(data, outfile)
 
+BUNDLE_ARRAYS = ['codes', 'depth', 'leaf', 'boundary_zone', 'boundary_max_range', 'rgj_offsets', 'rgj_idx', 'rgj_zones']
+FIELD_ARRAYS = ['types', 'repulsion', 'coord_offsets', 'coords', 'part_offsets', 'parts', 'shape_offsets', 'shapes']
+FIELD_TYPES = [PointRGJ, LineStringRGJ, RectangleRGJ, EllipseRGJ, MultiPointRGJ, MultiLineStringRGJ, MultiRectangleRGJ, MultiEllipseRGJ] # RGJs stored as arrays
+
+def __save_field_arrays__(field:PotentialField, directory:Union[str, PathLike]) -> bool:
+    """
+    Saves the RGJs as flat arrays (field_*.npy): type ids, repulsions, coordinate rows, line lengths of multi line strings
+    and ellipse shapes, each ragged array with per-RGJ offsets. Returns False (saving nothing) for RGJs of other types
+    """
+    if any(type(rgj) not in FIELD_TYPES for rgj in field.rgjs):
+        return False
+
+    coords = [np.concatenate(rgj.coordinates) if isinstance(rgj, MultiLineStringRGJ) else np.reshape(rgj.coordinates, (-1, 2)) for rgj in field.rgjs]
+    parts = [[len(line) for line in rgj.coordinates] if isinstance(rgj, MultiLineStringRGJ) else [] for rgj in field.rgjs]
+    shapes = [np.reshape(rgj.shape, (-1, 2, 2)) if isinstance(rgj, (EllipseRGJ, MultiEllipseRGJ)) else np.zeros((0, 2, 2)) for rgj in field.rgjs]
+    offsets = lambda arrays: np.concatenate([[0], np.cumsum([len(array) for array in arrays])]).astype(np.int64)
+
+    arrays = {
+        'types': np.array([FIELD_TYPES.index(type(rgj)) for rgj in field.rgjs], dtype=np.uint8),
+        'repulsion': np.array([rgj.repulsion for rgj in field.rgjs], dtype=float).reshape(-1, 2, 2),
+        'coord_offsets': offsets(coords),
+        'coords': np.concatenate(coords + [np.zeros((0, 2))]).astype(float),
+        'part_offsets': offsets(parts),
+        'parts': np.array([part for rgj_parts in parts for part in rgj_parts], dtype=np.int64),
+        'shape_offsets': offsets(shapes),
+        'shapes': np.concatenate(shapes + [np.zeros((0, 2, 2))]).astype(float)
+    }
+    for key in FIELD_ARRAYS:
+        np.save(os.path.join(directory, "field_" + key + ".npy"), arrays[key])
+
+    with open(os.path.join(directory, "field.json"), "w") as outfile:
+        json.dump({'properties': [rgj.properties for rgj in field.rgjs], 'extra_info': field.extra_info}, outfile)
+
+    return True
+
+def __load_field_arrays__(directory:Union[str, PathLike], size_offset = 0.0) -> PotentialField:
+    arrays = {key: np.load(os.path.join(directory, "field_" + key + ".npy")) for key in FIELD_ARRAYS}
+    with open(os.path.join(directory, "field.json"), "r") as f:
+        info:dict = json.load(f)
+
+    co, po, so = arrays['coord_offsets'].tolist(), arrays['part_offsets'].tolist(), arrays['shape_offsets'].tolist()
+    rgjs = []
+    for idx, (type_id, repulsion, properties) in enumerate(zip(arrays['types'].tolist(), arrays['repulsion'], info['properties'])):
+        rgj_class, rows = FIELD_TYPES[type_id], arrays['coords'][co[idx]:co[idx + 1]]
+        kwargs = {'repulsion': repulsion, 'properties': properties}
+
+        if rgj_class in (PointRGJ, EllipseRGJ):
+            coordinates = rows[0]
+        elif rgj_class is MultiRectangleRGJ:
+            coordinates = rows.reshape(-1, 2, 2)
+        elif rgj_class is MultiLineStringRGJ:
+            coordinates = np.split(rows, np.cumsum(arrays['parts'][po[idx]:po[idx + 1]])[:-1])
+        else:
+            coordinates = rows
+
+        if rgj_class is EllipseRGJ:
+            kwargs['shape'] = arrays['shapes'][so[idx]]
+        elif rgj_class is MultiEllipseRGJ:
+            kwargs['shape'] = arrays['shapes'][so[idx]:so[idx + 1]]
+
+        rgjs.append(rgj_class(coordinates=coordinates, **kwargs))
+
+    field = PotentialField(rgjs=rgjs, extra_info=info['extra_info'])
+    field.size += size_offset*2
+    return field
+
+def saveQuadTreeBundle(tree:Union[QuadTree, LinearQuadTree], directory:Union[str, PathLike]):
+    """
+    Saves the tree as a directory of flat node arrays (.npy, see LinearQuadTree), the tree
+    parameters (meta.json) and the field as flat arrays (field_*.npy, or field.rgj when it holds
+    geometry collections), so that it can be memory-mapped back
+    """
+
+    linear = tree if isinstance(tree, LinearQuadTree) else LinearQuadTree.from_quadtree(tree)
+    os.makedirs(directory, exist_ok=True)
+
+    for key in BUNDLE_ARRAYS:
+        np.save(os.path.join(directory, key + ".npy"), getattr(linear, key))
+
+    meta = {
+        'format': "larp.quadtree",
+        'version': 2,
+        'min_sector_size': float(linear.template.min_sector_size),
+        'max_sector_size': float(linear.template.max_sector_size),
+        'size': float(linear.size),
+        'center_point': linear.center_point.tolist(),
+        'edge_bounds': linear.template.edge_bounds.tolist(),
+        'conservative': bool(linear.template.conservative),
+        'n_nodes': len(linear)
+    }
+
+    meta['field'] = "arrays" if __save_field_arrays__(linear.field, directory) else "rgj"
+    if meta['field'] == "rgj":
+        saveRGeoJSON(linear.field, os.path.join(directory, "field.rgj"))
+
+    with open(os.path.join(directory, "meta.json"), "w") as outfile:
+        json.dump(meta, outfile)
+
+def loadQuadTreeBundle(directory:Union[str, PathLike], size_offset = 0.0, mmap = True, linear = False, field:Optional[PotentialField] = None) -> Union[QuadTree, LinearQuadTree]:
+    """
+    Loads a tree saved by saveQuadTreeBundle. With mmap, node arrays are memory-mapped read-only,
+    so processes opening the same bundle share its pages. The fast path is linear, which returns the
+    LinearQuadTree over those arrays as is; by default every QuadNode is rebuilt (to_quadtree), which
+    takes as long as the number of nodes. The field is rebuilt from its arrays, unless a field already
+    in memory (the same as the saved one) is given
+    """
+
+    with open(os.path.join(directory, "meta.json"), "r") as f:
+        meta:dict = json.load(f)
+
+    if meta.get('format') != "larp.quadtree":
+        raise ValueError(f"{directory} is not a quadtree bundle")
+
+    if field is None and meta.get('field') == "arrays":
+        field = __load_field_arrays__(directory, size_offset=size_offset)
+    elif field is None:
+        field = loadRGeoJSONFile(os.path.join(directory, "field.rgj"), size_offset=size_offset)
+    tree = LinearQuadTree(field=field,
+                          minimum_length_limit=meta['min_sector_size'],
+                          maximum_length_limit=meta['max_sector_size'],
+                          edge_bounds=meta['edge_bounds'],
+                          size=meta['size'],
+                          conservative=meta['conservative'])
+    tree.center_point = np.array(meta['center_point'], dtype=float)
+
+    for key in BUNDLE_ARRAYS:
+        setattr(tree, key, np.load(os.path.join(directory, key + ".npy"), mmap_mode='r' if mmap else None))
+
+    return tree if linear else tree.to_quadtree()
+
+def saveRoutingNetwork(network:RoutingNetwork, directory:Union[str, PathLike]):
+    """
+    Saves the network adjacency as CSR arrays over the locational codes of its quads,
+    typically inside the quadtree bundle of its tree
+    """
+
+    nodes, indptr, indices = network.to_csr()
+    codes = network.quadtree.quad_codes(nodes)
+    os.makedirs(directory, exist_ok=True)
+
+    np.save(os.path.join(directory, "network_codes.npy"), codes)
+    np.save(os.path.join(directory, "network_indptr.npy"), indptr)
+    np.save(os.path.join(directory, "network_indices.npy"), indices.astype(np.int32 if len(nodes) < 2**31 else np.int64))
+
+    meta = {
+        'format': "larp.network",
+        'version': 1,
+        'directed': bool(network._directed),
+        'n_nodes': len(nodes),
+        'n_edges': int(indptr[-1])
+    }
+
+    with open(os.path.join(directory, "network.json"), "w") as outfile:
+        json.dump(meta, outfile)
+
+def loadRoutingNetwork(directory:Union[str, PathLike], quadtree:Optional[QuadTree] = None, mmap = True) -> RoutingNetwork:
+    """
+    Loads a network saved by saveRoutingNetwork onto quadtree (by default, the quadtree bundle in the same directory)
+    """
+
+    with open(os.path.join(directory, "network.json"), "r") as f:
+        meta:dict = json.load(f)
+
+    if meta.get('format') != "larp.network":
+        raise ValueError(f"{directory} does not hold a routing network")
+
+    if quadtree is None:
+        quadtree = loadQuadTreeBundle(directory, mmap=mmap)
+
+    codes = np.load(os.path.join(directory, "network_codes.npy"))
+    indptr = np.load(os.path.join(directory, "network_indptr.npy"), mmap_mode='r' if mmap else None)
+    indices = np.load(os.path.join(directory, "network_indices.npy"), mmap_mode='r' if mmap else None)
+
+    leaves = list(quadtree.leaves)
+    leaf_codes = quadtree.quad_codes(leaves)
+    order = np.argsort(leaf_codes)
+    loc = np.minimum(np.searchsorted(leaf_codes[order], codes), max(len(leaves) - 1, 0))
+
+    if not len(leaves) or (leaf_codes[order][loc] != codes).any():
+        raise ValueError("Saved network does not match the leaves of the quadtree")
+
+    nodes = [leaves[order[idx]] for idx in loc]
+    return RoutingNetwork.from_csr(quadtree, nodes, indptr, indices, directed=meta['directed'])
+
+def __adjacency_digest__(network:RoutingNetwork, live:np.ndarray, live_codes:np.ndarray) -> str:
+    """
+    Digest of the compiled adjacency over locational codes (the neighbor codes of each quad, in code order),
+    so tables only load onto networks with the same edges
+    """
+    compiled = network.compiled
+    code = np.zeros(len(compiled.nodes), dtype=np.int64)
+    code[live] = live_codes
+
+    rows = live[np.argsort(live_codes)]
+    counts = compiled.indptr[rows + 1] - compiled.indptr[rows]
+    neighs = code[compiled.indices[__expand_ranges__(compiled.indptr[rows], counts)]]
+    neighs = neighs[np.lexsort((neighs, np.repeat(np.arange(len(rows)), counts)))]
+
+    digest = hashlib.sha256(b"directed" if network._directed else b"undirected")
+    digest.update(counts.astype(np.int64).tobytes())
+    digest.update(neighs.tobytes())
+    return digest.hexdigest()
+
+def saveLandmarks(network:RoutingNetwork, directory:Union[str, PathLike]):
+    """
+    Saves the landmark tables of the network over the locational codes of its quads, typically next to the saved network.
+    The cost model is kept as its node multipliers, so loaded tables only serve searches under the same model
+    """
+
+    landmarks = network.landmarks
+    if landmarks is None or landmarks.stale or landmarks.compiled is not network.compiled:
+        raise ValueError("Network has no up-to-date landmarks to save")
+
+    compiled = landmarks.compiled
+    live = np.array(sorted(compiled.ids.values()), dtype=np.int64)
+    codes = network.quadtree.quad_codes([compiled.nodes[idx] for idx in live])
+    os.makedirs(directory, exist_ok=True)
+
+    np.save(os.path.join(directory, "landmarks_codes.npy"), codes)
+    np.save(os.path.join(directory, "landmarks_from.npy"), landmarks.distances_from[:, live])
+    np.save(os.path.join(directory, "landmarks_to.npy"), landmarks.distances_to[:, live])
+    np.save(os.path.join(directory, "landmarks_multipliers.npy"), landmarks.multipliers[live])
+
+    meta = {
+        'format': "larp.landmarks",
+        'version': 1,
+        'landmarks': [int(code) for code in network.quadtree.quad_codes(landmarks.nodes)],
+        'penalty': landmarks.penalty,
+        'n_nodes': len(live),
+        'adjacency': __adjacency_digest__(network, live, codes)
+    }
+
+    with open(os.path.join(directory, "landmarks.json"), "w") as outfile:
+        json.dump(meta, outfile)
+
+def loadLandmarks(directory:Union[str, PathLike], network:RoutingNetwork, scale_tranform:FieldScaleTransform=default_scale_transform) -> Landmarks:
+    """
+    Loads landmark tables saved by saveLandmarks onto the network, which must have the same quads and edges.
+    scale_tranform is the transform of the saved cost model, only needed to repair the tables after edits
+    """
+
+    with open(os.path.join(directory, "landmarks.json"), "r") as f:
+        meta:dict = json.load(f)
+
+    if meta.get('format') != "larp.landmarks":
+        raise ValueError(f"{directory} does not hold landmark tables")
+
+    codes = np.load(os.path.join(directory, "landmarks_codes.npy"))
+    compiled = network.compiled
+    live = np.array(sorted(compiled.ids.values()), dtype=np.int64)
+    live_codes = network.quadtree.quad_codes([compiled.nodes[idx] for idx in live])
+
+    order = np.argsort(codes)
+    loc = np.minimum(np.searchsorted(codes[order], live_codes), max(len(codes) - 1, 0))
+    ids = dict(zip(live_codes.tolist(), live.tolist()))
+
+    if not len(codes) or len(codes) != len(live_codes) or (codes[order][loc] != live_codes).any() \
+       or any(code not in ids for code in meta['landmarks']) or meta.get('adjacency') != __adjacency_digest__(network, live, live_codes):
+        raise ValueError("Saved landmarks do not match the network")
+
+    columns = order[loc]
+    n = len(compiled.nodes)
+    distances_from = np.full((len(meta['landmarks']), n), np.nan)
+    distances_to = np.full((len(meta['landmarks']), n), np.nan)
+    multipliers = np.full(n, np.nan)
+    distances_from[:, live] = np.load(os.path.join(directory, "landmarks_from.npy"))[:, columns]
+    distances_to[:, live] = np.load(os.path.join(directory, "landmarks_to.npy"))[:, columns]
+    multipliers[live] = np.load(os.path.join(directory, "landmarks_multipliers.npy"))[columns]
+
+    network.landmarks = Landmarks(compiled, np.array([ids[code] for code in meta['landmarks']], dtype=np.int64), distances_from, distances_to,
+                                  multipliers, scale_tranform=scale_tranform, penalty=meta['penalty'])
+    return network.landmarks
+
 def fromRGeoJSON(rgeojson: dict, size_offset = 0.0) -> PotentialField:
 
     features = rgeojson["features"]
@@ -121,5 +399,7 @@ def projectCoordinates(field: PotentialField, from_crs="EPSG:4326", to_crs="EPSG
     for rgj in field:
         __prune_coords__(rgj)
 
+    field.reload_rgjs()
+
     if recalculate:
         field.reload_center_point(toggle=True, recal_size=True)
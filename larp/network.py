@@ -1,9 +1,15 @@
-from collections import defaultdict
+from __future__ import annotations
+from collections import OrderedDict, defaultdict
+import hashlib
 import heapq
-from typing import Callable, List, Optional, Tuple
+import itertools
+import math
+import warnings
+from typing import Callable, List, Optional, Set, Tuple, Union
 
 import numpy as np
 
+from larp.fn import __expand_ranges__
 from larp.quad import QuadNode, QuadTree
 from larp.types import FieldScaleTransform, Point, RoutingAlgorithmStr
 
@@ -13,6 +19,12 @@ Author: Josue N Rivera
 
 RoutingAlgorithm = Callable[[QuadNode, QuadNode, FieldScaleTransform, dict], Optional[List[QuadNode]]]
 
+def default_scale_transform(x):
+    """
+    Default cost model: entering a quad costs its length scaled by 1 + its highest potential
+    """
+    return 1.0 + x
+
 class Network(object):
     """ Network data structure, undirected by default. 
     
@@ -69,7 +81,411 @@ class Network(object):
     
     def find_path(self, node1, node2):
         raise NotImplementedError
+
+class CompiledNetwork():
+    """
+    Integer-id snapshot of a RoutingNetwork: nodes numbered 0..n-1, adjacency as CSR arrays (indptr, indices)
+    with the length of every edge, and the quad attributes used by the cost model as flat arrays.
+    Plain-list copies are kept for the search loops, where they index faster than arrays
+    """
+
+    def __init__(self, network:RoutingNetwork) -> None:
+        self.nodes, self.indptr, self.indices = network.to_csr()
+        self.ids = {node: idx for idx, node in enumerate(self.nodes)}
+        n = len(self.nodes)
+
+        self.centers = np.array([node.center_point for node in self.nodes], dtype=float).reshape(-1, 2)
+        self.boundary_zone = np.array([node.boundary_zone for node in self.nodes], dtype=int)
+        self.boundary_max_range = np.array([node.boundary_max_range for node in self.nodes], dtype=float)
+        self.__unrefined = np.array([node.unrefined for node in self.nodes], dtype=bool)
+
+        sources = np.repeat(np.arange(n), np.diff(self.indptr))
+        self.lengths = np.linalg.norm(self.centers[self.indices] - self.centers[sources], axis=1)
+
+        self.__finalize__()
+
+    def __finalize__(self) -> None:
+        self.unrefined = bool(self.__unrefined.any())
+        self.__reverse = None
+        self.indptr_list, self.indices_list = self.indptr.tolist(), self.indices.tolist()
+        self.lengths_list = self.lengths.tolist()
+        self.x_list, self.y_list = self.centers[:, 0].tolist(), self.centers[:, 1].tolist()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def patch(self, network:RoutingNetwork, dirty:Set[QuadNode], removed:Set[QuadNode]) -> Tuple[CompiledNetwork, Optional[np.ndarray]]:
+        """
+        Compiled network after the dirty nodes changed (adjacency or attributes) and the removed ones left the network.
+        Untouched nodes keep their ids and rows, so only dirty rows are rebuilt and removed ids are left empty.
+        Returns the patched network with the ids that changed, or None for the ids when it was recompiled from scratch
+        """
+        graph = network._graph
+        nodes, ids = list(self.nodes), dict(self.ids)
+        n_old = len(nodes)
+
+        alive = [node for node in dirty if node in graph]
+        for node in itertools.chain(alive, (neigh for node in alive for neigh in graph[node])):
+            if node not in ids:
+                ids[node] = len(nodes)
+                nodes.append(node)
+
+        rows = {ids[node] for node in dirty if node in ids} | set(range(n_old, len(nodes)))
+        for node in removed:
+            if node in ids and node not in graph:
+                nodes[ids.pop(node)] = None
+
+        if 2*(len(nodes) - len(ids)) > len(nodes):
+            return CompiledNetwork(network), None # mostly empty ids, compact them
+
+        n = len(nodes)
+        rows = np.array(sorted(rows), dtype=np.int64)
+        row_nodes = [nodes[row] for row in rows.tolist()]
+
+        counts = np.zeros(n, dtype=np.int64)
+        counts[:n_old] = np.diff(self.indptr)
+        counts[rows] = [len(graph.get(node, ())) if node is not None else 0 for node in row_nodes]
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        kept = np.ones(n_old, dtype=bool)
+        kept[rows[rows < n_old]] = False
+        kept = np.nonzero(kept)[0]
+        kept_counts = counts[kept]
+
+        indices = np.empty(indptr[-1], dtype=np.int64)
+        lengths = np.empty(indptr[-1], dtype=float)
+        old_edges, new_edges = __expand_ranges__(self.indptr[kept], kept_counts), __expand_ranges__(indptr[kept], kept_counts)
+        indices[new_edges], lengths[new_edges] = self.indices[old_edges], self.lengths[old_edges]
+
+        centers = np.zeros((n, 2), dtype=float)
+        boundary_zone, boundary_max_range = np.zeros(n, dtype=int), np.zeros(n, dtype=float)
+        unrefined = np.zeros(n, dtype=bool)
+        centers[:n_old], boundary_zone[:n_old], boundary_max_range[:n_old], unrefined[:n_old] = self.centers, self.boundary_zone, self.boundary_max_range, self.__unrefined
+
+        live = [(row, node) for row, node in zip(rows.tolist(), row_nodes) if node is not None]
+        live_rows = np.array([row for row, _ in live], dtype=np.int64)
+        centers[live_rows] = np.array([node.center_point for _, node in live], dtype=float).reshape(-1, 2)
+        boundary_zone[live_rows] = [node.boundary_zone for _, node in live]
+        boundary_max_range[live_rows] = [node.boundary_max_range for _, node in live]
+        unrefined[rows] = False
+        unrefined[live_rows] = [node.unrefined for _, node in live]
+
+        rebuilt = __expand_ranges__(indptr[rows], counts[rows])
+        indices[rebuilt] = np.fromiter((ids[neigh] for _, node in live for neigh in graph.get(node, ())), dtype=np.int64, count=len(rebuilt))
+        lengths[rebuilt] = np.linalg.norm(centers[indices[rebuilt]] - centers[np.repeat(rows, counts[rows])], axis=1)
+
+        patched = CompiledNetwork.__new__(CompiledNetwork)
+        patched.nodes, patched.ids, patched.indptr, patched.indices, patched.lengths = nodes, ids, indptr, indices, lengths
+        patched.centers, patched.boundary_zone, patched.boundary_max_range = centers, boundary_zone, boundary_max_range
+        patched.__unrefined = unrefined
+        patched.__finalize__()
+
+        return patched, rows
+
+    @property
+    def reverse(self) -> Tuple[List[int], List[int], np.ndarray]:
+        """
+        Transposed adjacency as lists (indptr, indices) with the position in indices of every reversed edge,
+        built on first use for searches walking edges backwards
+        """
+        if self.__reverse is None:
+            n = len(self.nodes)
+            sources = np.repeat(np.arange(n), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=n))]).astype(np.int64)
+            self.__reverse = (indptr.tolist(), sources[order].tolist(), order)
+
+        return self.__reverse
+
+    def multipliers(self, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0, ids:Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cost multiplier of entering each node (or only the given ids), as in RoutingNetwork.calculate_distance
+        """
+        boundary_zone = self.boundary_zone if ids is None else self.boundary_zone[ids]
+        boundary_max_range = self.boundary_max_range if ids is None else self.boundary_max_range[ids]
+        n = len(boundary_zone)
+        try:
+            # transforms written for floats usually work on arrays too
+            scaled = np.broadcast_to(np.asarray(scale_tranform(boundary_max_range), dtype=float), (n,))
+        except (TypeError, ValueError):
+            scaled = np.array([scale_tranform(value) for value in boundary_max_range.tolist()], dtype=float).reshape(n)
+
+        return np.where(boundary_zone == 0, penalty, scaled)
+
+    def weights(self, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0) -> np.ndarray:
+        """
+        Cost of every edge (aligned with indices) under the cost model
+        """
+        return self.multipliers(scale_tranform, penalty)[self.indices]*self.lengths
+
+    def distances(self, source:int, weights:List[float], reverse:bool = False) -> np.ndarray:
+        """
+        Shortest distance from source to every node (Dijkstra), or from every node to source when reverse
+        (with weights aligned with the reverse indices). Unreachable nodes are infinitely far
+        """
+        indptr, indices = self.reverse[:2] if reverse else (self.indptr_list, self.indices_list)
+        dist = [math.inf]*len(self.nodes)
+        dist[source] = 0.0
+        open_set = [(0.0, source)]
+
+        while open_set:
+            d, current = heapq.heappop(open_set)
+            if d > dist[current]:
+                continue # stale entry
+
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                tentative_dist = d + weights[edge]
+
+                if tentative_dist < dist[neighbor]:
+                    dist[neighbor] = tentative_dist
+                    heapq.heappush(open_set, (tentative_dist, neighbor))
+
+        return np.array(dist, dtype=float)
+
+    def search(self, start:int, end:int, weights:List[float], heuristic:bool = True, potential:Optional[Callable[[int], float]] = None) -> Optional[List[int]]:
+        """
+        A* (Dijkstra without heuristic) from start to end over node ids, with edge weights (aligned with indices) as a list.
+        The heuristic is the euclidean distance to end unless a potential (lower bound of the cost to end of a node id) is given.
+        Stale heap entries are skipped on pop and ties are broken by node id
+        """
+        indptr, indices = self.indptr_list, self.indices_list
+        xs, ys = self.x_list, self.y_list
+        end_x, end_y = xs[end], ys[end]
+
+        g_score = {start: 0.0}
+        came_from = {}
+        if potential is not None:
+            open_set = [(potential(start), 0.0, start)]
+        else:
+            open_set = [(math.hypot(xs[start] - end_x, ys[start] - end_y) if heuristic else 0.0, 0.0, start)]
+
+        while open_set:
+            _, g, current = heapq.heappop(open_set)
+
+            if current == end:
+                path = [current]
+                while current in came_from:
+                    current = came_from[current]
+                    path.append(current)
+                return path[::-1]
+            
+            if g > g_score[current]:
+                continue # stale entry
+
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                tentative_g_score = g + weights[edge]
+
+                if tentative_g_score < g_score.get(neighbor, math.inf):
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    if potential is not None:
+                        f_score = tentative_g_score + potential(neighbor)
+                    else:
+                        f_score = tentative_g_score + (math.hypot(xs[neighbor] - end_x, ys[neighbor] - end_y) if heuristic else 0.0)
+                    heapq.heappush(open_set, (f_score, tentative_g_score, neighbor))
+
+        return None
+
+    def bidirectional_search(self, start:int, end:int, weights:List[float], reverse_weights:List[float], heuristic:bool = True) -> Optional[List[int]]:
+        """
+        Bidirectional A* (Dijkstra without heuristic) from start and end over node ids, with edge weights as lists
+        aligned with indices and with reverse indices. Both sides use the average potential (h_end - h_start)/2
+        and its negation, which are consistent with each other, so the search stops once the smallest keys of
+        both sides add up to the best meeting cost. The side with the smaller open set is expanded first.
+        Potentials and scores are only computed for the nodes reached
+        """
+        if start == end:
+            return [start]
+        
+        xs, ys = self.x_list, self.y_list
+        start_x, start_y, end_x, end_y = xs[start], ys[start], xs[end], ys[end]
+        if heuristic:
+            forward_potential = lambda idx: 0.5*(math.hypot(xs[idx] - end_x, ys[idx] - end_y) - math.hypot(xs[idx] - start_x, ys[idx] - start_y))
+            reverse_potential = lambda idx: 0.5*(math.hypot(xs[idx] - start_x, ys[idx] - start_y) - math.hypot(xs[idx] - end_x, ys[idx] - end_y))
+        else:
+            forward_potential = reverse_potential = lambda idx: 0.0
+        
+        forward_g_score, reverse_g_score = {start: 0.0}, {end: 0.0}
+
+        reverse_indptr, reverse_indices, _ = self.reverse
+        sides = [(self.indptr_list, self.indices_list, weights, forward_potential, forward_g_score, reverse_g_score, {}, [(forward_potential(start), 0.0, start)]),
+                 (reverse_indptr, reverse_indices, reverse_weights, reverse_potential, reverse_g_score, forward_g_score, {}, [(reverse_potential(end), 0.0, end)])]
+        forward_open_set, reverse_open_set = sides[0][7], sides[1][7]
+        best, meet = math.inf, None
+
+        while forward_open_set and reverse_open_set and forward_open_set[0][0] + reverse_open_set[0][0] < best:
+            indptr, indices, edge_weights, potential, g_score, other_g_score, came_from, open_set = sides[len(forward_open_set) > len(reverse_open_set)]
+
+            _, g, current = heapq.heappop(open_set)
+            if g > g_score[current]:
+                continue # stale entry
+
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor = indices[edge]
+                tentative_g_score = g + edge_weights[edge]
+
+                if tentative_g_score < g_score.get(neighbor, math.inf):
+                    came_from[neighbor] = current
+                    g_score[neighbor] = tentative_g_score
+                    heapq.heappush(open_set, (tentative_g_score + potential(neighbor), tentative_g_score, neighbor))
+
+                    if tentative_g_score + other_g_score.get(neighbor, math.inf) < best:
+                        best, meet = tentative_g_score + other_g_score[neighbor], neighbor
+
+        if meet is None:
+            return None
+        
+        path = []
+        for came_from in [sides[0][6], sides[1][6]]:
+            half, current = [meet], meet
+            while current in came_from:
+                current = came_from[current]
+                half.append(current)
+            path = half[::-1] if not path else path + half[1:]
+
+        return path
     
+class Landmarks():
+    """
+    ALT tables over a compiled network: shortest distances from and to K landmark nodes under one cost model.
+    By the triangle inequality, d(L, t) - d(L, v) and d(v, L) - d(t, L) bound d(v, t) from below for every landmark L,
+    which is much tighter than the euclidean distance around restricted (heavily scaled) areas.
+    The multipliers of the cost model are kept to tell whether a search uses the same model
+    """
+
+    ACTIVE = 3 # landmarks bounding a search, the ones with the best bound from its start
+    EAGER = 64 # fraction (1/EAGER) of the nodes a search reaches before heuristic bounds all of them
+
+    def __init__(self, compiled:CompiledNetwork, ids:np.ndarray, distances_from:np.ndarray, distances_to:np.ndarray, multipliers:np.ndarray,
+                 scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0) -> None:
+        self.compiled = compiled
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.distances_from, self.distances_to = distances_from, distances_to
+        self.multipliers = multipliers
+        self.scale_tranform, self.penalty = scale_tranform, float(penalty)
+        self.stale = False
+        self.__rows = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    @property
+    def nodes(self) -> List[QuadNode]:
+        return [self.compiled.nodes[idx] for idx in self.ids.tolist()]
+
+    @classmethod
+    def build(cls, network:RoutingNetwork, k:int = 8, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0,
+              landmarks:Optional[List[QuadNode]] = None) -> Landmarks:
+        """
+        Runs one Dijkstra from and one to each landmark. Landmarks not given (or no longer in the network) are picked
+        farthest-first: the node farthest from the center, then the node farthest from every landmark picked so far
+        """
+        compiled = network.compiled
+        weights = network.edge_weights(scale_tranform, penalty, as_list=True)
+        reverse_weights = network.edge_weights(scale_tranform, penalty, as_list=True, reverse=True)
+
+        given = [compiled.ids[node] for node in (landmarks or []) if node in compiled.ids]
+        live = np.array(sorted(compiled.ids.values()), dtype=np.int64)
+        nearest = np.full(len(compiled.nodes), -np.inf) # distance to the nearest landmark, never picking removed ids
+        nearest[live] = np.inf
+
+        ids, distances_from, distances_to = [], [], []
+        while len(ids) < max(k, len(given)) and len(ids) < len(live):
+            if given:
+                landmark = given.pop(0)
+            elif not ids:
+                landmark = int(live[np.argmax(np.linalg.norm(compiled.centers[live] - compiled.centers[live].mean(0), axis=1))])
+            else:
+                landmark = int(np.argmax(np.where(np.isfinite(nearest), nearest, -np.inf)))
+                if nearest[landmark] <= 0.0:
+                    break
+
+            ids.append(landmark)
+            distances_from.append(compiled.distances(landmark, weights))
+            distances_to.append(compiled.distances(landmark, reverse_weights, reverse=True))
+            nearest = np.minimum(nearest, distances_from[-1])
+
+        return cls(compiled, np.array(ids, dtype=np.int64), np.array(distances_from).reshape(len(ids), -1), np.array(distances_to).reshape(len(ids), -1),
+                   network.cost_multipliers(scale_tranform, penalty), scale_tranform=scale_tranform, penalty=penalty)
+
+    def __active__(self, end:int, start:Optional[int] = None) -> np.ndarray:
+        """
+        Landmarks bounding a search to end: the ACTIVE ones with the best bounds from start, or all of them
+        """
+        if start is None or len(self.ids) <= self.ACTIVE:
+            return np.arange(len(self.ids))
+        
+        with np.errstate(invalid='ignore'):
+            at_start = np.fmax(self.distances_from[:, end] - self.distances_from[:, start], self.distances_to[:, start] - self.distances_to[:, end])
+        return np.argsort(-np.nan_to_num(at_start, nan=-np.inf))[:self.ACTIVE]
+    
+    def __row__(self, landmark:int, reverse:bool = False) -> List[float]:
+        """
+        Distances from (to, if reverse) a landmark as a list, converted on first use
+        """
+        key = (landmark, reverse)
+        if key not in self.__rows:
+            self.__rows[key] = (self.distances_to if reverse else self.distances_from)[landmark].tolist()
+        return self.__rows[key]
+
+    def potential(self, end:int, start:Optional[int] = None) -> np.ndarray:
+        """
+        Lower bound of the cost from every node to end: the best landmark bound, or the euclidean distance if larger.
+        Given the start, only the ACTIVE landmarks with the best bounds from start are used
+        """
+        active = self.__active__(end, start)
+        with np.errstate(invalid='ignore'): # inf - inf where neither node reaches (or is reached by) a landmark
+            bounds = np.concatenate([self.distances_from[active, end, None] - self.distances_from[active],
+                                     self.distances_to[active] - self.distances_to[active, end, None]])
+            potential = np.fmax.reduce(bounds, axis=0) if len(bounds) else np.full(len(self.compiled.nodes), np.nan)
+
+        return np.fmax(potential, np.linalg.norm(self.compiled.centers - self.compiled.centers[end], axis=1))
+    
+    def heuristic(self, end:int, start:Optional[int] = None) -> Callable[[int], float]:
+        """
+        Same bound as potential, computed per node as a search reaches it instead of for every node up front.
+        Once the search has reached more than 1/EAGER of the nodes, the bounds of all of them are computed at once
+        """
+        active = self.__active__(end, start)
+        rows_from = [(row, row[end]) for row in (self.__row__(landmark) for landmark in active.tolist())]
+        rows_to = [(row, row[end]) for row in (self.__row__(landmark, reverse=True) for landmark in active.tolist())]
+        xs, ys = self.compiled.x_list, self.compiled.y_list
+        end_x, end_y = xs[end], ys[end]
+        budget = len(xs)//self.EAGER
+        table = None
+
+        def bound(idx:int) -> float:
+            nonlocal budget, table
+            if table is not None:
+                return table[idx]
+            
+            budget -= 1
+            if budget < 0:
+                table = self.potential(end, start).tolist()
+                return table[idx]
+
+            best = math.hypot(xs[idx] - end_x, ys[idx] - end_y)
+            for row, at_end in rows_from:
+                if at_end - row[idx] > best: # nan (inf - inf) never wins
+                    best = at_end - row[idx]
+            for row, at_end in rows_to:
+                if row[idx] - at_end > best:
+                    best = row[idx] - at_end
+            return best
+        
+        return bound
+
+    def matches(self, multipliers:np.ndarray, scale_tranform:FieldScaleTransform, penalty:float) -> bool:
+        """
+        Whether the tables hold distances under the given cost model
+        """
+        if scale_tranform is self.scale_tranform and float(penalty) == self.penalty:
+            return True
+        # removed ids of loaded tables have no multiplier
+        return len(multipliers) == len(self.multipliers) and bool(((multipliers == self.multipliers) | np.isnan(self.multipliers)).all())
+
 class RoutingNetwork(Network):
 
     ChildNeighOuterEdges = { # Maps child quad' outer edge to neighbors' children
@@ -106,13 +522,27 @@ class RoutingNetwork(Network):
         'l':  ['tr', 'br']
     }
 
+    WEIGHT_TABLES = 8 # cost models whose edge weights are kept, least recently used dropped first
+    WEIGHT_MODELS = 32 # (scale_tranform, penalty) pairs remembered with the table they map to
+
     def __init__(self, quadtree:QuadTree, directed:bool=False, build_network:bool=False):
         self.quadtree = quadtree
+        self.__compiled:Optional[CompiledNetwork] = None
+        self.__dirty:Set[QuadNode] = set()
+        self.__removed:Set[QuadNode] = set()
+        self.__weights:OrderedDict = OrderedDict()
+        self.__models:OrderedDict = OrderedDict()
+        self.landmarks:Optional[Landmarks] = None
+        self.__fallback_warned = False
         super().__init__(directed=directed)
 
         self.routing_algs = defaultdict(lambda: self.find_path_A_star)
         self.routing_algs["a*"] = self.find_path_A_star
         self.routing_algs["dijkstra"] = self.find_path_dijkstra
+        self.routing_algs["a*-csr"] = self.find_path_A_star_csr
+        self.routing_algs["dijkstra-csr"] = self.find_path_dijkstra_csr
+        self.routing_algs["bidirectional-a*"] = self.find_path_bidirectional_A_star
+        self.routing_algs["alt"] = self.find_path_ALT
 
         if build_network:
             self.build()
@@ -120,7 +550,141 @@ class RoutingNetwork(Network):
     def add_routing_algorithm(self, name:str, algorithm:RoutingAlgorithm):
         self.routing_algs[name.lower()] = algorithm
 
-    def __fill_shallow_neighs__(self, root:Optional[QuadNode] = None):
+    def add(self, node1, node2):
+        super().add(node1, node2)
+        self.__touch__((node1, node2))
+
+    def add_one_to_many(self, node1, nodes, overwrite_directed=False):
+        nodes = list(nodes)
+        super().add_one_to_many(node1, nodes, overwrite_directed=overwrite_directed)
+        self.__touch__(nodes + [node1])
+
+    def remove(self, node):
+        if self.__compiled is not None:
+            referrers = [other for other, cxns in self._graph.items() if node in cxns] if self._directed else list(self._graph.get(node, ()))
+        super().remove(node)
+        if self.__compiled is not None:
+            self.__touch__(referrers)
+            self.__touch__((node,), removed=True)
+
+    def __touch__(self, nodes, removed:bool = False) -> None:
+        """
+        Marks nodes whose adjacency or attributes changed, so the compiled network patches their rows on next use
+        and the landmark tables are flagged stale
+        """
+        if self.landmarks is not None:
+            self.landmarks.stale = True
+        if self.__compiled is None: return
+        self.__dirty.update(nodes)
+        if removed:
+            self.__removed.update(nodes)
+
+    def invalidate(self, quads:Optional[Set[QuadNode]] = None) -> None:
+        """
+        Marks quads changed outside of the network methods (e.g. their zones) so they are recompiled with their
+        edge weights. Without quads, the compiled network and every edge-weight table are dropped
+        """
+        if quads is None:
+            self.__compiled = None
+            self.__weights.clear()
+            self.__models.clear()
+            if self.landmarks is not None:
+                self.landmarks.stale = True
+        else:
+            self.__touch__(quads)
+
+    @property
+    def compiled(self) -> CompiledNetwork:
+        """
+        Integer-id CSR form of the network, compiled on first use and patched in place of the changed nodes after edits
+        """
+        if self.__compiled is None:
+            self.__compiled = CompiledNetwork(self)
+            self.__weights.clear()
+            self.__models.clear()
+        elif self.__dirty:
+            self.__compiled, changed = self.__compiled.patch(self, self.__dirty, self.__removed)
+
+            tables, digests = self.__weights, {}
+            self.__weights = OrderedDict()
+            for digest, (multipliers, _, _, _, model) in tables.items():
+                scale_tranform, penalty = model
+                if changed is None:
+                    multipliers = self.__compiled.multipliers(scale_tranform, penalty)
+                else:
+                    multipliers = np.concatenate([multipliers, np.zeros(len(self.__compiled.nodes) - len(multipliers))])
+                    multipliers[changed] = self.__compiled.multipliers(scale_tranform, penalty, changed)
+                digests[digest] = self.__digest__(multipliers)
+                self.__weights[digests[digest]] = self.__weight_table__(multipliers, model)
+            # other transforms sharing a table may differ on the changed nodes, so only the one patching it keeps its entry
+            self.__models = OrderedDict((model, digests[digest]) for model, digest in self.__models.items() if digest in digests and tables[digest][4] == model)
+
+        self.__dirty, self.__removed = set(), set()
+        return self.__compiled
+
+    def __weight_table__(self, multipliers:np.ndarray, model:tuple) -> list:
+        """
+        Node multipliers, edge weights and the list copies of the weights (forward and reverse) for the search loops,
+        made on first search, with the (scale_tranform, penalty) that patches them after edits
+        """
+        return [multipliers, multipliers[self.__compiled.indices]*self.__compiled.lengths, None, None, model]
+
+    @staticmethod
+    def __digest__(multipliers:np.ndarray) -> str:
+        return hashlib.sha1(np.ascontiguousarray(multipliers, dtype=float).tobytes()).hexdigest()
+
+    def __table__(self, scale_tranform:FieldScaleTransform, penalty:float) -> list:
+        """
+        Tables are keyed by the digest of their node multipliers, so transforms computing the same costs share one.
+        Known (scale_tranform, penalty) pairs skip straight to their table, others compute the multipliers to find it
+        """
+        compiled, model = self.compiled, (scale_tranform, float(penalty))
+        digest = self.__models.get(model)
+
+        if digest not in self.__weights:
+            multipliers = compiled.multipliers(scale_tranform, penalty)
+            digest = self.__digest__(multipliers)
+            if digest not in self.__weights:
+                self.__weights[digest] = self.__weight_table__(multipliers, model)
+            self.__models[model] = digest
+            while len(self.__models) > self.WEIGHT_MODELS:
+                self.__models.popitem(last=False)
+        self.__models.move_to_end(model)
+        self.__weights.move_to_end(digest)
+        while len(self.__weights) > self.WEIGHT_TABLES:
+            self.__weights.popitem(last=False)
+
+        return self.__weights[digest]
+
+    def cost_multipliers(self, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0) -> np.ndarray:
+        """
+        Cost multiplier of entering each compiled node under the cost model, cached with its edge weights
+        """
+        return self.__table__(scale_tranform, penalty)[0]
+
+    def edge_weights(self, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0, as_list:bool = False, reverse:bool = False) -> Union[np.ndarray, List[float]]:
+        """
+        Cost of every compiled edge (aligned with compiled.indices, or with the reverse indices) under the cost model,
+        as in calculate_distance. Tables are cached per cost model and patched only where nodes changed after edits.
+        Transforms are recognized by identity, so inline lambdas miss that lookup and recompute the multipliers
+        (O(nodes)) on every call before finding their table: define the transform once and reuse it
+        """
+        compiled = self.compiled
+        table = self.__table__(scale_tranform, penalty)
+        if reverse:
+            weights = table[1][compiled.reverse[2]]
+            if as_list:
+                if table[3] is None:
+                    table[3] = weights.tolist()
+                return table[3]
+            return weights
+        
+        if as_list and table[2] is None:
+            table[2] = table[1].tolist()
+
+        return table[2] if as_list else table[1]
+
+    def __fill_shallow_neighs__(self, root:Optional[QuadNode] = None, recursive:bool = True):
 
         def outer_edge_fill(quad:QuadNode, child = 'tl', side = 't'):
             child_quad = quad[child]
@@ -167,8 +731,9 @@ class RoutingNetwork(Network):
             outer_edge_fill(quad, 'br', 'br')
             outer_edge_fill(quad, 'br', 'r')
 
-            for quad_loc in [qtl, qtr, qbl, qbr]:
-                dfs(quad_loc)
+            if recursive:
+                for quad_loc in [qtl, qtr, qbl, qbr]:
+                    dfs(quad_loc)
         
         if root is None:
             root = self.quadtree.root
@@ -199,7 +764,91 @@ class RoutingNetwork(Network):
         self.__fill_shallow_neighs__()
         self.__build_graph__()
 
-    def calculate_distance(self, node_from:QuadNode, node_to:QuadNode, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, scaled=True, penalty: float = 10.0):
+    def to_csr(self) -> Tuple[List[QuadNode], np.ndarray, np.ndarray]:
+        """
+        Adjacency as CSR arrays (indptr, indices) over the network nodes, numbered in the returned order
+        """
+        nodes = list(self._graph.keys())
+        ids = {node: idx for idx, node in enumerate(nodes)}
+        for node in list(nodes):
+            for neigh in self._graph[node]:
+                if neigh not in ids:
+                    ids[neigh] = len(nodes)
+                    nodes.append(neigh)
+
+        counts = np.array([len(self._graph.get(node, ())) for node in nodes], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        indices = np.fromiter((ids[neigh] for node in nodes for neigh in self._graph.get(node, ())), dtype=np.int64, count=indptr[-1])
+
+        return nodes, indptr, indices
+
+    @classmethod
+    def from_csr(cls, quadtree:QuadTree, nodes:List[QuadNode], indptr:np.ndarray, indices:np.ndarray, directed:bool = False) -> RoutingNetwork:
+        """
+        Network over the given nodes from CSR adjacency, without searching the tree for neighbors
+        """
+        network = cls(quadtree, directed=directed)
+        indptr, indices = np.asarray(indptr).tolist(), np.asarray(indices).tolist()
+
+        for idx, node in enumerate(nodes):
+            network._graph[node] = {nodes[neigh] for neigh in indices[indptr[idx]:indptr[idx + 1]]}
+
+        return network
+
+    def refine(self, quad:QuadNode) -> List[QuadNode]:
+        """
+        Subdivides an unrefined leaf (see QuadTree.refine) and links its children in its place
+        """
+        children = self.quadtree.refine(quad)
+        if not children:
+            return children
+
+        neighs = self._graph.pop(quad, set())
+        for neigh in neighs:
+            self._graph[neigh].discard(quad)
+        self.__touch__(neighs)
+        self.__touch__((quad,), removed=True)
+
+        # neighbors of quad's ancestors may have been refined too, so refresh them along the path down
+        ancestor = self.quadtree.root
+        while ancestor is not quad:
+            self.__fill_shallow_neighs__(ancestor, recursive=False)
+            direction = quad.center_point - ancestor.center_point
+            ancestor = ancestor[("t" if direction[1] >= 0.0 else "b") + ("r" if direction[0] >= 0.0 else "l")]
+
+        self.__fill_shallow_neighs__(quad)
+        self.__build_graph__(children)
+        for child in children:
+            for neigh in self._graph[child]:
+                self._graph[neigh].add(child)
+
+        return children
+
+    def __refined_neighbors__(self, quad:QuadNode) -> Set[QuadNode]:
+        """
+        Neighbors of quad, after refining the unrefined ones until quad only borders fully refined leaves
+        """
+        unrefined = [neigh for neigh in self._graph[quad] if neigh.unrefined]
+        while unrefined:
+            for neigh in unrefined:
+                self.refine(neigh)
+            unrefined = [neigh for neigh in self._graph[quad] if neigh.unrefined]
+
+        return self._graph[quad]
+
+    def refine_at(self, x:Point) -> QuadNode:
+        """
+        Refines the leaves containing x until it lies in a fully refined leaf, and returns that leaf
+        """
+        x = np.asarray(x, dtype=float)
+        quad = self.quadtree.__descend__(x, self.quadtree.root)
+        while quad is not None and quad.unrefined:
+            self.refine(quad)
+            quad = self.quadtree.__descend__(x, quad)
+
+        return quad
+
+    def calculate_distance(self, node_from:QuadNode, node_to:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, scaled=True, penalty: float = 10.0):
         if scaled:
             multipler = penalty if node_to.boundary_zone == 0 else scale_tranform(node_to.boundary_max_range)
         else:
@@ -215,24 +864,29 @@ class RoutingNetwork(Network):
             total_path.append(current)
         return total_path[::-1]
     
-    def find_path(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, alg:RoutingAlgorithmStr='A*', penalty: float = 10.0):
+    def find_path(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, alg:RoutingAlgorithmStr='A*', penalty: float = 10.0):
         """Routing Algorithms
 
         Options:
         * A*
         * Dijkstra
+        * A*-CSR, Dijkstra-CSR (same searches over the compiled network). On lazy trees with unrefined leaves,
+          or for quads outside the network, they run the graph searches instead (with a one-time RuntimeWarning)
+        * Bidirectional-A* (over the compiled network, with the same graph fallback)
+        * ALT (A* with landmark bounds, see build_landmarks)
         * [Any algorithm included by user]
         """
 
         return self.routing_algs[alg.lower()](start_node=start_node, end_node=end_node, scale_tranform=scale_tranform, penalty=penalty)
     
-    def find_path_A_star(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, penalty: float = 10.0) -> Optional[List[QuadNode]]:
+    def find_path_A_star(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0) -> Optional[List[QuadNode]]:
         """ find path (A*) 
         
         Returns None if no path found
         """
+        counter = itertools.count() # tie-breaker, so quads are never compared
         open_set = []
-        heapq.heappush(open_set, (0, start_node))
+        heapq.heappush(open_set, (0, next(counter), 0, start_node))
 
         came_from = {}
         g_score = defaultdict(lambda: np.inf)
@@ -242,64 +896,155 @@ class RoutingNetwork(Network):
         f_score[start_node] = self.calculate_distance(start_node, end_node, scaled=False)
 
         while open_set:
-            _, current = heapq.heappop(open_set)
+            _, _, g, current = heapq.heappop(open_set)
 
             if current == end_node:
                 return self.__reconstruct_path__(came_from, current)
+            
+            if g > g_score[current]:
+                continue # stale entry, the quad was pushed again with a lower score
 
-            for neighbor in self._graph[current]:
+            for neighbor in self.__refined_neighbors__(current):
                 tentative_g_score = g_score[current] + self.calculate_distance(current, neighbor, scale_tranform=scale_tranform, penalty=penalty)
 
                 if tentative_g_score < g_score[neighbor]:
                     came_from[neighbor] = current
                     g_score[neighbor] = tentative_g_score
                     f_score[neighbor] = tentative_g_score + self.calculate_distance(neighbor, end_node, scaled=False)
-
-                    if neighbor not in [i[1] for i in open_set]:
-                        heapq.heappush(open_set, (f_score[neighbor], neighbor))
+                    heapq.heappush(open_set, (f_score[neighbor], next(counter), tentative_g_score, neighbor))
 
         return None
     
-    def find_path_dijkstra(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, penalty: float = 10.0)-> Optional[List[QuadNode]]:
+    def __warn_fallback__(self, reason:str) -> None:
+        if not self.__fallback_warned:
+            self.__fallback_warned = True
+            warnings.warn(f"Compiled search fell back to the graph search: {reason} (warned once per network)", RuntimeWarning)
+
+    def __find_path_csr__(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform, penalty:float, heuristic:bool) -> Optional[List[QuadNode]]:
+        compiled = self.compiled
+
+        if compiled.unrefined or start_node not in compiled.ids or end_node not in compiled.ids:
+            # lazy trees refine while searching and isolated nodes have no ids, so search the graph itself
+            self.__warn_fallback__("the tree has unrefined leaves" if compiled.unrefined else "start or end quad is not in the network")
+            search = self.find_path_A_star if heuristic else self.find_path_dijkstra
+            return search(start_node, end_node, scale_tranform=scale_tranform, penalty=penalty)
+
+        weights = self.edge_weights(scale_tranform, penalty, as_list=True)
+        path = compiled.search(compiled.ids[start_node], compiled.ids[end_node], weights, heuristic=heuristic)
+
+        return None if path is None else [compiled.nodes[idx] for idx in path]
+
+    def find_path_A_star_csr(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0) -> Optional[List[QuadNode]]:
+        """ find path (A* over the compiled network)
+        
+        Returns None if no path found
+        """
+        return self.__find_path_csr__(start_node, end_node, scale_tranform, penalty, heuristic=True)
+
+    def find_path_dijkstra_csr(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0) -> Optional[List[QuadNode]]:
+        """ find path (Dijkstra over the compiled network)
+        
+        Returns None if no path found
+        """
+        return self.__find_path_csr__(start_node, end_node, scale_tranform, penalty, heuristic=False)
+    
+    def find_path_bidirectional_A_star(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0) -> Optional[List[QuadNode]]:
+        """ find path (bidirectional A* over the compiled network)
+        
+        Returns None if no path found
+        """
+        compiled = self.compiled
+
+        if compiled.unrefined or start_node not in compiled.ids or end_node not in compiled.ids:
+            return self.__find_path_csr__(start_node, end_node, scale_tranform, penalty, heuristic=True)
+        
+        path = compiled.bidirectional_search(compiled.ids[start_node], compiled.ids[end_node],
+                                             self.edge_weights(scale_tranform, penalty, as_list=True),
+                                             self.edge_weights(scale_tranform, penalty, as_list=True, reverse=True))
+
+        return None if path is None else [compiled.nodes[idx] for idx in path]
+
+    def build_landmarks(self, k:int = 8, scale_tranform:FieldScaleTransform=default_scale_transform, penalty:float = 10.0) -> Landmarks:
+        """
+        Preprocesses ALT landmark tables (see Landmarks.build) for the 'ALT' search under the cost model
+        """
+        self.landmarks = Landmarks.build(self, k=k, scale_tranform=scale_tranform, penalty=penalty)
+        return self.landmarks
+    
+    def repair_landmarks(self) -> Landmarks:
+        """
+        Recomputes stale landmark tables after edits, keeping the landmarks still in the network
+        """
+        landmarks = self.landmarks
+        if landmarks is None:
+            raise ValueError("Network has no landmarks to repair, build them first (see build_landmarks)")
+        self.landmarks = Landmarks.build(self, k=len(landmarks), scale_tranform=landmarks.scale_tranform, penalty=landmarks.penalty,
+                                         landmarks=[node for node in landmarks.nodes if node is not None])
+        return self.landmarks
+
+    def find_path_ALT(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0) -> Optional[List[QuadNode]]:
+        """ find path (A* with landmark bounds over the compiled network)
+
+        Falls back to A* over the compiled network when there are no landmarks for the cost model or they are stale.
+        Returns None if no path found
+        """
+        compiled, landmarks = self.compiled, self.landmarks
+
+        if landmarks is None or landmarks.stale or landmarks.compiled is not compiled or compiled.unrefined \
+           or start_node not in compiled.ids or end_node not in compiled.ids \
+           or not landmarks.matches(self.cost_multipliers(scale_tranform, penalty), scale_tranform, penalty):
+            return self.__find_path_csr__(start_node, end_node, scale_tranform, penalty, heuristic=True)
+        
+        end = compiled.ids[end_node]
+        path = compiled.search(compiled.ids[start_node], end, self.edge_weights(scale_tranform, penalty, as_list=True),
+                               potential=landmarks.heuristic(end, start=compiled.ids[start_node]))
+
+        return None if path is None else [compiled.nodes[idx] for idx in path]
+
+    def find_path_dijkstra(self, start_node:QuadNode, end_node:QuadNode, scale_tranform:FieldScaleTransform=default_scale_transform, penalty: float = 10.0)-> Optional[List[QuadNode]]:
         """ find path (Dijkstra) 
         
         Returns None if no path found
         """
+        counter = itertools.count() # tie-breaker, so quads are never compared
         open_set = []
-        heapq.heappush(open_set, (0, start_node))
+        heapq.heappush(open_set, (0, next(counter), start_node))
 
         came_from = {}
         dist = defaultdict(lambda: np.inf)
         dist[start_node] = 0
 
         while open_set:
-            _, current = heapq.heappop(open_set)
+            d, _, current = heapq.heappop(open_set)
 
             if current == end_node:
                 return self.__reconstruct_path__(came_from, current)
+            
+            if d > dist[current]:
+                continue # stale entry, the quad was pushed again with a lower distance
 
-            for neighbor in self._graph[current]:
+            for neighbor in self.__refined_neighbors__(current):
                 tentative_dist = dist[current] + self.calculate_distance(current, neighbor, scale_tranform=scale_tranform, penalty=penalty)
 
                 if tentative_dist < dist[neighbor]:
                     came_from[neighbor] = current
                     dist[neighbor] = tentative_dist
-
-                    if neighbor not in [i[1] for i in open_set]:
-                        heapq.heappush(open_set, (dist[neighbor], neighbor))
+                    heapq.heappush(open_set, (tentative_dist, next(counter), neighbor))
 
         return None
 
-    def find_route(self, pointA:Point, pointB:Point, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, alg:RoutingAlgorithmStr='A*', penalty:float=10.0):
+    def find_route(self, pointA:Point, pointB:Point, scale_tranform:FieldScaleTransform=default_scale_transform, alg:RoutingAlgorithmStr='A*', penalty:float=10.0):
         
-        quads = self.quadtree.find_quads([pointA, pointB])
+        quads = [self.refine_at(pointA), self.refine_at(pointB)]
         return self.find_path(quads[0], quads[1], scale_tranform=scale_tranform, alg=alg, penalty=penalty)
 
-    def find_many_routes(self, pointsA:Point, pointsB:Point, scale_tranform:FieldScaleTransform=lambda x: 1.0 + x, alg:RoutingAlgorithmStr='A*'):
+    def find_many_routes(self, pointsA:Point, pointsB:Point, scale_tranform:FieldScaleTransform=default_scale_transform, alg:RoutingAlgorithmStr='A*'):
         pointsA, pointsB = np.array(pointsA), np.array(pointsB)
         n = len(pointsA)
 
-        quads = self.quadtree.find_quads(np.concatenate([pointsA, pointsB], axis=0))
+        points = np.concatenate([pointsA, pointsB], axis=0)
+        quads = self.quadtree.find_quads(points)
+        quads = [self.refine_at(x) if quad is not None and quad.unrefined else quad for x, quad in zip(points, quads)]
 
         return [self.find_path(quads[idx], quads[n+idx], scale_tranform=scale_tranform, alg=alg) for idx in range(n)]
     
@@ -1,7 +1,9 @@
 from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional, Set, Tuple, Union
 import numpy as np
 from larp import PotentialField
+from larp.fn import __expand_ranges__
 
 from larp.types import Point
 
@@ -16,7 +18,32 @@ def __list_to_dict__(array:Union[np.ndarray, List[float]]):
 
     return dict(zip(values, np.arange(len(values))))
 
+def __group_by__(keys:np.ndarray) -> List[Tuple[int, np.ndarray]]:
+    """
+    Groups the positions of equal keys, as (key, positions) pairs
+    """
+    order = np.argsort(keys, kind='stable')
+    groups, starts = np.unique(keys[order], return_index=True)
+
+    return list(zip(groups, np.split(order, starts[1:])))
+
+def __morton__(cells:np.ndarray, depth:int) -> np.ndarray:
+    """
+    Interleaves integer cell coordinates (n x 2) into Morton codes with digit 2*y + x per level
+    """
+    cells = np.asarray(cells).astype(np.uint64)
+    codes = np.zeros(len(cells), dtype=np.uint64)
+    for bit in range(depth):
+        shift = np.uint64(bit)
+        codes |= ((cells[:, 0] >> shift) & np.uint64(1)) << (np.uint64(2)*shift)
+        codes |= ((cells[:, 1] >> shift) & np.uint64(1)) << (np.uint64(2)*shift + np.uint64(1))
+
+    return codes
+
 class QuadTree():
+    LOCATE_EDGE_TOL = 1e-7 # fraction of the finest cell treated as lying on its edge
+    LOCATE_DESCEND_POINTS = 32 # up to this many points, find_quads descends the tree instead of rebuilding a stale locator
+    CHILD_OFFSETS = np.array([[-1.0, -1.0], [1.0, -1.0], [-1.0, 1.0], [1.0, 1.0]]) # center offsets of the children, in QuadNode order (bl, br, tl, tr)
 
     def __init__(self, field: PotentialField,
                  minimum_length_limit:float = 5.0,
@@ -40,6 +67,7 @@ class QuadTree():
 
         self.root = None
         self.leaves:Set[QuadNode] = set()
+        self.__locator = None
 
         if build_tree:
             self.build()
@@ -47,12 +75,19 @@ class QuadTree():
     def mark_leaf(self, quad:QuadNode) -> None:
         quad.leaf = True
         self.leaves.add(quad)
+        self.__locator = None
+
+    def reset_locator(self) -> None:
+        """
+        Drops the leaf table used by locate. Needed after leaves are edited outside of the tree methods
+        """
+        self.__locator = None
 
     def __approximated_PF_zones__(self, center_point:Point, size:float, filter_idx:Optional[List[int]] = None) -> Tuple[List[int], np.ndarray]: 
         n_rgjs = len(filter_idx)
         zones = np.ones(n_rgjs, dtype=int) * self.n_zones
 
-        rep_vectors, refs_idxs = self.field.repulsion_vectors([center_point], filted_idx=filter_idx, min_dist_select=True, reference_idx=True)
+        rep_vectors, refs_idxs = self.field.repulsion_vectors([center_point], filted_idx=filter_idx, min_dist_select=True, reference_idx=True, cull=False)
 
         dist_sqr = (rep_vectors*rep_vectors).sum(1)
         zone0_select = dist_sqr <= (size*size)/2.0
@@ -118,12 +153,214 @@ class QuadTree():
 
         return quad
 
-    def build(self) -> QuadNode:
+    def __approximated_PF_zones_batch__(self, centers:np.ndarray, sizes:np.ndarray, rgj_idxs:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Zones and repulsion vectors of many (cell, RGJ) pairs, as in `__approximated_PF_zones__`,
+        from two batched queries per RGJ
+        """
+        zones = np.ones(len(rgj_idxs), dtype=int) * self.n_zones
+        rep_vectors = np.zeros((len(rgj_idxs), 2))
+
+        for idx, select in __group_by__(rgj_idxs):
+            rep_vectors[select] = self.field.rgjs[idx].repulsion_vector(centers[select], min_dist_select=True).reshape(-1, 2)
+
+        dist_sqr = (rep_vectors*rep_vectors).sum(1)
+        zone0_select = dist_sqr <= (sizes*sizes)/2.0
+        zones[zone0_select] = 0
+
+        not_zone0 = np.nonzero(~zone0_select)[0]
+        if len(not_zone0):
+            vectors = rep_vectors[not_zone0]
+            uni_vectors = vectors/np.linalg.norm(vectors, axis=1, keepdims=True)
+            points = centers[not_zone0] - uni_vectors*(sizes[not_zone0]/np.sqrt(2)).reshape(-1, 1)
+
+            dist_sqr = np.zeros(len(not_zone0))
+            for idx, select in __group_by__(rgj_idxs[not_zone0]):
+                dist_sqr[select] = self.field.rgjs[idx].squared_dist(points[select], scaled=True, inverted=True)
+
+            zones[not_zone0] = np.digitize(dist_sqr, self.__zones_rad_ln, right=True) + 1
+
+        return zones, rep_vectors
+
+    def __zone_level__(self, centers:np.ndarray, sizes:np.ndarray, counts:np.ndarray, rgj_idxs:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Zones every (cell, candidate RGJ) pair of a level, the candidates of each cell being consecutive in rgj_idxs.
+        Returns the boundary zone of each cell, whether each cell is a leaf, and the cell and zone of each pair
+        """
+        n = len(centers)
+        cell_idxs = np.repeat(np.arange(n), counts)
+        zones, rep_vectors = self.__approximated_PF_zones_batch__(centers[cell_idxs], sizes[cell_idxs], rgj_idxs)
+
+        boundary_zones = np.ones(n, dtype=int) * self.n_zones
+        np.minimum.at(boundary_zones, cell_idxs, zones)
+
+        small = sizes <= self.max_sector_size
+        leaves = small & ((sizes/2.0 < self.min_sector_size) | (boundary_zones == self.n_zones))
+
+        if self.conservative:
+            # stop subdiving cells whose sphere does not leave the zone
+            check = small & ~leaves & (boundary_zones > 0)
+            pairs = np.nonzero(check[cell_idxs] & (zones == boundary_zones[cell_idxs]))[0]
+
+            if len(pairs):
+                pair_cells = cell_idxs[pairs]
+                vectors = rep_vectors[pairs]
+                uni_vectors = vectors/np.linalg.norm(vectors, axis=1, keepdims=True)
+                points = centers[pair_cells] + uni_vectors*(sizes[pair_cells]/np.sqrt(2)).reshape(-1, 1)
+
+                bounds_evals = np.zeros(len(pairs))
+                for idx, select in __group_by__(rgj_idxs[pairs]):
+                    bounds_evals[select] = self.field.rgjs[idx].eval(points[select])
+
+                reached = pair_cells[bounds_evals >= self.ZONEToMinRANGE[boundary_zones[pair_cells]]]
+                leaves[reached] = True
+
+        return boundary_zones, leaves, cell_idxs, zones
+
+    def __build_levels__(self, quads:List[QuadNode], candidates:List[np.ndarray], max_depth:Optional[int] = None, lazy_depth:Optional[int] = None) -> Tuple[List[QuadNode], List[np.ndarray]]:
+        """
+        Zones and subdivides the given quads one level at a time, so that every (cell, RGJ) pair
+        of a level is zoned together. Returns the quads (and their candidate RGJs) left unzoned at max_depth.
+        Quads zoned at lazy_depth are marked unrefined leaves instead of being subdivided
+        """
+        depth = 0
+
+        while quads and (max_depth is None or depth < max_depth):
+            n = len(quads)
+            counts = np.array([len(idxs) for idxs in candidates], dtype=int)
+            centers = np.array([quad.center_point for quad in quads], dtype=float).reshape(-1, 2)
+            sizes = np.array([quad.size for quad in quads], dtype=float)
+            rgj_idxs = np.concatenate(candidates).astype(int)
+
+            boundary_zones, leaves, cell_idxs, zones = self.__zone_level__(centers, sizes, counts, rgj_idxs)
+
+            select = zones < self.n_zones
+            splits = np.cumsum(np.bincount(cell_idxs[select], minlength=n))[:-1]
+            kept_idxs = np.split(rgj_idxs[select], splits)
+            kept_zones = np.split(zones[select], splits)
+
+            next_quads, next_candidates = [], []
+            for i, quad in enumerate(quads):
+                quad.boundary_zone = int(boundary_zones[i])
+                quad.boundary_max_range = self.ZONEToMaxRANGE[quad.boundary_zone]
+                if counts[i]:
+                    quad.rgj_idx, quad.rgj_zones = kept_idxs[i], kept_zones[i]
+
+                if leaves[i]:
+                    self.mark_leaf(quad)
+                    continue
+
+                if depth == lazy_depth:
+                    quad.unrefined = True
+                    self.mark_leaf(quad)
+                    continue
+
+                size2 = quad.size/2.0
+                size4 = size2/2.0
+                for child, offset in enumerate(self.CHILD_OFFSETS):
+                    quad[child] = QuadNode(center_point=quad.center_point + offset*size4, size=size2)
+                    next_quads.append(quad[child])
+                    next_candidates.append(quad.rgj_idx)
+
+            quads, candidates = next_quads, next_candidates
+            depth += 1
+
+        return quads, candidates
+
+    def __build_breadth_first__(self, center_point:Point, size:float, filter_idx:np.ndarray, lazy_depth:Optional[int] = None) -> QuadNode:
+        """
+        Builds the same tree as `__build__` one level at a time
+        """
+        root = QuadNode(center_point=center_point, size=size)
+        self.__build_levels__([root], [np.asarray(filter_idx, dtype=int)], lazy_depth=lazy_depth)
+
+        return root
+
+    def __build_parallel__(self, center_point:Point, size:float, filter_idx:np.ndarray, workers:int, split_depth:Optional[int] = None) -> QuadNode:
+        """
+        Builds the levels above split_depth here and every subtree below it in a process pool,
+        shipping each subtree only the RGJs it can reach
+        """
+        if split_depth is None:
+            split_depth = int(np.ceil(np.log(4*workers)/np.log(4))) # about four subtrees per worker
+
+        root = QuadNode(center_point=center_point, size=size)
+        quads, candidates = self.__build_levels__([root], [np.asarray(filter_idx, dtype=int)], max_depth=split_depth)
+
+        shipped = [i for i in range(len(quads)) if len(candidates[i])]
+        empty = [i for i in range(len(quads)) if not len(candidates[i])]
+        self.__build_levels__([quads[i] for i in empty], [candidates[i] for i in empty])
+
+        options = {
+            'minimum_length_limit': self.min_sector_size,
+            'maximum_length_limit': self.max_sector_size,
+            'edge_bounds': self.edge_bounds,
+            'conservative': self.conservative
+        }
+        tasks = [(quads[i].center_point, quads[i].size, [self.field.rgjs[idx] for idx in candidates[i]], options) for i in shipped]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for i, subtree in zip(shipped, executor.map(__build_subtree__, tasks)):
+                # subtrees index the RGJs shipped with them
+                subtree['rgj_idx'] = candidates[i][subtree['rgj_idx']]
+                self.leaves.update(__unflatten_quads__(subtree, root=quads[i])[1])
+
+        return root
+
+    def build(self, breadth_first:bool = True, workers:Optional[int] = None, split_depth:Optional[int] = None, lazy_depth:Optional[int] = None) -> QuadNode:
+        """
+        Builds the tree level by level (breadth_first) or one quad at a time.
+        With workers > 1, subtrees below split_depth are built in parallel processes.
+        With lazy_depth, quads deeper than lazy_depth are left unrefined until `refine` is called on them
+        (lazy trees are built in a single process)
+        """
+        if lazy_depth is not None and workers is not None and workers > 1:
+            raise ValueError("Lazy trees are built in a single process, lazy_depth cannot be combined with workers")
+
         self.leaves:Set[QuadNode] = set()
+        self.__locator = None
+
+        if lazy_depth is not None:
+            self.root = self.__build_breadth_first__(self.field.center_point, self.size, np.arange(len(self.field)), lazy_depth=lazy_depth)
+            return self.root
         
-        self.root = self.__build__(self.field.center_point, self.size, np.arange(len(self.field)))
+        if workers is not None and workers > 1:
+            self.root = self.__build_parallel__(self.field.center_point, self.size, np.arange(len(self.field)), workers=workers, split_depth=split_depth)
+            return self.root
+
+        build = self.__build_breadth_first__ if breadth_first else self.__build__
+        self.root = build(self.field.center_point, self.size, np.arange(len(self.field)))
         return self.root
     
+    def refine(self, quad:QuadNode) -> List[QuadNode]:
+        """
+        Subdivides an unrefined leaf one level, zoning its children against the leaf's RGJs.
+        Returns the children (themselves unrefined if they need further subdivision).
+        Networks over the tree must refine through RoutingNetwork.refine to stay linked
+        """
+        return self.refine_leaves([quad])
+
+    def refine_leaves(self, quads:Optional[List[QuadNode]] = None) -> List[QuadNode]:
+        """
+        Refines the given (by default all) unrefined leaves one level, zoning their children together
+        """
+        quads = [quad for quad in (self.leaves if quads is None else quads) if quad.unrefined]
+        children, candidates = [], []
+
+        for quad in quads:
+            quad.unrefined = quad.leaf = False
+            self.leaves.discard(quad)
+
+            size2 = quad.size/2.0
+            size4 = size2/2.0
+            for child, offset in enumerate(self.CHILD_OFFSETS):
+                quad[child] = QuadNode(center_point=quad.center_point + offset*size4, size=size2)
+                children.append(quad[child])
+                candidates.append(quad.rgj_idx)
+
+        self.__build_levels__(children, candidates, lazy_depth=0)
+        return children
+
     def to_boundary_lines_collection(self, margin=0.1) -> List[np.ndarray]:
         lines = [quad.to_boundary_lines(margin=margin) for quad in self.leaves]
         
@@ -133,25 +370,92 @@ class QuadTree():
         return np.array([quad.boundary_max_range for quad in self.leaves])
     
     def find_quads(self, x:Union[List[Point],np.ndarray]) -> List[QuadNode]:
-        """ Finds quad for given points
-
-        * Pool parallization not possible because quad memory reference is needed
+        """ Finds quad for given points (see locate). A few points are found by descending the tree
+        when the locator is stale, so lookups between refinements do not rebuild it
         """
-        x = np.array(x)
+        x = np.asarray(x, dtype=float).reshape(-1, 2)
+        if self.__locator is None and len(x) <= self.LOCATE_DESCEND_POINTS:
+            return [self.__descend__(point, self.root) for point in x]
 
-        def subdivide(x:Point, quad:QuadNode) -> List[QuadNode]:
-            if quad is None or quad.leaf:
-                return quad
+        return self.locate(x, return_quads=True)[1]
 
+    def __descend__(self, x:Point, quad:Optional[QuadNode]) -> Optional[QuadNode]:
+        while quad is not None and not quad.leaf:
             direction = x - quad.center_point
             if direction[1] >= 0.0:
-                quadstr = "tr" if direction[0] >= 0.0 else "tl"
+                quad = quad["tr"] if direction[0] >= 0.0 else quad["tl"]
             else:
-                quadstr = "br" if direction[0] >= 0.0 else "bl"
+                quad = quad["br"] if direction[0] >= 0.0 else quad["bl"]
+
+        return quad
+
+    def __quad_cells__(self, quads:List[QuadNode]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Grid cell (at their own level) and depth of each quad, and the lower-left corner of the tree
+        """
+        sizes = np.array([quad.size for quad in quads], dtype=float)
+        depths = np.rint(np.log2(self.size/sizes)).astype(np.int64)
+
+        if len(quads) and depths.max() > LinearQuadTree.MAX_DEPTH:
+            raise ValueError(f"Tree depth {depths.max()} exceeds the maximum locational code depth of {LinearQuadTree.MAX_DEPTH}")
+
+        corner = self.root.center_point - self.size/2.0 if self.root is not None else np.zeros(2)
+        centers = np.array([quad.center_point for quad in quads], dtype=float).reshape(-1, 2)
+        cells = np.rint((centers - corner)/sizes[:, None] - 0.5).astype(np.int64)
+
+        return cells, depths, corner
+
+    def quad_codes(self, quads:List[QuadNode]) -> np.ndarray:
+        """
+        Locational codes of the given quads, as in LinearQuadTree
+        """
+        cells, depths, _ = self.__quad_cells__(quads)
+        max_depth = int(depths.max()) if len(quads) else 0
 
-            return subdivide(x, quad=quad[quadstr])
+        return (np.uint64(1) << (np.uint64(2)*depths.astype(np.uint64))) | __morton__(cells, max_depth)
 
-        return [subdivide(x=xi, quad=self.root) for xi in x]
+    def __build_locator__(self) -> None:
+        """
+        Sorts the leaves by the Morton code of their lower-left cell at the deepest leaf level
+        """
+        leaves = list(self.leaves)
+        cells, depths, corner = self.__quad_cells__(leaves)
+        max_depth = int(depths.max()) if len(leaves) else 0
+        cells = cells << (max_depth - depths)[:, None]
+
+        starts = __morton__(cells, max_depth)
+        order = np.argsort(starts, kind='stable')
+        leaves = [leaves[idx] for idx in order]
+        self.__locator = (max_depth, corner, starts[order], leaves, {leaf: idx for idx, leaf in enumerate(leaves)})
+
+    def locate(self, x:Union[List[Point],np.ndarray], return_quads:bool = False) -> Union[np.ndarray, Tuple[np.ndarray, List[QuadNode]]]:
+        """
+        Finds the leaf of every point at once. Leaf ids are positions in the Z-order of the leaves (-1 without leaves).
+        Points outside of the tree fall in the nearest border leaf
+        """
+        if self.__locator is None:
+            self.__build_locator__()
+        max_depth, corner, starts, leaves, leaf_ids = self.__locator
+
+        x = np.asarray(x, dtype=float).reshape(-1, 2)
+        if not len(leaves):
+            ids = np.full(len(x), -1, dtype=int)
+            return (ids, [None]*len(x)) if return_quads else ids
+
+        scaled = (x - corner)/(self.size/2.0**max_depth)
+        cells = np.clip(np.floor(scaled), 0, 2**max_depth - 1).astype(np.int64)
+        ids = np.searchsorted(starts, __morton__(cells, max_depth), side='right') - 1
+
+        # points on cell edges are settled by descending, so ties split as in the tree
+        frac = scaled - np.floor(scaled)
+        edge = np.nonzero(((frac < self.LOCATE_EDGE_TOL) | (frac > 1.0 - self.LOCATE_EDGE_TOL)).any(1))[0]
+        if len(edge):
+            ids[edge] = [leaf_ids.get(self.__descend__(x[idx], self.root), -1) for idx in edge]
+
+        if return_quads:
+            return ids, [leaves[idx] if idx >= 0 else None for idx in ids]
+
+        return ids
     
     def __search_leaves__(self, quad:QuadNode):
         if quad is None: raise TypeError(f"Branch missing leaf for quad {str(quad)}")
@@ -180,6 +484,7 @@ class QuadTree():
                 'center_point': quad.center_point,
                 'size': quad.size,
                 'leaf': quad.leaf,
+                'unrefined': quad.unrefined,
                 'boundary_zone': quad.boundary_zone,
                 'boundary_max_range': quad.boundary_max_range,
                 'rgj_idx': quad.rgj_idx,
@@ -216,6 +521,7 @@ class QuadTree():
                             size = quad_data['size'])
             
             quad.leaf = quad_data['leaf']
+            quad.unrefined = quad_data.get('unrefined', False)
             quad.boundary_zone = quad_data['boundary_zone']
             quad.boundary_max_range = quad_data['boundary_max_range']
             quad.rgj_idx = quad_data['rgj_idx']
@@ -234,6 +540,7 @@ class QuadTree():
         self.ZONEToMinRANGE = data['ZONEToMinRANGE']
         self.root = __load_quad__(data['root'])
         self.leaves = self.search_leaves()
+        self.__locator = None
 
     def quad_to_image(self, quad:Optional[QuadNode] = None, resolution:int = 200, margin:float = 0.0) -> np.ndarray:
 
@@ -246,6 +553,263 @@ class QuadTree():
                                    size=[quad.size]*2,
                                    filted_idx=quad.rgj_idx)
 
+def __flatten_quads__(root:QuadNode) -> dict:
+    """
+    Flat arrays (depth-first order, children as positions or -1) of the subtree under root
+    """
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(child for child in node.children[::-1] if child is not None)
+
+    position = {id(node): i for i, node in enumerate(nodes)}
+    counts = np.array([len(node.rgj_idx) for node in nodes], dtype=int)
+
+    return {
+        'center_point': np.array([node.center_point for node in nodes], dtype=float).reshape(-1, 2),
+        'size': np.array([node.size for node in nodes], dtype=float),
+        'leaf': np.array([node.leaf for node in nodes], dtype=bool),
+        'boundary_zone': np.array([node.boundary_zone for node in nodes], dtype=int),
+        'boundary_max_range': np.array([node.boundary_max_range for node in nodes], dtype=float),
+        'children': np.array([[-1 if child is None else position[id(child)] for child in node.children] for node in nodes], dtype=int).reshape(-1, 4),
+        'rgj_offsets': np.concatenate([[0], np.cumsum(counts)]),
+        'rgj_idx': np.concatenate([node.rgj_idx for node in nodes]).astype(int),
+        'rgj_zones': np.concatenate([node.rgj_zones for node in nodes]).astype(int)
+    }
+
+def __unflatten_quads__(data:dict, root:Optional[QuadNode] = None) -> Tuple[QuadNode, Set[QuadNode]]:
+    """
+    Rebuilds the quads of `__flatten_quads__`, reusing root (if given) for the first one. Returns the root and the leaves
+    """
+    n = len(data['size'])
+    nodes = [QuadNode(center_point=data['center_point'][i], size=data['size'][i]) for i in range(n)] if root is None \
+            else [root] + [QuadNode(center_point=data['center_point'][i], size=data['size'][i]) for i in range(1, n)]
+    rgj_idx = np.split(data['rgj_idx'], data['rgj_offsets'][1:-1])
+    rgj_zones = np.split(data['rgj_zones'], data['rgj_offsets'][1:-1])
+
+    leaf, boundary_zone = np.asarray(data['leaf']).tolist(), np.asarray(data['boundary_zone']).tolist()
+    boundary_max_range, children = np.asarray(data['boundary_max_range']).tolist(), np.asarray(data['children']).tolist()
+
+    leaves = set()
+    for i, node in enumerate(nodes):
+        node.leaf = bool(leaf[i])
+        node.boundary_zone = int(boundary_zone[i])
+        node.boundary_max_range = boundary_max_range[i]
+        node.rgj_idx, node.rgj_zones = rgj_idx[i], rgj_zones[i]
+        node.children = [None if child < 0 else nodes[child] for child in children[i]]
+
+        if node.leaf:
+            leaves.add(node)
+
+    return nodes[0], leaves
+
+def __build_subtree__(task:Tuple[Point, float, list, dict]) -> dict:
+    """
+    Process pool worker of `QuadTree.build`, builds one subtree over the RGJs shipped with it
+    """
+    center_point, size, rgjs, options = task
+    tree = QuadTree(PotentialField(rgjs=rgjs), size=size, **options)
+
+    return __flatten_quads__(tree.__build_breadth_first__(center_point, size, np.arange(len(rgjs))))
+
+class LinearQuadTree():
+    """
+    Array-backed quadtree. Nodes are kept in flat arrays sorted by locational (Morton) code: 1 for the root and
+    4*parent + 2*top + right for children, so level by level and in Z-order within a level.
+    RGJ indexes and zones of every node are packed as CSR arrays (rgj_offsets, rgj_idx, rgj_zones)
+
+    `to_quadtree` returns the QuadNode-based tree expected by RoutingNetwork and HotLoader
+    """
+
+    MAX_DEPTH = 31 # deepest level representable by 64-bit locational codes
+
+    def __init__(self, field: PotentialField,
+                 minimum_length_limit:float = 5.0,
+                 maximum_length_limit:float = np.inf,
+                 edge_bounds:Union[np.ndarray, List[float]] = np.arange(0.2, 0.8, 0.2),
+                 size:Optional[float] = None,
+                 conservative:bool = False,
+                 build_tree:bool = False) -> None:
+
+        # root-less tree holding the parameters and the zoning of each level
+        self.template = QuadTree(field,
+                                 minimum_length_limit=minimum_length_limit,
+                                 maximum_length_limit=maximum_length_limit,
+                                 edge_bounds=edge_bounds,
+                                 size=size,
+                                 conservative=conservative)
+        self.field = field
+        self.size = self.template.size
+        self.center_point = np.array(field.center_point, dtype=float)
+
+        self.codes = np.zeros(0, dtype=np.uint64)
+        self.depth = np.zeros(0, dtype=np.uint8)
+        self.leaf = np.zeros(0, dtype=bool)
+        self.boundary_zone = np.zeros(0, dtype=np.int8)
+        self.boundary_max_range = np.zeros(0, dtype=float)
+        self.rgj_offsets = np.zeros(1, dtype=np.int64)
+        self.rgj_idx = np.zeros(0, dtype=np.int32)
+        self.rgj_zones = np.zeros(0, dtype=np.int8)
+
+        if build_tree:
+            self.build()
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.codes, self.depth, self.leaf, self.boundary_zone, self.boundary_max_range,
+                                              self.rgj_offsets, self.rgj_idx, self.rgj_zones))
+
+    @property
+    def leaf_idx(self) -> np.ndarray:
+        return np.nonzero(self.leaf)[0]
+
+    def build(self) -> None:
+        """
+        Builds the same tree as `QuadTree.build`, level by level, without creating quad objects
+        """
+        n_zones = self.template.n_zones
+        codes, centers = np.ones(1, dtype=np.uint64), self.center_point.reshape(1, 2)
+        size, depth = float(self.size), 0
+        counts, candidates = np.array([len(self.field)]), np.arange(len(self.field))
+        levels = []
+
+        while len(codes):
+            if depth > self.MAX_DEPTH:
+                raise RuntimeError(f"Quadtree deeper than {self.MAX_DEPTH} levels")
+            
+            n = len(codes)
+            boundary_zones, leaves, cell_idxs, zones = self.template.__zone_level__(centers, np.full(n, size), counts, candidates)
+
+            select = zones < n_zones
+            kept_counts = np.bincount(cell_idxs[select], minlength=n)
+            kept_idx, kept_zones = candidates[select], zones[select]
+            levels.append((codes, np.full(n, depth), leaves, boundary_zones, kept_counts, kept_idx, kept_zones))
+
+            split = np.nonzero(~leaves)[0]
+            kept_starts = np.cumsum(kept_counts) - kept_counts
+            size4 = (size/2.0)/2.0
+
+            codes = ((codes[split, None] << 2) | np.arange(4, dtype=np.uint64)).reshape(-1)
+            centers = (centers[split, None] + QuadTree.CHILD_OFFSETS*size4).reshape(-1, 2)
+            counts = np.repeat(kept_counts[split], 4)
+            candidates = kept_idx[__expand_ranges__(np.repeat(kept_starts[split], 4), counts)]
+            size, depth = size/2.0, depth + 1
+
+        codes, depths, leaves, boundary_zones, kept_counts, kept_idx, kept_zones = [np.concatenate(arrays) for arrays in zip(*levels)]
+        self.__set_nodes__(codes, depths, leaves, boundary_zones, kept_counts, kept_idx, kept_zones)
+
+    def __set_nodes__(self, codes:np.ndarray, depth:np.ndarray, leaf:np.ndarray, boundary_zone:np.ndarray, rgj_counts:np.ndarray, rgj_idx:np.ndarray, rgj_zones:np.ndarray) -> None:
+        self.codes = codes.astype(np.uint64)
+        self.depth = depth.astype(np.uint8)
+        self.leaf = leaf.astype(bool)
+        self.boundary_zone = boundary_zone.astype(np.int8)
+        self.boundary_max_range = self.template.ZONEToMaxRANGE[self.boundary_zone]
+        self.rgj_offsets = np.concatenate([[0], np.cumsum(rgj_counts)]).astype(np.int64)
+        self.rgj_idx = rgj_idx.astype(np.int32)
+        self.rgj_zones = rgj_zones.astype(np.int8)
+
+    def centers(self, idxs:Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Center points decoded from the locational codes
+        """
+        codes = self.codes if idxs is None else self.codes[idxs]
+        depth = (self.depth if idxs is None else self.depth[idxs]).astype(np.uint64)
+        centers = np.repeat(self.center_point.reshape(1, 2), len(codes), axis=0)
+
+        for level in range(1, int(depth.max(initial=0)) + 1):
+            active = depth >= level
+            digits = (codes[active] >> (2*(depth[active] - level))) & np.uint64(3)
+            centers[active] += QuadTree.CHILD_OFFSETS[digits.astype(int)]*((self.size/2.0**level)/2.0)
+
+        return centers
+
+    def sizes(self, idxs:Optional[np.ndarray] = None) -> np.ndarray:
+        depth = self.depth if idxs is None else self.depth[idxs]
+        return self.size/2.0**depth.astype(float)
+
+    def rgjs(self, idx:int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        RGJ indexes and zones of one node
+        """
+        select = slice(self.rgj_offsets[idx], self.rgj_offsets[idx + 1])
+        return self.rgj_idx[select], self.rgj_zones[select]
+
+    def children(self) -> np.ndarray:
+        """
+        Positions of the children (in QuadNode order) of every node, -1 if missing
+        """
+        children = -np.ones((len(self), 4), dtype=int)
+        parents = np.searchsorted(self.codes, self.codes[1:] >> np.uint64(2))
+        children[parents, (self.codes[1:] & np.uint64(3)).astype(int)] = np.arange(1, len(self))
+
+        return children
+
+    def get_quad_zones(self) -> np.ndarray:
+        return self.boundary_zone[self.leaf].astype(int)
+    
+    def get_quad_maximum_range(self) -> np.ndarray:
+        return self.boundary_max_range[self.leaf]
+
+    def to_quadtree(self) -> QuadTree:
+        tree = QuadTree(self.field,
+                        minimum_length_limit=self.template.min_sector_size,
+                        maximum_length_limit=self.template.max_sector_size,
+                        edge_bounds=self.template.edge_bounds,
+                        size=self.size,
+                        conservative=self.template.conservative)
+        
+        if len(self):
+            # plain arrays, as slicing memory-mapped ones per node is slow
+            tree.root, tree.leaves = __unflatten_quads__({
+                'center_point': self.centers(),
+                'size': self.sizes(),
+                'leaf': np.asarray(self.leaf),
+                'boundary_zone': np.asarray(self.boundary_zone),
+                'boundary_max_range': np.asarray(self.boundary_max_range),
+                'children': self.children(),
+                'rgj_offsets': np.asarray(self.rgj_offsets),
+                'rgj_idx': np.array(self.rgj_idx, dtype=int),
+                'rgj_zones': np.array(self.rgj_zones, dtype=int)
+            })
+
+        return tree
+    
+    @classmethod
+    def from_quadtree(cls, tree:QuadTree) -> LinearQuadTree:
+        linear = cls(tree.field,
+                     minimum_length_limit=tree.min_sector_size,
+                     maximum_length_limit=tree.max_sector_size,
+                     edge_bounds=tree.edge_bounds,
+                     size=tree.size,
+                     conservative=tree.conservative)
+        if tree.root is None:
+            return linear
+        
+        linear.center_point = np.array(tree.root.center_point, dtype=float)
+        data = __flatten_quads__(tree.root)
+        n = len(data['size'])
+
+        codes, depth = np.ones(n, dtype=np.uint64), np.zeros(n, dtype=int)
+        frontier = np.zeros(1, dtype=int)
+        while len(frontier):
+            children = data['children'][frontier]
+            valid = children >= 0
+            codes[children[valid]] = ((codes[frontier, None] << 2) | np.arange(4, dtype=np.uint64))[valid]
+            depth[children[valid]] = np.repeat(depth[frontier] + 1, 4).reshape(-1, 4)[valid]
+            frontier = children[valid]
+
+        order = np.argsort(codes, kind='stable')
+        counts = np.diff(data['rgj_offsets'])
+        select = __expand_ranges__(data['rgj_offsets'][:-1][order], counts[order])
+        linear.__set_nodes__(codes[order], depth[order], data['leaf'][order], data['boundary_zone'][order], counts[order], data['rgj_idx'][select], data['rgj_zones'][select])
+
+        return linear
+
 class QuadNode():
 
     chdToIdx = __list_to_dict__(['tl', 'tr', 'bl', 'br'])
@@ -255,6 +819,7 @@ class QuadNode():
         self.center_point = np.array(center_point)
         self.size = size
         self.leaf = False
+        self.unrefined = False # leaf that still needs subdividing (lazy builds)
         self.boundary_zone:int = 0
         self.boundary_max_range:float = 1.0
 
@@ -12,7 +12,7 @@ FieldSize = Tuple[int, int]
 Point = Union[Tuple[float, float], np.ndarray]
 RepulsionVectorsAndRef = Tuple[List[int], np.ndarray]
 
-RoutingAlgorithmStr = Literal['a*', 'dijkstra']
+RoutingAlgorithmStr = Literal['a*', 'dijkstra', 'a*-csr', 'dijkstra-csr', 'bidirectional-a*', 'alt']
 
 FieldScaleTransform = Callable[[float], float]
 
@@ -0,0 +1,41 @@
+import numpy as np
+import sys
+from typing import List, Optional, Tuple
+sys.path.append("../larp")
+import larp
+from larp.network import default_scale_transform
+
+"""
+Author: Josue N Rivera
+
+Setup shared by the tests: random point fields, their trees and networks
+"""
+
+def point_rgjs(rng:np.random.Generator, n:int = 30) -> List[dict]:
+    return [{'type': "Point", 'coordinates': center.tolist(), 'repulsion': [[25, 5], [5, 16]]} for center in rng.uniform(0, 200, (n, 2))]
+
+def point_field(seed:int, n:int = 30) -> Tuple[np.random.Generator, larp.PotentialField]:
+    """
+    Field of n random Point RGJs over [0, 200]^2, with the generator to draw the rest of the test from
+    """
+    rng = np.random.default_rng(seed)
+    return rng, larp.PotentialField(rgjs=point_rgjs(rng, n))
+
+def routing_network(field:larp.PotentialField, minimum_length_limit:float = 2, maximum_length_limit:float = 50, **kwargs) -> Tuple[larp.quad.QuadTree, larp.network.RoutingNetwork]:
+    quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=minimum_length_limit, maximum_length_limit=maximum_length_limit, build_tree=True, **kwargs)
+    return quadtree, larp.network.RoutingNetwork(quadtree=quadtree, build_network=True)
+
+def flatten(quad:Optional[larp.quad.QuadNode]) -> list:
+    """
+    Pre-order list of the quads' attributes, None for missing children, to compare whole trees
+    """
+    if quad is None:
+        return [None]
+
+    out = [(tuple(quad.center_point), quad.size, quad.leaf, quad.boundary_zone, tuple(quad.rgj_idx), tuple(quad.rgj_zones))]
+    for child in quad.children:
+        out.extend(flatten(child))
+    return out
+
+def route_cost(network:larp.network.RoutingNetwork, route:List[larp.quad.QuadNode], scale_tranform=default_scale_transform) -> float:
+    return sum(network.calculate_distance(a, b, scale_tranform=scale_tranform) for a, b in zip(route[:-1], route[1:]))
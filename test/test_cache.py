@@ -0,0 +1,74 @@
+import errno
+import numpy as np
+import os
+import sys
+import tempfile
+sys.path.append("../larp")
+import larp
+import larp.cache
+from .common import point_rgjs
+
+"""
+Author: Josue N Rivera
+"""
+
+def test_build_cache():
+    rgjs = point_rgjs(np.random.default_rng(15))
+    field = larp.PotentialField(rgjs=rgjs)
+
+    key = lambda quad: (tuple(quad.center_point), quad.size)
+    graph = lambda network: {key(quad): sorted(map(key, neighs)) for quad, neighs in network._graph.items()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = larp.cache.BuildCache(directory)
+        
+        built = cache.network(field, minimum_length_limit=4, maximum_length_limit=50)
+        assert cache.key(field, minimum_length_limit=4, maximum_length_limit=50) in cache, "Built network was not stored"
+
+        cached = cache.network(field, minimum_length_limit=4, maximum_length_limit=50)
+        assert graph(cached) == graph(built) and cached.quadtree.field is field, "Cached network differs from built network"
+        assert cached.quadtree.leaves == cached.quadtree.search_leaves(), "Cached tree is inconsistent"
+
+        tree = cache.quadtree(field, minimum_length_limit=4, maximum_length_limit=50)
+        assert set(map(key, tree.leaves)) == set(map(key, built.quadtree.leaves)), "Cached tree differs from built tree"
+        assert len(os.listdir(directory)) == 1, "Same build stored twice"
+
+        same_field = larp.PotentialField(rgjs=rgjs)
+        assert cache.key(same_field, minimum_length_limit=4, maximum_length_limit=50) == cache.key(field, minimum_length_limit=4, maximum_length_limit=50), "Key depends on more than content"
+        
+        keys = {cache.key(field, minimum_length_limit=4, maximum_length_limit=50),
+                cache.key(field, minimum_length_limit=2, maximum_length_limit=50),
+                cache.key(field, minimum_length_limit=4, maximum_length_limit=50, conservative=True),
+                cache.key(field, minimum_length_limit=4, maximum_length_limit=50, edge_bounds=[0.5]),
+                cache.key(larp.PotentialField(rgjs=rgjs[1:]), minimum_length_limit=4, maximum_length_limit=50)}
+        assert len(keys) == 5, "Key ignores a build input"
+
+        # another process storing the same key is not an error, anything else is
+        replace = larp.cache.os.replace
+        def racing(errno_code):
+            def move(source, target):
+                replace(source, target)
+                raise OSError(errno_code, os.strerror(errno_code))
+            return move
+
+        other = dict(minimum_length_limit=8, maximum_length_limit=50)
+        try:
+            larp.cache.os.replace = racing(errno.ENOTEMPTY)
+            cache.quadtree(field, **other)
+            assert cache.key(field, **other) in cache, "Raced entry missing"
+
+            larp.cache.os.replace = racing(errno.EACCES)
+            try:
+                cache.quadtree(field, minimum_length_limit=16, maximum_length_limit=50)
+                assert False, "Failed move was suppressed"
+            except PermissionError:
+                pass
+        finally:
+            larp.cache.os.replace = replace
+
+        open(os.path.join(directory, "stray.txt"), "w").close()
+        os.makedirs(os.path.join(directory, ".staging-leftover"))
+        cache.clear()
+        assert not os.listdir(directory), "Cache was not cleared"
+
+test_build_cache()
@@ -2,6 +2,7 @@ import numpy as np
 import sys
 sys.path.append("../larp")
 import larp
+from .common import flatten, point_field, routing_network
 
 """
 Author: Josue N Rivera
@@ -205,4 +206,44 @@ def test_remove_leaf_none_children():
 
     assert quadtree.search_leaves() == quadtree.leaves, "Leaves in list are different than those found by search"
 
-test_remove_leaf_none_children()
\ No newline at end of file
+test_remove_leaf_none_children()
+
+def test_remove_outer_merge_graph():
+    field = larp.PotentialField(size=200, center_point=[100, 100], rgjs=[{'type': "Point", 'coordinates': [40, 40], 'repulsion': [[25, 0], [0, 25]]}])
+    quadtree, network = routing_network(field)
+    
+    loader = larp.hl.HotLoader(field=field, quadtree=quadtree, network=network)
+    idx = loader.addRGJ(larp.PointRGJ((150, 150), repulsion=[[25, 0], [0, 25]]))
+    loader.removeRGJ(idx)
+
+    # quads merged first and then swallowed by the merge of their parent must not be linked back in
+    assert set(network._graph.keys()) == quadtree.leaves, "Network has nodes that are not leaves after removal"
+    assert all(neighs <= quadtree.leaves for neighs in network._graph.values()), "Network links quads that are not leaves after removal"
+
+test_remove_outer_merge_graph()
+
+def test_progressive_loader():
+    _, field = point_field(12)
+
+    quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=2, maximum_length_limit=50, build_tree=True)
+
+    loader = larp.hl.ProgressiveLoader(field, minimum_length_limit=2, maximum_length_limit=50, initial_depth=2, background=False)
+    coarse_tree, _ = loader.snapshot
+    assert loader.depth == 2 and not loader.complete, "Coarse build went past the initial depth"
+    assert loader.find_route((5, 10), (190, 180)) is not None, "No route on the coarse snapshot"
+    assert all(not quad.unrefined for quad in coarse_tree.leaves), "Snapshot has unrefined leaves"
+
+    loader = larp.hl.ProgressiveLoader(field, minimum_length_limit=2, maximum_length_limit=50, initial_depth=2)
+    early_tree = loader.quadtree
+    early_nodes = flatten(early_tree.root)
+    assert loader.wait(timeout=60), "Background refinement did not finish"
+    assert loader.version > 1 and loader.complete, "Refined snapshots were not published"
+    assert flatten(loader.quadtree.root) == flatten(quadtree.root), "Fully refined snapshot differs from the built tree"
+    assert loader.quadtree.leaves == loader.quadtree.search_leaves(), "Snapshot leaves differ from its tree"
+    assert flatten(early_tree.root) == early_nodes, "Published snapshot was modified"
+
+    budgeted = larp.hl.ProgressiveLoader(field, minimum_length_limit=2, maximum_length_limit=50, initial_depth=None, time_budget=30.0, background=False)
+    assert budgeted.complete, "Refinement stopped with budget left"
+    assert larp.hl.ProgressiveLoader(field, minimum_length_limit=2, maximum_length_limit=50, initial_depth=None, time_budget=0.0, background=False).depth == 0, "Refined past an exhausted budget"
+
+test_progressive_loader()
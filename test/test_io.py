@@ -1,8 +1,11 @@
 import numpy as np
+import os
 import sys
+import tempfile
 sys.path.append("../larp")
 import larp
 import larp.io as lpio
+from .common import flatten, point_field, point_rgjs, route_cost, routing_network
 
 """
 Author: Josue N Rivera
@@ -24,4 +27,121 @@ def test_load_quadtree():
     field = quadtree.field
     field.eval([[55.0, 55.0]])
 
-test_load_quadtree()
\ No newline at end of file
+test_load_quadtree()
+
+def test_quadtree_bundle():
+    rng = np.random.default_rng(13)
+    rgjs = point_rgjs(rng)
+    rgjs += [{'type': "Ellipse", 'coordinates': center.tolist(), 'shape': [[20, 0], [0, 10]], 'repulsion': [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (5, 2))]
+    rgjs += [{'type': "MultiLineString", 'coordinates': [[[20, 20], [30, 25], [35, 40]], [[150, 150], [160, 170]]], 'repulsion': [[9, 0], [0, 9]]},
+             {'type': "MultiEllipse", 'coordinates': [[60, 140], [90, 120]], 'shape': [[[5, 0], [0, 2]], [[3, 1], [1, 3]]], 'repulsion': [[9, 0], [0, 9]]},
+             {'type': "MultiRectangle", 'coordinates': [[[110, 10], [120, 20]], [[140, 40], [145, 48]]], 'repulsion': [[4, 0], [0, 4]]}]
+    field = larp.PotentialField(rgjs=rgjs)
+    quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=True, build_tree=True)
+    x = rng.uniform(0, 200, (200, 2))
+
+    with tempfile.TemporaryDirectory() as directory:
+        bundle = os.path.join(directory, "tree")
+        lpio.saveQuadTreeBundle(quadtree, bundle)
+
+        loaded = lpio.loadQuadTreeBundle(bundle)
+        assert flatten(loaded.root) == flatten(quadtree.root), "Bundle tree differs from saved tree"
+        assert loaded.leaves == loaded.search_leaves() and len(loaded.field) == len(field), "Bundle loaded incompletely"
+        assert loaded.conservative and loaded.min_sector_size == 4, "Bundle parameters differ"
+        assert np.array_equal(loaded.field.eval(x), field.eval(x)), "Bundle field differs"
+        assert not os.path.exists(os.path.join(bundle, "field.rgj")), "Field saved as RGeoJSON instead of arrays"
+
+        linear = lpio.loadQuadTreeBundle(bundle, linear=True)
+        assert isinstance(linear.codes, np.memmap) and not linear.codes.flags.writeable, "Bundle arrays are not memory-mapped"
+        assert flatten(linear.to_quadtree().root) == flatten(quadtree.root), "Linear bundle tree differs from saved tree"
+        del linear
+
+        collection = larp.PotentialField(rgjs=rgjs[:5] + [{'type': "GeometryCollection", 'geometries': rgjs[5:7]}])
+        lpio.saveQuadTreeBundle(larp.quad.QuadTree(field=collection, minimum_length_limit=8, maximum_length_limit=50, build_tree=True), bundle)
+        loaded = lpio.loadQuadTreeBundle(bundle, linear=True)
+        assert np.allclose(loaded.field.eval(x), collection.eval(x)), "Geometry collection field differs after the RGeoJSON fallback"
+        del loaded
+
+test_quadtree_bundle()
+
+def test_network_bundle():
+    _, field = point_field(14)
+    quadtree, network = routing_network(field, minimum_length_limit=4)
+
+    key = lambda quad: (tuple(quad.center_point), quad.size)
+    graph = {key(quad): sorted(map(key, neighs)) for quad, neighs in network._graph.items()}
+
+    with tempfile.TemporaryDirectory() as directory:
+        lpio.saveQuadTreeBundle(quadtree, directory)
+        lpio.saveRoutingNetwork(network, directory)
+
+        loaded = lpio.loadRoutingNetwork(directory)
+        assert {key(quad): sorted(map(key, neighs)) for quad, neighs in loaded._graph.items()} == graph, "Loaded network differs from saved network"
+        assert set(loaded._graph.keys()) <= loaded.quadtree.leaves, "Loaded network is not over the loaded tree's leaves"
+
+        route = loaded.find_route((5, 10), (190, 180))
+        assert np.isclose(route_cost(network, route), route_cost(network, network.find_route((5, 10), (190, 180)))), "Route on loaded network differs"
+
+        other = larp.quad.QuadTree(field=field, minimum_length_limit=8, maximum_length_limit=50, build_tree=True)
+        try:
+            lpio.loadRoutingNetwork(directory, quadtree=other)
+            assert False, "Network loaded onto a different tree"
+        except ValueError:
+            pass
+
+test_network_bundle()
+
+def test_landmarks_bundle():
+    _, field = point_field(15)
+    quadtree, network = routing_network(field, minimum_length_limit=4)
+    landmarks = network.build_landmarks(k=4)
+
+    key = lambda quad: (tuple(quad.center_point), quad.size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        lpio.saveQuadTreeBundle(quadtree, directory)
+        lpio.saveRoutingNetwork(network, directory)
+        lpio.saveLandmarks(network, directory)
+
+        loaded = lpio.loadRoutingNetwork(directory)
+        loaded_landmarks = lpio.loadLandmarks(directory, loaded)
+        assert loaded.landmarks is loaded_landmarks and sorted(map(key, loaded_landmarks.nodes)) == sorted(map(key, landmarks.nodes)), "Loaded landmarks differ"
+
+        end_node = network.quadtree.find_quads(np.array([[190, 180]]))[0]
+        loaded_end = loaded.quadtree.find_quads(np.array([[190, 180]]))[0]
+        potential = landmarks.potential(network.compiled.ids[end_node])
+        loaded_potential = loaded_landmarks.potential(loaded.compiled.ids[loaded_end])
+        assert np.allclose(sorted(potential), sorted(loaded_potential)), "Loaded landmark bounds differ"
+
+        route = loaded.find_route((5, 10), (190, 180), alg='ALT')
+        assert np.isclose(route_cost(network, route), route_cost(network, network.find_route((5, 10), (190, 180), alg='Dijkstra'))), "ALT route on loaded network differs"
+
+        edited = larp.network.RoutingNetwork.from_csr(loaded.quadtree, *loaded.to_csr())
+        node = next(iter(edited._graph))
+        edited._graph[node].discard(next(iter(edited._graph[node])))
+        for other in [edited, larp.network.RoutingNetwork.from_csr(loaded.quadtree, *loaded.to_csr(), directed=True)]:
+            try:
+                lpio.loadLandmarks(directory, other)
+                assert False, "Landmarks loaded onto a network with different edges"
+            except ValueError:
+                pass
+
+        loaded.invalidate()
+        try:
+            lpio.saveLandmarks(loaded, directory)
+            assert False, "Stale landmarks saved"
+        except ValueError:
+            pass
+
+        codes = np.load(os.path.join(directory, "landmarks_codes.npy"))
+        np.save(os.path.join(directory, "landmarks_codes.npy"), np.append(codes, codes.max() + 1))
+        for name in ["landmarks_from.npy", "landmarks_to.npy", "landmarks_multipliers.npy"]:
+            table = np.load(os.path.join(directory, name))
+            np.save(os.path.join(directory, name), np.concatenate([table, table[..., :1]], axis=-1))
+        try:
+            lpio.loadLandmarks(directory, loaded)
+            assert False, "Landmarks with extra quads loaded"
+        except ValueError:
+            pass
+
+test_landmarks_bundle()
@@ -1,7 +1,9 @@
 import numpy as np
 import sys
+import warnings
 sys.path.append("../larp")
 import larp
+from .common import point_field, route_cost, routing_network
 
 """
 Author: Josue N Rivera
@@ -32,5 +34,227 @@ def test_quad_on_simple_pf():
     route_path = larp.network.RoutingNetwork.route_to_lines_collection((45, 45), (60, 65), route=route, remapped=True)
     
     
+def test_lazy_refinement():
+    _, field = point_field(11)
+    quadtree, network = routing_network(field)
+
+    for alg in ['A*', 'Dijkstra']:
+        lazy_quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=2, maximum_length_limit=50)
+        lazy_quadtree.build(lazy_depth=2)
+        lazy_network = larp.network.RoutingNetwork(quadtree=lazy_quadtree, build_network=True)
+
+        short_route = lazy_network.find_route((40, 40), (60, 45), alg=alg)
+        assert len(lazy_quadtree.leaves) < len(quadtree.leaves), "Short lazy route refined the whole tree"
+        assert np.isclose(route_cost(network, short_route), route_cost(network, network.find_route((40, 40), (60, 45), alg=alg))), "Lazy route costs more than eager route"
+
+        route = lazy_network.find_route((5, 10), (190, 180), alg=alg)
+        assert np.isclose(route_cost(network, route), route_cost(network, network.find_route((5, 10), (190, 180), alg=alg))), "Lazy route costs more than eager route"
+        assert all(not quad.unrefined for quad in route), "Route passes through unrefined quads"
+
+    while any(quad.unrefined for quad in lazy_quadtree.leaves):
+        for quad in [quad for quad in lazy_quadtree.leaves if quad.unrefined]:
+            lazy_network.refine(quad)
+
+    key = lambda quad: (tuple(quad.center_point), quad.size)
+    graph = {key(quad): sorted(map(key, neighs)) for quad, neighs in network._graph.items()}
+    lazy_graph = {key(quad): sorted(map(key, neighs)) for quad, neighs in lazy_network._graph.items()}
+    assert graph == lazy_graph, "Fully refined lazy network differs from eager network"
+
+    lazy_quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=2, maximum_length_limit=50)
+    lazy_quadtree.build(lazy_depth=2)
+    lazy_network = larp.network.RoutingNetwork(quadtree=lazy_quadtree, build_network=True)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        for _ in range(2):
+            route = lazy_network.find_route((5, 10), (190, 180), alg='A*-CSR')
+    assert np.isclose(route_cost(network, route), route_cost(network, network.find_route((5, 10), (190, 180)))), "Compiled search on a lazy tree costs more"
+    assert len([warning for warning in caught if issubclass(warning.category, RuntimeWarning)]) == 1, "Graph fallback not warned exactly once"
+
+    rebuilds, build_locator = [], lazy_quadtree.__build_locator__
+    lazy_quadtree.__build_locator__ = lambda: rebuilds.append(True) or build_locator()
+    starts = np.stack([np.linspace(5, 195, 10), np.full(10, 20.0)], 1)
+    routes = [lazy_network.find_route(start, (200 - start[0], 180)) for start in starts]
+    assert not rebuilds, "Single point lookups rebuilt the leaf locator"
+    assert [route[0] for route in routes] == lazy_quadtree.locate(starts, return_quads=True)[1], "Descended start quads differ from the locator"
+
+    try:
+        lazy_quadtree.build(lazy_depth=2, workers=2)
+        assert False, "Lazy build accepted parallel workers"
+    except ValueError:
+        pass
+
+def test_compiled_routing():
+    rng, field = point_field(16)
+
+    quadtree, network = routing_network(field)
+
+    compiled = network.compiled
+    assert len(compiled) == len(quadtree.leaves) and compiled.indptr[-1] == sum(len(neighs) for neighs in network._graph.values()), "Compiled network size differs"
+    assert network.compiled is compiled, "Network compiled twice without changes"
+
+    stepped = lambda x: 1.0 if x < 0.5 else 3.0 # not vectorizable
+    for pointA, pointB in zip(rng.uniform(0, 200, (5, 2)), rng.uniform(0, 200, (5, 2))):
+        reference = network.find_route(pointA, pointB, alg='Dijkstra')
+        route = network.find_route(pointA, pointB, alg='A*-CSR')
+
+        assert route[0] is reference[0] and route[-1] is reference[-1], "Compiled route has different ends"
+        assert route_cost(network, route) <= route_cost(network, reference) + 1e-9, "Compiled A* route costs more than Dijkstra"
+        assert np.isclose(route_cost(network, route), route_cost(network, network.find_route(pointA, pointB, alg='Dijkstra-CSR'))), "Compiled A* and Dijkstra costs differ"
+        assert np.isclose(route_cost(network, network.find_route(pointA, pointB, scale_tranform=stepped, alg='A*-CSR'), stepped), 
+                          route_cost(network, network.find_route(pointA, pointB, scale_tranform=stepped, alg='Dijkstra-CSR'), stepped)), "Compiled costs differ with a scalar transform"
+
+    loader = larp.hl.HotLoader(field=field, quadtree=quadtree, network=network)
+    loader.addRGJ(larp.PointRGJ((100, 100), repulsion=[[10, 0], [0, 10]]))
+    assert network.compiled is not compiled and len(network.compiled) == len(quadtree.leaves), "Compiled network not refreshed after edit"
+
+def test_open_set_optimality():
+    rng, field = point_field(17, 40)
+
+    quadtree, network = routing_network(field)
+
+    compare = larp.quad.QuadNode.__lt__
+    def fail(self, other):
+        raise AssertionError("Open set compared quads")
+    larp.quad.QuadNode.__lt__ = fail
+
+    try:
+        for pointA, pointB in zip(rng.uniform(0, 200, (8, 2)), rng.uniform(0, 200, (8, 2))):
+            optimal = route_cost(network, network.find_route(pointA, pointB, alg='Dijkstra-CSR'))
+            assert np.isclose(route_cost(network, network.find_route(pointA, pointB, alg='A*')), optimal), "A* route is not optimal"
+            assert np.isclose(route_cost(network, network.find_route(pointA, pointB, alg='Dijkstra')), optimal), "Dijkstra route is not optimal"
+    finally:
+        larp.quad.QuadNode.__lt__ = compare
+
+def test_weight_tables():
+    rng, field = point_field(18)
+
+    quadtree, network = routing_network(field)
+
+    linear, squared = (lambda x: 1.0 + x), (lambda x: 1.0 + x**2)
+    weights = network.edge_weights(linear)
+    assert network.edge_weights(linear) is weights, "Edge weights recomputed for a cached cost model"
+    assert not np.shares_memory(network.edge_weights(linear, penalty=5.0), weights), "Penalty not part of the cost model key"
+
+    network.WEIGHT_TABLES = 2
+    network.edge_weights(squared)
+    assert network.edge_weights(linear) is not weights, "Least recently used table not evicted"
+    assert network.edge_weights() is network.edge_weights(linear) is network.edge_weights(lambda x: 1.0 + x), "Same cost model got its own table"
+    network.find_route((5, 10), (190, 180), alg='A*-CSR')
+    network.build_landmarks(k=2)
+    assert network.edge_weights(as_list=True) is network.edge_weights(lambda x: 1.0 + x, as_list=True), "Entry points keep separate tables"
+
+    def check():
+        compiled = network.compiled
+        assert len(compiled) == len(quadtree.leaves), "Patched network has stale nodes"
+        for scale_tranform in [linear, squared]:
+            weights = network.edge_weights(scale_tranform)
+            for node, idx in compiled.ids.items():
+                edges = range(compiled.indptr[idx], compiled.indptr[idx + 1])
+                assert {compiled.nodes[compiled.indices[edge]] for edge in edges} == network._graph[node], "Patched adjacency differs"
+                for edge in edges:
+                    expected = network.calculate_distance(node, compiled.nodes[compiled.indices[edge]], scale_tranform=scale_tranform)
+                    assert np.isclose(weights[edge], expected), "Patched edge weight differs"
+
+    loader = larp.hl.HotLoader(field=field, quadtree=quadtree, network=network)
+    compiled = network.compiled
+    idx = loader.addRGJ(larp.PointRGJ((100, 100), repulsion=[[10, 0], [0, 10]]))
+    check()
+    assert network.compiled.indptr is not compiled.indptr and network.compiled.nodes[:len(compiled.nodes)] != compiled.nodes, "Edit not patched"
+
+    loader.removeRGJ(idx)
+    check()
+
+    for pointA, pointB in zip(rng.uniform(0, 200, (5, 2)), rng.uniform(0, 200, (5, 2))):
+        route, reference = network.find_route(pointA, pointB, alg='A*-CSR'), network.find_route(pointA, pointB, alg='Dijkstra')
+        costs = [route_cost(network, path) for path in [route, reference]]
+        assert np.isclose(costs[0], costs[1]), "Route over patched weights differs"
+
+def test_bidirectional_A_star():
+    rng, field = point_field(19, 40)
+
+    quadtree, network = routing_network(field)
+
+    pointsA, pointsB = rng.uniform(0, 200, (8, 2)), rng.uniform(0, 200, (8, 2))
+    for route, reference in zip(network.find_many_routes(pointsA, pointsB, alg='Bidirectional-A*'), network.find_many_routes(pointsA, pointsB, alg='A*')):
+        assert route[0] is reference[0] and route[-1] is reference[-1], "Bidirectional route has different ends"
+        assert all(network.is_connected(a, b) for a, b in zip(route[:-1], route[1:])), "Bidirectional route is not connected"
+        assert np.isclose(route_cost(network, route), route_cost(network, reference)), "Bidirectional A* cost differs from A*"
+
+    # one-way edges, so the backward search must walk the reversed adjacency
+    directed = larp.network.RoutingNetwork.from_csr(quadtree, *network.to_csr(), directed=True)
+    for node in rng.choice(list(directed._graph.keys()), 300, replace=False):
+        neighs = sorted(directed._graph[node], key=lambda neigh: tuple(neigh.center_point))
+        directed._graph[node].discard(neighs[0])
+    directed.invalidate()
+
+    for pointA, pointB in zip(pointsA, pointsB):
+        route = directed.find_route(pointA, pointB, alg='Bidirectional-A*')
+        reference = directed.find_route(pointA, pointB, alg='Dijkstra-CSR')
+        if reference is None:
+            assert route is None, "Bidirectional A* found a path to an unreachable quad"
+            continue
+        assert all(directed.is_connected(a, b) for a, b in zip(route[:-1], route[1:])), "Bidirectional route uses a reversed one-way edge"
+        assert np.isclose(route_cost(directed, route), route_cost(directed, reference)), "Bidirectional A* cost differs on a directed network"
+
+    quad = network.quadtree.find_quads(pointsA[:1])[0]
+    assert network.find_path(quad, quad, alg='Bidirectional-A*') == [quad], "Route to the same quad is not trivial"
+
+    lazy_quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=2, maximum_length_limit=50)
+    lazy_quadtree.build(lazy_depth=2)
+    lazy_network = larp.network.RoutingNetwork(quadtree=lazy_quadtree, build_network=True)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        route = lazy_network.find_route(pointsA[0], pointsB[0], alg='Bidirectional-A*')
+    assert np.isclose(route_cost(lazy_network, route), route_cost(network, network.find_route(pointsA[0], pointsB[0]))), "Bidirectional A* on a lazy tree costs more"
+    assert any(issubclass(warning.category, RuntimeWarning) for warning in caught), "Graph fallback not warned"
+
+def test_alt_landmarks():
+    rng, field = point_field(20, 40)
+
+    quadtree, network = routing_network(field)
+
+    try:
+        network.repair_landmarks()
+        assert False, "Landmarks repaired before being built"
+    except ValueError:
+        pass
+    landmarks = network.build_landmarks(k=4)
+    assert len(landmarks) == 4 and len(set(landmarks.ids.tolist())) == 4, "Landmarks not picked"
+
+    # bounds never exceed the true cost to the end
+    compiled = network.compiled
+    end = compiled.ids[quadtree.find_quads(np.array([[150, 40]]))[0]]
+    exact = compiled.distances(end, network.edge_weights(as_list=True, reverse=True), reverse=True)
+    assert (landmarks.potential(end) <= exact + 1e-9).all(), "Landmark bound is not admissible"
+    assert (landmarks.potential(end, start=0) <= exact + 1e-9).all(), "Active landmark bound is not admissible"
+    heuristic = landmarks.heuristic(end, start=0)
+    assert np.allclose([heuristic(idx) for idx in range(len(compiled.nodes))], landmarks.potential(end, start=0)), "Per-node bound differs from the landmark potential"
+
+    stepped = lambda x: 1.0 if x < 0.5 else 3.0
+    pointsA, pointsB = rng.uniform(0, 200, (6, 2)), rng.uniform(0, 200, (6, 2))
+    def check():
+        for pointA, pointB in zip(pointsA, pointsB):
+            route = network.find_route(pointA, pointB, alg='ALT')
+            assert np.isclose(route_cost(network, route), route_cost(network, network.find_route(pointA, pointB, alg='Dijkstra-CSR'))), "ALT cost differs from Dijkstra"
+            route = network.find_route(pointA, pointB, scale_tranform=stepped, alg='ALT') # other cost model, landmarks unused
+            assert np.isclose(route_cost(network, route, stepped), route_cost(network, network.find_route(pointA, pointB, scale_tranform=stepped, alg='Dijkstra-CSR'), stepped)), "ALT cost differs under another model"
+    check()
+
+    loader = larp.hl.HotLoader(field=field, quadtree=quadtree, network=network)
+    loader.addRGJ(larp.PointRGJ((100, 100), repulsion=[[30, 0], [0, 30]]))
+    assert network.landmarks.stale, "Landmarks not flagged stale after an edit"
+    check()
+
+    repaired = network.repair_landmarks()
+    assert not repaired.stale and repaired.compiled is network.compiled and len(repaired) == 4, "Landmarks not repaired"
+    assert set(repaired.nodes) >= {node for node in landmarks.nodes if node in network.compiled.ids}, "Repair moved landmarks still in the network"
+    check()
+
 if __name__ == "__main__":
-    test_quad_on_simple_pf()
\ No newline at end of file
+    test_quad_on_simple_pf()
+    test_lazy_refinement()
+    test_compiled_routing()
+    test_open_set_optimality()
+    test_weight_tables()
+    test_bidirectional_A_star()
+    test_alt_landmarks()
@@ -1,8 +1,11 @@
 import json
+import math
 import numpy as np
+import warnings
 import sys
 sys.path.append("../larp")
 import larp
+from .common import point_rgjs
 
 """
 Author: Josue N Rivera
@@ -61,6 +64,37 @@ def test_area_estimation():
 
     area = field.estimate_route_area([(49, 50), (51, 50)], step=0.0001, scale_transform=lambda x: 1/(1.0 - x + 0.000001))
 
+def test_adaptive_area_estimation():
+    rgjs = [
+        {
+            "type": "Point",
+            "coordinates": [50, 50], 
+            "repulsion": [[1, 0], [0, 1]]
+        },
+        {
+            "type": "LineString",
+            "coordinates": [[20, 80], [30, 90]], 
+            "repulsion": [[4, 0], [0, 4]]
+        }
+    ]
+
+    field = larp.PotentialField(size=(100, 100), rgjs=rgjs)
+    area, error = field.integrate_route_area([(49, 50), (51, 50)], atol=1e-9, return_error=True)
+    assert abs(area - np.sqrt(np.pi)*math.erf(1.0)) < 1e-8 and error < 1e-8, "Adaptive area estimation off"
+
+    route = [(0, 50), (100, 50), (20, 85), (0, 0)]
+    area = field.estimate_route_area(route, adaptive=True, atol=1e-8)
+    assert abs(area - field.estimate_route_area(route, step=1e-3)) < 1e-2, "Adaptive area differs from fixed step estimate"
+    assert abs(field.integrate_route_area(route, rtol=1e-10, atol=0.0) - area) < 1e-6, "Relative tolerance estimate differs"
+
+    # segments far from every RGJ start as a single panel
+    assert field.integrate_route_area([(-1e4, -1e4), (-1e4, 1e4)], atol=1e-9) < 1e-12, "Far segment picked up potential"
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        field.integrate_route_area(route, atol=1e-14, max_depth=2)
+    assert any("max_depth" in str(warning.message) for warning in caught), "Unconverged integration not reported"
+
 def test_gradient():
     rgjs = [
         {
@@ -127,7 +161,221 @@ def test_bbox():
     assert field.find_bbox([81, 80])[0] == 3, "Error finding bbox for ellipse"
     assert field.find_bbox([15, 15])[0] == 1, "Error finding bbox for linestring"
 
+def test_index_culling():
+    rng = np.random.default_rng(0)
+    rgjs = []
+    for idx, center in enumerate(rng.uniform(0, 500, (60, 2))):
+        if idx % 3 == 0:
+            rgjs.append({"type": "Point", "coordinates": center.tolist(), "repulsion": [[25, 5], [5, 16]]})
+        elif idx % 3 == 1:
+            rgjs.append({"type": "LineString", "coordinates": (center + rng.uniform(-20, 20, (4, 2))).tolist(), "repulsion": [[9, 0], [0, 9]]})
+        else:
+            rgjs.append({"type": "Ellipse", "coordinates": center.tolist(), "shape": [[9, 2], [2, 4]], "repulsion": [[9, 0], [0, 9]]})
+
+    field = larp.PotentialField(rgjs=rgjs)
+    x = rng.uniform(0, 500, (1000, 2))
+    expected_eval = field.eval(x)
+    expected_dist = field.squared_dist(x)
+    repeated = [3, 7, 3]
+    expected_list = field.squared_dist_list(x, filted_idx=repeated)
+
+    field.enable_index(tolerance=1e-8)
+    assert np.abs(field.eval(x) - expected_eval).max() < 1e-8, "Indexed evaluation error larger than tolerance"
+
+    near = expected_dist <= -np.log(1e-8)
+    assert (field.squared_dist(x)[near] == expected_dist[near]).all(), "Indexed squared distance differs within the influence radius"
+
+    indexed_list = field.squared_dist_list(x, filted_idx=repeated)
+    near = expected_list <= -np.log(1e-8)
+    assert (indexed_list[near] == expected_list[near]).all() and (indexed_list[:, 0] == indexed_list[:, 2]).all(), "Repeated RGJ ids left columns unfilled"
+
+    culled = field.repulsion_vectors(x, filted_idx=repeated).reshape(len(repeated), len(x), 2)
+    assert (culled[0] == culled[2]).all() and np.isfinite(culled[2]).any(), "Repeated RGJ ids left rows unfilled"
+
+    field.delRGJ([0, 4])
+    field.addRGJ(rgjs[0])
+    reference = larp.PotentialField(rgjs=[rgj for idx, rgj in enumerate(rgjs) if idx not in [0, 4]] + [rgjs[0]])
+
+    assert len(field.index) == len(field), "Index out of sync with field"
+    assert np.abs(field.eval(x) - reference.eval(x)).max() < 1e-8, "Index out of sync after adding and deleting RGJs"
+
+def test_compiled_field():
+    rng = np.random.default_rng(1)
+    rgjs = point_rgjs(rng, 20)
+    rgjs += [{"type": "Point", "coordinates": center.tolist(), "repulsion": [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (20, 2))]
+    rgjs += [{"type": "Rectangle", "coordinates": [center.tolist(), (center + 5).tolist()], "repulsion": [[9, 0], [0, 4]]} for center in rng.uniform(0, 200, (10, 2))]
+    rgjs += [{"type": "Ellipse", "coordinates": center.tolist(), "shape": [[9, 2], [2, 4]], "repulsion": [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (10, 2))]
+    rgjs += [{"type": "LineString", "coordinates": [[10, 10], [10, 20], [20, 20]], "repulsion": [[2, 0], [0, 2]]}]
+
+    field = larp.PotentialField(rgjs=rgjs)
+    compiled = field.compile()
+    x = rng.uniform(0, 200, (500, 2))
+
+    dists, idxs = field.squared_dist(x, reference_idx=True)
+    compiled_dists, compiled_idxs = compiled.squared_dist(x, reference_idx=True)
+
+    assert np.abs(compiled.eval(x) - field.eval(x)).max() < 1e-10, "Compiled evaluation differs from field"
+    assert np.abs(compiled_dists - dists).max() < 1e-8, "Compiled squared distance differs from field"
+    assert (compiled_idxs == idxs).all(), "Compiled reference indexes differ from field"
+    assert np.abs(compiled.gradient(x) - field.gradient(x)).max() < 1e-10, "Compiled gradient differs from field"
+
+    field.delRGJ([0, 45])
+    assert field.compile() is not compiled, "Compiled field not invalidated after the field changed"
+    assert np.abs(compiled.eval(x) - field.eval(x)).max() < 1e-10, "Stale compiled field not rebuilt"
+
+def test_tolerance():
+    rng = np.random.default_rng(3)
+    rgjs = [{"type": "Point", "coordinates": center.tolist(), "repulsion": [[25, 5], [5, 16]]} for center in rng.uniform(0, 1000, (80, 2))]
+    rgjs += [{"type": "LineString", "coordinates": (center + rng.uniform(-20, 20, (4, 2))).tolist(), "repulsion": [[9, 0], [0, 9]]} for center in rng.uniform(0, 1000, (20, 2))]
+
+    field = larp.PotentialField(rgjs=rgjs)
+    truncated = larp.PotentialField(rgjs=rgjs, tolerance=1e-6)
+    x = rng.uniform(0, 1000, (500, 2))
+    idxs = rng.integers(0, len(rgjs), len(x))
+
+    assert truncated.tolerance == 1e-6 and truncated.index is not None, "Tolerance did not enable the index"
+    assert np.abs(truncated.eval(x) - field.eval(x)).max() <= 1e-6, "Truncated evaluation error above tolerance"
+    assert np.abs(truncated.eval_per(x, idxs) - field.eval_per(x, idxs)).max() <= 1e-6, "Truncated per-rgj evaluation error above tolerance"
+    gradient_bound = 4e-6*np.sqrt(-np.log(1e-6))/min(rgj.length_scale() for rgj in field.rgjs)
+    assert np.abs(truncated.gradient(x) - field.gradient(x)).max() <= gradient_bound, "Truncated gradient error above its bound"
+    assert np.abs(truncated.to_image(resolution=50) - field.to_image(resolution=50)).max() <= 1e-6, "Truncated image error above tolerance"
+
+    far = np.array([[-5000.0, -5000.0]])
+    assert truncated.eval(far)[0] == 0.0 and (truncated.gradient(far) == 0.0).all(), "Points outside every influence box should be exactly zero"
+
+    truncated.tolerance = None
+    assert truncated.index is None, "Removing the tolerance did not disable the index"
+
+def test_eval_gradient():
+    rgjs = [
+        {
+            "type": "Point",
+            "coordinates": [50, 50], 
+            "repulsion": [[1, 0], [0, 1]]
+        },
+        {
+            "type": "LineString",
+            "coordinates": [[10, 10], [10, 20], [20, 20], [20, 10]], 
+            "repulsion": [[2, 0], [0, 2]]
+        },
+        {
+            "type": "GeometryCollection",
+            "geometries": [
+                {"type": "Rectangle", "coordinates": [[30, 30], [25, 25]], "repulsion": [[1, 0], [0, 1]]},
+                {"type": "Ellipse", "coordinates": [80, 80], "repulsion": [[4, 0], [0, 4]], "shape": [[2, 0], [0, 2]]}
+            ]
+        }
+    ]
+
+    field = larp.PotentialField(size=(100, 100), rgjs=rgjs)
+    x = np.array([(49, 50), (51, 51), (11, 10), (20, 11), (32, 31), (81, 82)])
+
+    evals, grads, idxs = field.eval_gradient(x, reference_idx=True)
+    _, expected_idxs = field.squared_dist(x, reference_idx=True)
+
+    assert np.abs(evals - field.eval(x)).max() < 1e-12, "Fused potential differs from evaluation"
+    assert (idxs == expected_idxs).all(), "Fused owner indexes differ from squared distance reference"
+    assert ((grads[0] - np.array([2*np.exp(-1), 0]))**2).sum() < 1e-5, "Unexpected fused gradient"
+    for idx in range(len(x)):
+        assert np.abs(grads[idx] - field.rgjs[idxs[idx]].gradient(x[idx:idx+1])[0]).max() < 1e-12, "Fused gradient differs from owner gradient"
+
+    line = field.rgjs[1]
+    per_element = line.gradient(x, min_dist_select=False)
+    assert per_element.shape == (3, len(x), 2), "Per-element gradients not returned"
+    try:
+        line.eval_gradient(x, min_dist_select=False)
+        assert False, "Fused evaluation accepted min_dist_select=False"
+    except ValueError:
+        pass
+
+    points = larp.PotentialField(size=(100, 100), rgjs=rgjs[:1] + [{"type": "Point", "coordinates": [20, 60], "repulsion": [[9, 0], [0, 9]]}])
+    assert np.abs(points.gradient(x, min_dist_select=False) - points.gradient(x)).max() < 1e-12, "Per-element field gradient differs for points"
+
+    sub_evals, _, sub_idxs = field.rgjs[2].eval_gradient(x[4:], reference_idx=True)
+    assert (sub_idxs == [0, 1]).all(), "Unexpected owner in geometry collection"
+    assert np.abs(sub_evals - field.rgjs[2].eval(x[4:])).max() < 1e-12, "Fused potential differs in geometry collection"
+
+def test_score_routes():
+    rng = np.random.default_rng(4)
+    rgjs = point_rgjs(rng)
+    rgjs += [{"type": "LineString", "coordinates": (center + rng.uniform(-20, 20, (3, 2))).tolist(), "repulsion": [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (5, 2))]
+    field = larp.PotentialField(rgjs=rgjs)
+
+    routes = [center + np.cumsum(rng.uniform(-15, 15, (4, 2)), axis=0) for center in rng.uniform(0, 200, (12, 2))]
+    routes.append(np.array([[1.0, 1.0]]))
+
+    areas, peaks = field.score_routes(routes, step=0.5)
+    for route, area, peak in zip(routes[:-1], areas, peaks):
+        assert np.isclose(area, field.estimate_route_area(route, step=0.5)), "Batch route area does not match single route estimate"
+        assert np.isclose(peak, field.estimate_route_highest_potential(route, step=0.5)), "Batch highest potential does not match single route estimate"
+    assert areas[-1] == 0.0 and np.isnan(peaks[-1]), "Route without samples should score zero area and nan peak"
+
+    points, offsets = larp.fn.ragged_routes(routes)
+    culled_areas, culled_peaks = field.score_routes(points, offsets, step=0.5, tolerance=1e-9)
+    assert np.abs(culled_areas - areas).max() < 1e-6, "Culled route areas error unexpectedly large"
+    assert np.nanmax(np.abs(culled_peaks - peaks)) <= 1e-9, "Culled highest potential error above tolerance"
+
+def test_route_highest_potential():
+    rng = np.random.default_rng(6)
+    rgjs = point_rgjs(rng)
+    rgjs += [{"type": "Rectangle", "coordinates": [center.tolist(), (center + 10).tolist()], "repulsion": [[4, 0], [0, 4]]} for center in rng.uniform(0, 200, (5, 2))]
+    rgjs += [{"type": "Ellipse", "coordinates": center.tolist(), "shape": [[5, 1], [0, 3]], "repulsion": [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (5, 2))]
+
+    field = larp.PotentialField(rgjs=rgjs)
+    indexed = larp.PotentialField(rgjs=rgjs, tolerance=1e-12)
+    route = np.cumsum(rng.uniform(-20, 20, (8, 2)), axis=0) + 100
+
+    peak = field.route_highest_potential(route)
+    sampled = field.estimate_route_highest_potential(route, step=1e-2)
+    assert sampled <= peak + 1e-12 and peak - sampled < 1e-3, "Exact highest potential differs from sampled estimate"
+    assert abs(indexed.estimate_route_highest_potential(route, exact=True) - peak) < 1e-12, "Culled highest potential differs"
+
+    far = [[-5000.0, -5000.0], [-4000.0, -5000.0]]
+    assert indexed.route_highest_potential(far) == 0.0, "Route outside every influence box should have zero potential"
+
+    try:
+        field.route_highest_potential(np.zeros((0, 2)))
+        assert False, "Empty route accepted"
+    except ValueError:
+        pass
+
+def test_bulk_rgjs():
+    rng = np.random.default_rng(7)
+    rgjs = point_rgjs(rng, 40)
+    rgjs += [{"type": "MultiRectangle", "coordinates": [[center.tolist(), (center + 10).tolist()], [(center - 30).tolist(), (center - 20).tolist()]], "repulsion": [[4, 0], [0, 4]]} for center in rng.uniform(0, 200, (5, 2))]
+
+    field = larp.PotentialField(rgjs=rgjs[:10], tolerance=1e-9)
+    for rgj in rgjs[10:20]:
+        field.addRGJ(rgj)
+    assert (field.addRGJs(rgjs[20:]) == np.arange(20, len(rgjs))).all(), "Bulk add returned unexpected indexes"
+
+    full = larp.PotentialField(rgjs=rgjs)
+    assert np.allclose(field.bbox, full.bbox) and np.allclose(field.center_point, full.center_point), "Incremental bounding box differs from bulk load"
+
+    field.delRGJs([0, 5, 42])
+    full.delRGJ([0, 5, 42])
+    expected = larp.PotentialField(rgjs=[rgj for idx, rgj in enumerate(rgjs) if idx not in (0, 5, 42)])
+    assert len(field) == len(rgjs) - 3 and np.allclose(field.rgj_bboxes, expected.rgj_bboxes), "Bulk delete left unexpected boxes"
+    assert np.allclose(field.bbox, expected.bbox) and np.allclose(full.bbox, expected.bbox), "Bounding box not updated after delete"
+
+    x = rng.uniform(-50, 250, (300, 2))
+    assert np.abs(field.eval(x) - expected.eval(x)).max() <= 1e-9, "Index out of sync after bulk changes"
+
+    try:
+        field.addRGJs([rgjs[0], {"type": "Unknown", "coordinates": [0, 0]}])
+        raise AssertionError("Unknown RGJ type accepted")
+    except ValueError:
+        assert len(field) == len(rgjs) - 3, "Failed bulk add modified the field"
+
 test_eval()
 test_area_estimation()
+test_adaptive_area_estimation()
 test_gradient()
-test_bbox()
\ No newline at end of file
+test_bbox()
+test_index_culling()
+test_compiled_field()
+test_tolerance()
+test_eval_gradient()
+test_score_routes()
+test_route_highest_potential()
+test_bulk_rgjs()
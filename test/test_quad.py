@@ -2,6 +2,7 @@ import numpy as np
 import sys
 sys.path.append("../larp")
 import larp
+from .common import flatten, point_field, point_rgjs
 
 """
 Author: Josue N Rivera
@@ -114,3 +115,79 @@ def test_leaf_none_children():
     assert quadtree.search_leaves() == quadtree.leaves, "Leaves in list are different than those found by search"
 
 test_leaf_none_children()
+
+def test_breadth_first_build():
+    rng = np.random.default_rng(8)
+    rgjs = point_rgjs(rng, 40)
+    rgjs += [{'type': "LineString", 'coordinates': (center + rng.uniform(-20, 20, (3, 2))).tolist(), 'repulsion': [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (10, 2))]
+    rgjs += [{'type': "Rectangle", 'coordinates': [center.tolist(), (center + 10).tolist()], 'repulsion': [[16, 0], [0, 16]]} for center in rng.uniform(0, 200, (10, 2))]
+
+    field = larp.PotentialField(rgjs=rgjs)
+
+    for conservative in [False, True]:
+        recursive = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=conservative)
+        recursive.build(breadth_first=False)
+        level = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=conservative)
+        level.build(breadth_first=True)
+
+        assert flatten(recursive.root) == flatten(level.root), "Breadth-first tree differs from recursive tree"
+        assert len(recursive.leaves) == len(level.leaves) and level.leaves == level.search_leaves(), "Breadth-first leaves differ"
+
+        parallel = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=conservative)
+        parallel.build(workers=2, split_depth=2)
+
+        assert flatten(recursive.root) == flatten(parallel.root), "Parallel tree differs from recursive tree"
+        assert len(recursive.leaves) == len(parallel.leaves) and parallel.leaves == parallel.search_leaves(), "Parallel leaves differ"
+
+test_breadth_first_build()
+
+def test_linear_quadtree():
+    rng = np.random.default_rng(9)
+    rgjs = point_rgjs(rng, 40)
+    rgjs += [{'type': "Ellipse", 'coordinates': center.tolist(), 'shape': [[20, 0], [0, 10]], 'repulsion': [[9, 0], [0, 9]]} for center in rng.uniform(0, 200, (5, 2))]
+
+    field = larp.PotentialField(rgjs=rgjs)
+
+    quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=True)
+    quadtree.build()
+    linear = larp.quad.LinearQuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50, conservative=True, build_tree=True)
+
+    assert len(linear) == len(flatten(quadtree.root)) - flatten(quadtree.root).count(None), "Linear tree has a different number of nodes"
+    assert (np.diff(linear.codes.astype(float)) > 0).all(), "Locational codes are not sorted"
+    assert flatten(linear.to_quadtree().root) == flatten(quadtree.root), "Linear tree differs from QuadTree"
+
+    converted = larp.quad.LinearQuadTree.from_quadtree(quadtree)
+    for key in ['codes', 'depth', 'leaf', 'boundary_zone', 'rgj_offsets', 'rgj_idx', 'rgj_zones']:
+        assert np.array_equal(getattr(converted, key), getattr(linear, key)), f"Converted {key} differs from built {key}"
+
+    leaf_centers = sorted(map(tuple, linear.centers(linear.leaf_idx)))
+    assert leaf_centers == sorted(tuple(quad.center_point) for quad in quadtree.leaves), "Decoded leaf centers differ"
+
+test_linear_quadtree()
+
+def test_locate():
+    rng, field = point_field(10)
+    quadtree = larp.quad.QuadTree(field=field, minimum_length_limit=4, maximum_length_limit=50)
+    quadtree.build()
+
+    def descend(x:np.ndarray, quad:larp.quad.QuadNode):
+        while not quad.leaf:
+            direction = x - quad.center_point
+            quad = quad[("t" if direction[1] >= 0.0 else "b") + ("r" if direction[0] >= 0.0 else "l")]
+        return quad
+
+    centers = np.array([quad.center_point for quad in quadtree.leaves])
+    sizes = np.array([quad.size for quad in quadtree.leaves])[:, None]
+    points = np.concatenate([rng.uniform(-50, 250, (2000, 2)), centers, centers - sizes/2.0, centers + sizes/2.0])
+
+    ids, quads = quadtree.locate(points, return_quads=True)
+    assert all(quad is descend(x, quadtree.root) for x, quad in zip(points, quads)), "Located quads differ from tree descent"
+    assert (ids >= 0).all() and len(np.unique(ids)) == len(quadtree.leaves), "Leaf ids do not cover the leaves"
+    assert np.array_equal(quadtree.locate(points), ids), "Leaf ids depend on return_quads"
+    assert quadtree.find_quads(points[:10]) == quads[:10], "find_quads differs from locate"
+
+    quadtree.reset_locator()
+    assert quadtree.find_quads(points[:10]) == quads[:10] and quadtree._QuadTree__locator is None, "Few points rebuilt a stale locator"
+    assert quadtree.find_quads(points) == quads, "find_quads differs from locate after a rebuild"
+
+test_locate()
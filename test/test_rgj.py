@@ -194,4 +194,96 @@ def test_geometry_collection_rgj():
     assert ((grads[2] - np.array([0.0]*2))**2).sum() < 1e-5, "Unexpected gradient vector"
     assert ((grads[3] - grad_line)**2).sum() < 1e-5, "Unexpected gradient vector"
 
-test_geometry_collection_rgj()
\ No newline at end of file
+test_geometry_collection_rgj()
+
+def test_batched_kernels_match_per_element():
+
+    rng = np.random.default_rng(0)
+    x = rng.uniform(-5, 5, (200, 2))
+
+    rgjs = [
+        larp.LineStringRGJ(coordinates=rng.uniform(-5, 5, (30, 2)), repulsion=[[2, 0.3], [0.3, 1]]),
+        larp.MultiLineStringRGJ(coordinates=[rng.uniform(-5, 5, (5, 2)), rng.uniform(-5, 5, (7, 2))], repulsion=np.eye(2)),
+        larp.MultiRectangleRGJ(coordinates=rng.uniform(-5, 5, (10, 2, 2)), repulsion=[[2, 0], [0, 1]]),
+        larp.MultiEllipseRGJ(coordinates=rng.uniform(-5, 5, (10, 2)), shape=np.array([np.eye(2)*0.5]*10), repulsion=np.eye(2))
+    ]
+
+    for rgj in rgjs:
+        expected = rgj.repulsion_vector(x, batched=False)
+
+        assert (rgj.repulsion_vector(x) == expected).all(), f"Batched kernel of {rgj.RGJType} differs from per-element path"
+        assert (rgj.repulsion_vector(x, max_batch_bytes=512) == expected).all(), f"Chunked kernel of {rgj.RGJType} differs from per-element path"
+        assert (rgj.repulsion_vector(x, min_dist_select=False) == rgj.repulsion_vector(x, min_dist_select=False, batched=False)).all(), \
+            f"Unselected batched vectors of {rgj.RGJType} differ from per-element path"
+
+test_batched_kernels_match_per_element()
+
+def test_multi_point_indexed_rgj():
+
+    rng = np.random.default_rng(2)
+    rgj = larp.MultiPointRGJ(coordinates=rng.uniform(0, 100, (600, 2)), repulsion=[[4, 1], [1, 2]])
+    x = rng.uniform(-10, 110, (300, 2))
+
+    brute = rgj.repulsion_vector(x, indexed=False)
+    indexed = rgj.repulsion_vector(x, indexed=True)
+
+    assert (rgj.squared_dist(x) == ((brute@rgj.inv_repulsion)*brute).sum(1)).all(), "Default multi point squared distance differs from brute force"
+    assert np.abs(indexed - brute).max() < 1e-10, "Indexed nearest point differs from brute force under the repulsion metric"
+
+    rgj.set_repulsion([[1, 0], [0, 9]])
+    assert np.abs(rgj.repulsion_vector(x, indexed=True) - rgj.repulsion_vector(x, indexed=False)).max() < 1e-10, "Multi point index not rebuilt after repulsion change"
+
+    # clustered points fill a few buckets of a uniform grid, the tree stays balanced
+    clustered = np.concatenate([rng.normal(center, 0.05, (400, 2)) for center in rng.uniform(0, 100, (4, 2))])
+    rgj = larp.MultiPointRGJ(coordinates=clustered, repulsion=[[4, 1], [1, 2]])
+    x = np.concatenate([rng.normal(center, 0.1, (200, 2)) for center in clustered[::400]] + [rng.uniform(-10, 110, (200, 2))])
+    assert np.abs(rgj.repulsion_vector(x) - rgj.repulsion_vector(x, indexed=False)).max() < 1e-10, "Indexed nearest point differs on clustered points"
+
+    index = larp.index.PointTreeIndex(clustered)
+    assert np.diff(index.__bounds__(index.depth)).max() <= index.BUCKET_SIZE, "Tree buckets overflow on clustered points"
+
+test_multi_point_indexed_rgj()
+
+def test_segment_squared_dist():
+
+    rng = np.random.default_rng(5)
+    repulsion = [[25, 5], [5, 16]]
+
+    rgjs = [
+        larp.PointRGJ(coordinates=[3, 4], repulsion=repulsion),
+        larp.MultiPointRGJ(coordinates=rng.uniform(0, 20, (30, 2)), repulsion=repulsion),
+        larp.LineStringRGJ(coordinates=rng.uniform(0, 20, (5, 2)), repulsion=repulsion),
+        larp.MultiLineStringRGJ(coordinates=[rng.uniform(0, 20, (3, 2)), rng.uniform(0, 20, (4, 2))], repulsion=repulsion),
+        larp.RectangleRGJ(coordinates=[[8, 5], [2, 3]], repulsion=repulsion),
+        larp.MultiRectangleRGJ(coordinates=[[[2, 3], [8, 5]], [[12, 13], [10, 18]]], repulsion=repulsion),
+        larp.EllipseRGJ(coordinates=[5, 5], shape=np.array([[3, 1], [0, 2]]), repulsion=repulsion),
+        larp.MultiEllipseRGJ(coordinates=[[5, 5], [15, 12]], shape=np.array([[[3, 1], [0, 2]], [[1, 0], [0, 4]]]), repulsion=repulsion)
+    ]
+
+    a, b = rng.uniform(-20, 40, (20, 2)), rng.uniform(-20, 40, (20, 2))
+    a[0] = b[0]
+    t = np.linspace(0, 1, 5001).reshape(-1, 1)
+
+    for rgj in rgjs:
+        dists = rgj.segment_squared_dist(a, b)
+        sampled = np.array([rgj.squared_dist(start + t*(end - start)).min() for start, end in zip(a, b)])
+
+        assert (dists <= sampled + 1e-12).all(), f"Segment distance of {rgj.RGJType} above a sampled distance"
+        assert (sampled - dists).max() < 1e-2, f"Segment distance of {rgj.RGJType} far below sampled distances"
+
+test_segment_squared_dist()
+
+def test_shared_repulsion():
+
+    first = larp.PointRGJ(coordinates=[0, 0], repulsion=[[4, 1], [1, 2]])
+    second = larp.LineStringRGJ(coordinates=[[0, 0], [1, 1]], repulsion=[[4, 1], [1, 2]])
+
+    assert first.inv_repulsion is second.inv_repulsion and first.grad_matrix is second.grad_matrix, "Equal repulsions are not shared"
+    assert not first.inv_repulsion.flags.writeable, "Shared repulsion matrices should be read-only"
+    assert np.allclose(first.inv_repulsion, np.linalg.inv([[4, 1], [1, 2]])), "Unexpected inverse repulsion"
+    assert not hasattr(first, "__dict__") and not hasattr(second, "__dict__"), "RGJs should be slotted"
+
+    second.set_repulsion([[1, 0], [0, 1]])
+    assert np.allclose(first.repulsion, [[4, 1], [1, 2]]) and np.allclose(second.repulsion, np.eye(2)), "Changing a repulsion affected another RGJ"
+
+test_shared_repulsion()